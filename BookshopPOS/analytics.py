@@ -0,0 +1,216 @@
+from array import array
+from datetime import date
+from timekeys import SECONDS_PER_DAY, day_from_epoch, epoch_day
+
+# --- OPTIONAL: NUMPY (vectorized group-bys; plain Python otherwise) ---
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DAILY_DAYS = 30
+WEEKLY_WEEKS = 12
+MONTHLY_MONTHS = 12
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# Day 0 (1970-01-01) was a Thursday; weeks start on Monday
+EPOCH_WEEKDAY = 3
+HEATMAP_SLOTS = 7 * 24
+
+def window_start(today):
+    """First day (epoch day) any chart needs: the 1st of the month MONTHLY_MONTHS - 1 months back."""
+    d = day_from_epoch(today)
+    months = d.year * 12 + d.month - 1 - (MONTHLY_MONTHS - 1)
+    return epoch_day(date(months // 12, months % 12 + 1, 1))
+
+def week_of(day):
+    return (day + EPOCH_WEEKDAY) // 7
+
+def pct(part, whole):
+    return round(100.0 * part / whole, 1) if whole else 0.0
+
+# ==========================================
+# COLUMN STORE
+# ==========================================
+class SalesColumns:
+    """
+    Sales held column-wise: one typed array each for ts, amount, profit,
+    a payment-method code and a count. A row is either one sale (count 1)
+    or totals already added up for `count` sales, such as an hourly rollup
+    cell. Appends are O(1), and summarize() groups the whole store in a few
+    passes: NumPy bincounts when it is installed, or a single plain Python
+    loop without it. Everything after the per-day grouping works on at most
+    a year of day totals, not on rows.
+    """
+    def __init__(self):
+        self.ts = array('q')
+        self.amount = array('d')
+        self.profit = array('d')
+        self.method = array('i')
+        self.count = array('q')
+        self.methods = []       # code -> payment method
+        self.method_codes = {}  # payment method -> code
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, ts, amount, profit, method, count=1):
+        code = self.method_codes.get(method)
+        if code is None:
+            code = self.method_codes[method] = len(self.methods)
+            self.methods.append(method)
+        self.ts.append(ts)
+        self.amount.append(amount)
+        self.profit.append(profit)
+        self.method.append(code)
+        self.count.append(count)
+
+    def extend(self, rows):
+        """Appends (ts, amount, profit, method[, count]) rows."""
+        for row in rows:
+            self.append(*row)
+
+    # --- Group-bys ---
+    def group(self, since):
+        """
+        Totals over the sales on day `since` or later, as plain lists:
+        (first_day, revenue, profit and count per day from first_day on,
+        revenue and count per method code, count per weekday/hour slot).
+        """
+        if np is not None:
+            return self.group_numpy(since)
+        return self.group_python(since)
+
+    def group_numpy(self, since):
+        methods = len(self.methods)
+        # One key per (hour of the window, method). Row 0 collects everything
+        # before the window and is dropped, so nothing is filtered sale by sale.
+        key = np.frombuffer(self.ts, dtype=np.int64) // 3600
+        key -= since * 24 - 1
+        np.maximum(key, 0, out=key)
+        key *= methods
+        key += np.frombuffer(self.method, dtype=np.intc)
+        days = -(-(int(key.max()) // methods) // 24)
+        if not days:
+            return None
+        size = (days * 24 + 1) * methods
+
+        def by_day_hour_method(weights=None):
+            return np.bincount(key, weights=weights, minlength=size)[methods:].reshape(days, 24, methods)
+        revenue = by_day_hour_method(np.frombuffer(self.amount, dtype=np.float64))
+        profit = by_day_hour_method(np.frombuffer(self.profit, dtype=np.float64))
+        count = by_day_hour_method(np.frombuffer(self.count, dtype=np.int64)).astype(np.int64)
+
+        per_hour = count.sum(axis=2)
+        heat = np.zeros((7, 24), dtype=np.int64)
+        for offset in range(min(7, days)):
+            heat[(since + offset + EPOCH_WEEKDAY) % 7] = per_hour[offset::7].sum(axis=0)
+        return (since,
+                revenue.sum(axis=(1, 2)).tolist(),
+                profit.sum(axis=(1, 2)).tolist(),
+                per_hour.sum(axis=1).tolist(),
+                revenue.sum(axis=(0, 1)).tolist(),
+                count.sum(axis=(0, 1)).tolist(),
+                heat.ravel().tolist())
+
+    def group_python(self, since):
+        days = {}  # day -> [revenue, profit, count]
+        m_revenue = [0.0] * len(self.methods)
+        m_count = [0] * len(self.methods)
+        heat = [0] * HEATMAP_SLOTS
+        for ts, amount, profit, code, n in zip(self.ts, self.amount, self.profit, self.method, self.count):
+            day, secs = divmod(ts, SECONDS_PER_DAY)
+            if day < since:
+                continue
+            totals = days.get(day)
+            if totals is None:
+                totals = days[day] = [0.0, 0.0, 0]
+            totals[0] += amount
+            totals[1] += profit
+            totals[2] += n
+            m_revenue[code] += amount
+            m_count[code] += n
+            heat[(day + EPOCH_WEEKDAY) % 7 * 24 + secs // 3600] += n
+        if not days:
+            return None
+        first = min(days)
+        zero = (0.0, 0.0, 0)
+        per_day = [days.get(d, zero) for d in range(first, max(days) + 1)]
+        return (first,
+                [t[0] for t in per_day], [t[1] for t in per_day], [t[2] for t in per_day],
+                m_revenue, m_count, heat)
+
+    # --- Chart data ---
+    def summarize(self, today):
+        """
+        Chart data up to day `today` (an epoch day): daily, weekly and monthly
+        revenue with profit margins, the payment mix by revenue, and a
+        weekday x hour heatmap of transactions, all since window_start(today).
+        """
+        since = window_start(today)
+        grouped = self.group(since) if len(self) else None
+        if grouped is None:
+            grouped = (today, [], [], [], [0.0] * len(self.methods), [0] * len(self.methods), [0] * HEATMAP_SLOTS)
+        first, revenue, profit, count, m_revenue, m_count, heat = grouped
+
+        def totals(day):
+            i = day - first
+            if 0 <= i < len(revenue):
+                return revenue[i], profit[i], count[i]
+            return 0.0, 0.0, 0
+
+        daily = list(range(today - DAILY_DAYS + 1, today + 1))
+        daily_totals = [totals(day) for day in daily]
+
+        # Weeks and months are folded from the day totals
+        weeks = list(range(week_of(today) - WEEKLY_WEEKS + 1, week_of(today) + 1))
+        week_totals = {w: [0.0, 0.0] for w in weeks}
+        d = day_from_epoch(today)
+        months = [(m // 12, m % 12 + 1) for m in range(d.year * 12 + d.month - MONTHLY_MONTHS, d.year * 12 + d.month)]
+        month_totals = {m: [0.0, 0.0] for m in months}
+        for day in range(max(first, since), today + 1):
+            r, p, _ = totals(day)
+            if not r and not p:
+                continue
+            w = week_totals.get(week_of(day))
+            if w:
+                w[0] += r
+                w[1] += p
+            d = day_from_epoch(day)
+            m = month_totals[(d.year, d.month)]
+            m[0] += r
+            m[1] += p
+
+        mix = sorted(range(len(self.methods)), key=lambda c: -m_revenue[c])
+        mix = [c for c in mix if m_count[c]]
+        return {
+            'daily_revenue': {
+                'labels': [day_from_epoch(day).strftime('%d %b') for day in daily],
+                'data': [round(r, 2) for r, _, _ in daily_totals],
+                'margin': [pct(p, r) for r, p, _ in daily_totals],
+                'transactions': [n for _, _, n in daily_totals]
+            },
+            'weekly_revenue': {
+                'labels': [day_from_epoch(w * 7 - EPOCH_WEEKDAY).strftime('%d %b') for w in weeks],
+                'data': [round(week_totals[w][0], 2) for w in weeks],
+                'margin': [pct(week_totals[w][1], week_totals[w][0]) for w in weeks]
+            },
+            'monthly_revenue': {
+                'labels': [date(y, m, 1).strftime('%b %Y') for y, m in months],
+                'data': [round(month_totals[m][0], 2) for m in months],
+                'profit': [round(month_totals[m][1], 2) for m in months],
+                'margin': [pct(month_totals[m][1], month_totals[m][0]) for m in months]
+            },
+            'payment_mix': {
+                'labels': [self.methods[c] for c in mix],
+                'data': [round(m_revenue[c], 2) for c in mix],
+                'transactions': [m_count[c] for c in mix]
+            },
+            'hourly_heatmap': {
+                'days': list(WEEKDAYS),
+                'data': [heat[i * 24:(i + 1) * 24] for i in range(7)]
+            },
+            'margin': pct(sum(profit), sum(revenue))
+        }
@@ -0,0 +1,356 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import analytics
+import db
+import fake_firebase
+from cloud_sync import FirebaseSync, generate_push_id
+from core import ROLLUP_VERSION, Cart, CheckoutService, InventoryService, ReportingService, SyncService, hourly_cell
+from timekeys import SECONDS_PER_DAY, epoch_day, local_epoch
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DEFAULT_PRODUCTS = 100000
+DEFAULT_SALES = 200000
+# Sales mirrored into the fake Firebase for the dashboard benchmarks
+DEFAULT_CLOUD_SALES = 20000
+# Sales in the dashboard analytics store (the database's history, repeated as needed)
+DEFAULT_ANALYTICS_SALES = 1000000
+HISTORY_DAYS = 365
+INSERT_CHUNK = 50000
+
+PAYMENT_METHODS = ("Cash", "M-Pesa", "Card")
+CATEGORIES = ("Fiction", "Science", "History", "Children", "Religion", "Reference", "Stationery", "Exam Prep")
+WORDS = ("river", "shadow", "garden", "mountain", "lion", "journey", "secret", "kingdom", "rain", "market",
+         "teacher", "ocean", "fire", "harvest", "village", "letter", "bridge", "star", "forest", "song")
+AUTHORS = ("Achebe", "Ngugi", "Adichie", "Okri", "Mwangi", "Ogot", "Wainaina", "Soyinka", "Head", "Emecheta")
+
+# ==========================================
+# SYNTHETIC DATA
+# ==========================================
+def product_rows(n, rng):
+    for i in range(n):
+        title = ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 4)))
+        price = round(rng.uniform(100, 3000), -1)
+        yield (f"978{i:010d}", f"{title} {i}", rng.choice(AUTHORS), rng.choice(CATEGORIES), "Book",
+               price, round(price * 0.6, 2), rng.randint(50, 500), "2024-01-01")
+
+def generate(conn, products, sales, seed=1):
+    """Fills an empty database with `products` products and `sales` sales spread over HISTORY_DAYS."""
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    rows = list(product_rows(products, rng))
+    cur.executemany("""
+        INSERT INTO products (sku, title, author_supplier, category, product_type, price, cost_price, stock, date_added)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    cur.execute("INSERT INTO stock_counters (sku, terminal, inc, dec) SELECT sku, 'base', stock, 0 FROM products")
+    catalogue = [(r[0], r[1], r[5], r[6]) for r in rows]
+    conn.commit()
+
+    start = datetime.now() - timedelta(days=HISTORY_DAYS)
+    span = HISTORY_DAYS * 86400
+    offsets = sorted(rng.randrange(span) for _ in range(sales))
+    sale_id = cur.execute("SELECT COALESCE(max(id), 0) FROM sales").fetchone()[0]
+    for chunk in range(0, sales, INSERT_CHUNK):
+        sale_rows, item_rows = [], []
+        for off in offsets[chunk:chunk + INSERT_CHUNK]:
+            sale_id += 1
+            when = start + timedelta(seconds=off)
+            sale_date, sale_ts = when.strftime('%Y-%m-%d %H:%M:%S'), local_epoch(when)
+            sale_day = sale_ts // SECONDS_PER_DAY
+            total = profit = 0.0
+            for sku, title, price, cost in rng.sample(catalogue, rng.randint(1, 3)):
+                qty = rng.randint(1, 2)
+                item_rows.append((sale_id, sku, title, qty, price, cost, sale_date, sale_day))
+                total += price * qty
+                profit += (price - cost) * qty
+            sale_rows.append((sale_id, sale_date, sale_ts, sale_day, total, 0.0, profit, rng.choice(PAYMENT_METHODS)))
+        cur.executemany("INSERT INTO sales (id, sale_date, sale_ts, sale_day, total_amount, discount, total_profit, payment_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sale_rows)
+        cur.executemany("INSERT INTO sale_items (sale_id, sku, title, qty, price, cost, sale_date, sale_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", item_rows)
+        conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+
+def cloud_tree(conn, cloud_sales, seed=2):
+    """A Firebase tree for the catalogue in `conn` plus `cloud_sales` recent sales and matching rollups."""
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    products = {sku: {"sku": sku, "title": title, "author_supplier": author, "category": cat, "product_type": ptype,
+                      "price": price, "cost_price": cost, "date_added": added, "updated_at": now_ms,
+                      "counters": {"base": {"inc": stock, "dec": 0}}}
+                for sku, title, author, cat, ptype, price, cost, stock, added in
+                conn.execute("SELECT sku, title, author_supplier, category, product_type, price, cost_price, stock, date_added FROM products")}
+
+    sales, daily, hourly, methods = {}, {}, {}, {}
+    total = 0.0
+    now = datetime.now()
+    for i in range(cloud_sales):
+        ts = now - timedelta(seconds=(cloud_sales - i) * 60)
+        day = ts.strftime('%Y-%m-%d')
+        amount = round(rng.uniform(100, 6000), -1)
+        method = rng.choice(PAYMENT_METHODS)
+        sales[generate_push_id()] = {"sale_id": i + 1, "timestamp": ts.strftime('%Y-%m-%dT%H:%M:%S'), "day": day,
+                                     "ts": local_epoch(ts), "epoch_day": epoch_day(ts), "rollup_version": ROLLUP_VERSION,
+                                     "total_amount": amount, "discount": 0.0, "profit": amount * 0.4,
+                                     "payment_method": method, "user": "bench",
+                                     "items": [{"sku": "9780000000000", "title": "Bench", "qty": 1, "price": amount}]}
+        d = daily.setdefault(day, {"total_amount": 0.0, "transactions": 0, "revision": 0})
+        d["total_amount"] += amount
+        d["transactions"] += 1
+        d["revision"] += 1
+        node = hourly
+        for part in hourly_cell(local_epoch(ts), method).split('/')[1:]:
+            node = node.setdefault(part, {})
+        node["total_amount"] = node.get("total_amount", 0.0) + amount
+        node["profit"] = node.get("profit", 0.0) + amount * 0.4
+        node["transactions"] = node.get("transactions", 0) + 1
+        methods[method] = methods.get(method, 0) + 1
+        total += amount
+    return {
+        "products": products,
+        "meta": {"products_updated_at": now_ms},
+        "sales": sales,
+        "rollups": {"all_time": {"total_amount": total, "transactions": cloud_sales, "methods": methods},
+                    "daily": daily, "hourly": hourly,
+                    "meta": {"bootstrapped": True, "epochs_backfilled": True, "hourly_backfilled": True}},
+    }
+
+# ==========================================
+# TIMING
+# ==========================================
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(ms[len(ms) // 2], 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "min_ms": round(ms[0], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+def measure(func, repeat, setup=None):
+    samples = []
+    for i in range(repeat):
+        if setup: setup(i)
+        t = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t)
+    return summarize(samples)
+
+# ==========================================
+# BENCHMARKS
+# ==========================================
+def bench_search(inventory, repeat, rng):
+    skus = [r[0] for r in inventory.cursor.execute("SELECT sku FROM products ORDER BY random() LIMIT 200")]
+    queries = {
+        "search_exact_sku": lambda: rng.choice(skus),
+        "search_sku_prefix": lambda: rng.choice(skus)[:9],
+        "search_title_word": lambda: rng.choice(WORDS),
+        "search_two_prefixes": lambda: f"{rng.choice(WORDS)[:3]} {rng.choice(WORDS)[:3]}",
+        "search_author": lambda: rng.choice(AUTHORS),
+        "search_no_match": lambda: "zzqx",
+    }
+    results = {}
+    for name, make_query in queries.items():
+        query = []
+        results[name] = measure(lambda: inventory.search(query.pop()), repeat,
+                                setup=lambda i, q=make_query: query.append(q()))
+    return results
+
+def bench_checkout(conn, checkout, repeat, rng):
+    catalogue = conn.execute("SELECT sku, title, price, cost_price FROM products WHERE stock > 10 ORDER BY random() LIMIT 1000").fetchall()
+    def sale():
+        cart = Cart()
+        for sku, title, price, cost in rng.sample(catalogue, rng.randint(1, 5)):
+            cart.add(sku, title, price, cost, 10)
+        return cart.checkout(cart.total, rng.choice(PAYMENT_METHODS), 'bench')
+    pending = []
+    return {"checkout_commit_sale": measure(lambda: checkout.commit_sale(conn, pending.pop()), repeat,
+                                            setup=lambda i: pending.append(sale()))}
+
+def bench_reports(reports, repeat):
+    """The Reports tab refresh: period totals, all-time totals, payment mix and recent sales."""
+    today = datetime.now().date()
+    periods = {"today": today, "this_week": today - timedelta(days=today.weekday()), "this_month": today.replace(day=1)}
+    results = {}
+    for name, start in periods.items():
+        def report(start=epoch_day(start), end=epoch_day(today)):
+            reports.totals(start, end)
+            reports.totals()
+            reports.payment_mix(start, end)
+            reports.recent_sales()
+        results[f"report_{name}"] = measure(report, repeat)
+    return results
+
+def bench_sync(sync, server, path, repeat):
+    """Full catalogue download into an empty till, then no-op and small-delta syncs."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+    conn = db.connect(path)
+    try:
+        results = {"sync_full_catalogue": measure(lambda: sync.pull_products(conn), 1)}
+        results["sync_unchanged"] = measure(lambda: sync.pull_products(conn), repeat)
+
+        database = server.RequestHandlerClass.database
+        skus = list((database.get('products') or {}).keys())
+        def touch(i):
+            now_ms = int(time.time() * 1000)
+            database.patch('', {**{f"products/{sku}/counters/bench/dec": i + 1 for sku in skus[i * 100:(i + 1) * 100]},
+                                **{f"products/{sku}/updated_at": now_ms for sku in skus[i * 100:(i + 1) * 100]},
+                                "meta/products_updated_at": now_ms})
+            time.sleep(0.002)  # the next change must get a later server timestamp
+        results["sync_delta_100"] = measure(lambda: sync.pull_products(conn), min(repeat, max(len(skus) // 100, 1)), setup=touch)
+        return results
+    finally:
+        conn.close()
+
+def bench_dashboard(server_url, repeat):
+    """
+    The web dashboard, through the Firebase Admin SDK's emulator mode, against
+    the fake server. Its cache files go to a directory of its own, never the
+    DASHBOARD_CACHE_DIR of a live dashboard on the same host.
+    """
+    os.environ['FIREBASE_DATABASE_EMULATOR_HOST'] = server_url.split('://', 1)[1]
+    os.environ.pop('FIREBASE_CREDENTIALS_JSON', None)
+    cache_dir = tempfile.mkdtemp(prefix='bookshop-bench-')
+    os.environ['DASHBOARD_CACHE_DIR'] = cache_dir
+    try:
+        import web_dashboard
+    except ImportError as e:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return {"dashboard_skipped": str(e)}
+    try:
+        return run_dashboard(web_dashboard, repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def run_dashboard(web_dashboard, repeat):
+    """Times the dashboard routes; see bench_dashboard."""
+    client = web_dashboard.app.test_client()
+    aggregate = web_dashboard.sales_aggregate
+    cache = web_dashboard.dashboard_cache
+
+    def cold():
+        aggregate.loaded = aggregate.migrated = False
+        aggregate.hourly = {}
+        aggregate.payload_cache = None
+        for path in (cache.path, aggregate.hourly_path):
+            if os.path.exists(path): os.remove(path)
+    def expire(i):
+        # Backdate the shared payload so the next request rebuilds it
+        if os.path.exists(cache.path): os.utime(cache.path, (0, 0))
+
+    results = {"dashboard_cold_load": measure(lambda: client.get('/api/dashboard'), max(repeat // 10, 1), setup=lambda i: cold())}
+    results["dashboard_refresh"] = measure(lambda: client.get('/api/dashboard'), repeat, setup=expire)
+    results["dashboard_cached"] = measure(lambda: client.get('/api/dashboard'), repeat)
+    etag = client.get('/api/dashboard').headers.get('ETag')
+    results["dashboard_not_modified"] = measure(lambda: client.get('/api/dashboard', headers={'If-None-Match': etag}), repeat)
+    results["stats"] = measure(lambda: client.get('/api/stats'), repeat, setup=expire)
+    results["charts"] = measure(lambda: client.get('/api/charts'), repeat, setup=expire)
+    results["recent_sales"] = measure(lambda: client.get('/api/sales'), repeat)
+    results["metrics_scrape"] = measure(lambda: client.get('/metrics'), repeat)
+    results["dashboard_payload_bytes"] = len(client.get('/api/dashboard').data)
+    return results
+
+def bench_analytics(conn, sales, repeat):
+    """The dashboard's chart summary over a columnar store of `sales` sales."""
+    today = epoch_day(datetime.now())
+    rows = conn.execute("SELECT sale_ts, total_amount, total_profit, payment_method FROM sales WHERE sale_ts >= ?",
+                        (analytics.window_start(today) * SECONDS_PER_DAY,)).fetchall()
+    columns = analytics.SalesColumns()
+    columns.extend(itertools.islice(itertools.cycle(rows), sales if rows else 0))
+    return {"analytics_backend": "numpy" if analytics.np else "array",
+            "analytics_sales": len(columns),
+            "analytics_summarize": measure(lambda: columns.summarize(today), max(repeat // 10, 1))}
+
+# ==========================================
+# RUNNER
+# ==========================================
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+SUITES = ("search", "checkout", "reports", "sync", "dashboard", "analytics")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the POS and web dashboard hot paths")
+    parser.add_argument('--db', default='bench.db', help="benchmark database (created if missing)")
+    parser.add_argument('--products', type=int, default=DEFAULT_PRODUCTS)
+    parser.add_argument('--sales', type=int, default=DEFAULT_SALES)
+    parser.add_argument('--cloud-sales', type=int, default=DEFAULT_CLOUD_SALES)
+    parser.add_argument('--analytics-sales', type=int, default=DEFAULT_ANALYTICS_SALES)
+    parser.add_argument('--repeat', type=int, default=200, help="iterations per measurement")
+    parser.add_argument('--only', default=','.join(SUITES), help="comma-separated subset of: " + ', '.join(SUITES))
+    parser.add_argument('--regenerate', action='store_true', help="rebuild the database even if it exists")
+    parser.add_argument('--out', default='bench_results.json')
+    args = parser.parse_args()
+    suites = [s.strip() for s in args.only.split(',') if s.strip()]
+
+    if args.regenerate:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix): os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    os.environ['BOOKSHOP_TERMINAL'] = 'bench'
+    conn = db.get_connection()
+
+    report = {"meta": {
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "args": vars(args),
+    }, "results": {}}
+
+    if not conn.execute("SELECT 1 FROM products LIMIT 1").fetchone():
+        print(f"⏳ Generating {args.products:,} products and {args.sales:,} sales in {args.db}...")
+        t = time.perf_counter()
+        generate(conn, args.products, args.sales)
+        report["meta"]["generate_seconds"] = round(time.perf_counter() - t, 2)
+    report["meta"]["products"] = conn.execute("SELECT count(*) FROM products").fetchone()[0]
+    report["meta"]["sales"] = conn.execute("SELECT count(*) FROM sales").fetchone()[0]
+
+    server, url = fake_firebase.start_server(data=cloud_tree(conn, args.cloud_sales))
+    cloud = FirebaseSync(url, db_path=args.db, terminal='bench')
+    rng = random.Random(3)
+    results = report["results"]
+
+    if "search" in suites:
+        results.update(bench_search(InventoryService(conn, cloud), args.repeat, rng))
+    if "checkout" in suites:
+        results.update(bench_checkout(conn, CheckoutService(cloud), args.repeat, rng))
+    if "reports" in suites:
+        results.update(bench_reports(ReportingService(conn), args.repeat))
+    if "sync" in suites:
+        results.update(bench_sync(SyncService(cloud), server, os.path.splitext(args.db)[0] + '_sync.db', args.repeat))
+    if "dashboard" in suites:
+        results.update(bench_dashboard(url, args.repeat))
+    if "analytics" in suites:
+        results.update(bench_analytics(conn, args.analytics_sales, args.repeat))
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, r in results.items():
+        print(f"{name:<28} " + (f"p50 {r['p50_ms']:>9.3f} ms  p95 {r['p95_ms']:>9.3f} ms" if isinstance(r, dict) else str(r)))
+    print(f"✅ Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+import db
+from timekeys import SECONDS_PER_DAY
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Writes staged within this window go out together
+FLUSH_WINDOW_SECONDS = 0.5
+# Max outbox rows folded into one multi-path PATCH
+BATCH_SIZE = 200
+# Idle re-check of the outbox, so writes made while offline are replayed once the network is back
+IDLE_POLL_SECONDS = 30
+MAX_BACKOFF_SECONDS = 60
+# Idempotency keys only need to outlive a retry; older ones are pruned from /sync_log
+SYNC_LOG_RETENTION_DAYS = 7
+SYNC_LOG_PRUNE_SECONDS = 3600
+SYNC_LOG_PRUNE_BATCH = 500
+REQUEST_TIMEOUT = 15
+# Refusals that clear up without touching the write: an expired credential or a
+# rules change (401/403), a missing database or failed precondition (404/412),
+# and rate limiting. These, like 5xx, keep the outbox and back off.
+RETRY_STATUS = {401, 403, 404, 408, 412, 429}
+
+# Resolved to the server's clock on write, so all tills share one time line
+SERVER_TIMESTAMP = {".sv": "timestamp"}
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+def generate_push_id():
+    """Firebase-style push key: 8 chars of millisecond time + 12 random, so keys sort by creation time."""
+    now = int(time.time() * 1000)
+    stamp = ''
+    for _ in range(8):
+        stamp = PUSH_CHARS[now % 64] + stamp
+        now //= 64
+    return stamp + ''.join(random.choice(PUSH_CHARS) for _ in range(12))
+
+def increment_of(value):
+    """The step of a {".sv": {"increment": n}} server value, or None for anything else."""
+    if isinstance(value, dict) and isinstance(value.get('.sv'), dict):
+        return value['.sv'].get('increment')
+    return None
+
+def merge_stock_counters(cursor, counters, legacy_stock=()):
+    """
+    Folds counters pulled from the cloud, as (sku, terminal, inc, dec) rows, into
+    stock_counters and recomputes products.stock for the SKUs they touch.
+    Products first written before tills kept counters carry an absolute
+    `stock` and no 'base' counter in the cloud; pass it as (sku, stock) in
+    legacy_stock and it becomes their 'base' counter, replacing whatever
+    baseline the till seeded locally, so every till starts from the same one.
+    """
+    cursor.executemany('''
+        INSERT INTO stock_counters (sku, terminal, inc, dec) VALUES (?, ?, ?, ?)
+        ON CONFLICT(sku, terminal) DO UPDATE SET inc = max(inc, excluded.inc), dec = max(dec, excluded.dec)
+    ''', counters)
+    cursor.executemany('''
+        INSERT INTO stock_counters (sku, terminal, inc, dec) VALUES (?, 'base', ?, 0)
+        ON CONFLICT(sku, terminal) DO UPDATE SET inc = excluded.inc, dec = 0
+    ''', legacy_stock)
+    skus = json.dumps(sorted({r[0] for r in counters} | {r[0] for r in legacy_stock}))
+    cursor.execute('''
+        UPDATE products SET stock = (SELECT sum(inc) - sum(dec) FROM stock_counters c WHERE c.sku = products.sku)
+        WHERE sku IN (SELECT value FROM json_each(?))
+    ''', (skus,))
+
+class WriteRejected(Exception):
+    """The server refused a batch for good (e.g. a malformed write)."""
+
+# ==========================================
+# FIREBASE SYNC CLIENT
+# ==========================================
+class FirebaseSync:
+    """
+    Offline-first writer for the Firebase REST API.
+
+    Callers stage writes into the SQLite `outbox` table with their own cursor,
+    in the same transaction as the sale or stock change, then call wake()
+    after committing. A single drainer thread replays the outbox in order:
+    up to BATCH_SIZE rows become one atomic multi-path PATCH of the database
+    root, sent over a pooled keep-alive session. A dropped network therefore
+    never loses a write or blocks the till, and a backlog built up during an
+    outage is replayed in bulk.
+
+    Every row carries an idempotency key that is written to /sync_log, with
+    the server time, in the same PATCH. If a request fails ambiguously (e.g.
+    a timeout after the server applied it), the drainer checks /sync_log
+    before retrying, so server-side increments are never applied twice.
+    Keys older than SYNC_LOG_RETENTION_DAYS are pruned while the outbox is
+    idle (needs ".indexOn": ".value" on /sync_log).
+
+    Auth and rules failures are retried like network errors, so a bad
+    credential never costs a write. Only a single row the server refuses
+    outright is moved out of the way, into `outbox_dead` for inspection.
+
+    Stock is never sent as an absolute number, since several tills sell the
+    same titles. Each till keeps its own running totals of units added and
+    removed per SKU and writes only its own entry under
+    products/{sku}/counters/{terminal}. Those totals only ever grow, so
+    merging is a per-terminal max and stock is sum(inc) - sum(dec)
+    (a PN-counter CRDT). Tills can sell offline and still converge, whatever
+    order their writes arrive in.
+    """
+    def __init__(self, base_url, db_path=None, pool_size=2, terminal=None):
+        self.base_url = base_url.rstrip('/')
+        self.db_path = db_path
+        self.terminal = terminal
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.wakeup = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def url(self, path):
+        return f"{self.base_url}/{path.strip('/')}.json"
+
+    # --- Staging (call inside the caller's transaction) ---
+    def stage(self, cursor, method, path, data=None):
+        key = generate_push_id()
+        cursor.execute(
+            "INSERT INTO outbox (idem_key, method, path, body, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, method, path.strip('/'), json.dumps(data), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        return key
+
+    def put(self, cursor, path, data):
+        return self.stage(cursor, 'PUT', path, data)
+
+    def patch(self, cursor, path, data):
+        return self.stage(cursor, 'PATCH', path, data)
+
+    def delete(self, cursor, path):
+        return self.stage(cursor, 'DELETE', path)
+
+    def post(self, cursor, path, data):
+        """Like a REST POST, but the child key is generated locally and returned,
+        so a replay writes the same record instead of pushing a duplicate."""
+        key = generate_push_id()
+        self.put(cursor, f"{path.strip('/')}/{key}", data)
+        return key
+
+    # Every product write stamps `updated_at` and bumps meta/products_updated_at,
+    # which is what lets other tills sync only what changed.
+    def put_product(self, cursor, sku, data):
+        # A PATCH, so the stock counters under the product survive; `deleted` clears an old tombstone
+        fields = {k: v for k, v in data.items() if k != 'stock'}
+        self.patch(cursor, f"products/{sku}", dict(fields, deleted=None, updated_at=SERVER_TIMESTAMP))
+        return self.put(cursor, "meta/products_updated_at", SERVER_TIMESTAMP)
+
+    def delete_product(self, cursor, sku):
+        # A tombstone rather than a DELETE, so delta syncs see the removal
+        self.put(cursor, f"products/{sku}", {"sku": sku, "deleted": True, "updated_at": SERVER_TIMESTAMP})
+        return self.put(cursor, "meta/products_updated_at", SERVER_TIMESTAMP)
+
+    def adjust_stock(self, cursor, deltas):
+        """
+        Records (sku, +/-units) changes against this till's own counters and
+        stages their new totals. The caller updates products.stock itself.
+        """
+        rows = [(sku, self.terminal, max(d, 0), max(-d, 0)) for sku, d in deltas if d]
+        if not rows: return
+        cursor.executemany('''
+            INSERT INTO stock_counters (sku, terminal, inc, dec) VALUES (?, ?, ?, ?)
+            ON CONFLICT(sku, terminal) DO UPDATE SET inc = inc + excluded.inc, dec = dec + excluded.dec
+        ''', rows)
+        counters = cursor.execute(
+            "SELECT sku, inc, dec FROM stock_counters WHERE terminal=? AND sku IN (SELECT value FROM json_each(?))",
+            (self.terminal, json.dumps([r[0] for r in rows]))).fetchall()
+        for sku, inc, dec in counters:
+            self.patch(cursor, f"products/{sku}",
+                       {"sku": sku, f"counters/{self.terminal}": {"inc": inc, "dec": dec}, "updated_at": SERVER_TIMESTAMP})
+        return self.put(cursor, "meta/products_updated_at", SERVER_TIMESTAMP)
+
+    def wake(self):
+        """Call after committing staged writes."""
+        self.wakeup.set()
+
+    def get(self, path, **params):
+        """Synchronous read over the pooled session."""
+        return self.session.get(self.url(path), params=params, timeout=REQUEST_TIMEOUT)
+
+    # --- Drainer ---
+    def run(self):
+        conn = db.connect(self.db_path)
+        delay = 1
+        limit = BATCH_SIZE
+        pruned_at = 0
+        while True:
+            try:
+                rows = conn.execute(
+                    "SELECT id, idem_key, method, path, body, attempts FROM outbox ORDER BY id LIMIT ?",
+                    (limit,)).fetchall()
+            except sqlite3.OperationalError as e:
+                # The database stayed locked past the busy timeout
+                print(f"Sync Error: {e}")
+                rows = []
+
+            if not rows:
+                if time.time() - pruned_at > SYNC_LOG_PRUNE_SECONDS:
+                    try:
+                        self.prune_sync_log()
+                        pruned_at = time.time()
+                    except requests.RequestException as e:
+                        print(f"Sync Error: {e}")
+                self.wakeup.wait(IDLE_POLL_SECONDS)
+                self.wakeup.clear()
+                time.sleep(FLUSH_WINDOW_SECONDS)
+                continue
+
+            try:
+                done = self.replay(rows)
+            except requests.RequestException as e:
+                print(f"Sync Error: {e}")
+                done = None
+            except WriteRejected as e:
+                print(f"Sync Error: PATCH rejected -> {e}")
+                if len(rows) == 1:
+                    # A single write the server will never accept: park it rather than block the outbox
+                    print(f"❌ Moving outbox write {rows[0][2]} {rows[0][3]} to outbox_dead")
+                    self.dead_letter(conn, rows[0][0], str(e))
+                else:
+                    # Retry row by row to isolate the bad write
+                    limit = 1
+                continue
+
+            if done is None:
+                # Network or server trouble: keep the rows and back off
+                conn.execute(f"UPDATE outbox SET attempts = attempts + 1 WHERE id IN ({','.join('?' * len(rows))})",
+                             [r[0] for r in rows])
+                conn.commit()
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                delay = min(delay * 2, MAX_BACKOFF_SECONDS)
+                continue
+
+            conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(done))})", done)
+            conn.commit()
+            delay = 1
+            limit = BATCH_SIZE
+
+    def replay(self, rows):
+        """
+        Sends a prefix of `rows` as one multi-path PATCH. Returns the ids that
+        are now applied, or None to retry later. Raises WriteRejected when the
+        server refuses the write for good.
+        """
+        if any(r[5] > 0 for r in rows):
+            applied = self.already_applied(rows)
+            if applied is None or applied:
+                return applied
+
+        updates, ids = self.build_update(rows)
+        r = self.session.patch(self.url(''), json=updates, timeout=REQUEST_TIMEOUT)
+        if r.status_code < 400:
+            return ids
+        if r.status_code >= 500 or r.status_code in RETRY_STATUS:
+            print(f"Sync Error: PATCH refused -> {r.status_code} {r.text[:200]}")
+            return None
+        raise WriteRejected(f"{r.status_code} {r.text[:200]}")
+
+    @staticmethod
+    def dead_letter(conn, row_id, error):
+        """Moves an outbox row the server refused into outbox_dead."""
+        conn.execute('''
+            INSERT INTO outbox_dead (idem_key, method, path, body, created_at, attempts, error, failed_at)
+            SELECT idem_key, method, path, body, created_at, attempts, ?, ? FROM outbox WHERE id=?
+        ''', (error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row_id))
+        conn.execute("DELETE FROM outbox WHERE id=?", (row_id,))
+        conn.commit()
+
+    def already_applied(self, rows):
+        """
+        Ids of the previously attempted rows the server already applied.
+        Batches are atomic and always start at the head of the outbox, so
+        the applied rows are a prefix of `rows`; its end is found by binary
+        search, looking up each probed key at /sync_log/{key}. Returns None
+        if a lookup fails, so nothing is resent on a guess.
+        """
+        tried = [r for r in rows if r[5] > 0]
+        lo, hi = 0, len(tried)  # tried[:lo] applied, tried[hi:] not
+        while lo < hi:
+            mid = (lo + hi) // 2
+            r = self.get(f"sync_log/{tried[mid][1]}")
+            if r.status_code != 200:
+                return None
+            if r.json() is None:
+                hi = mid
+            else:
+                lo = mid + 1
+        return [row[0] for row in tried[:lo]]
+
+    def prune_sync_log(self):
+        """Deletes up to SYNC_LOG_PRUNE_BATCH idempotency keys older than SYNC_LOG_RETENTION_DAYS."""
+        cutoff = int((time.time() - SYNC_LOG_RETENTION_DAYS * SECONDS_PER_DAY) * 1000)
+        r = self.get('sync_log', orderBy='"$value"', endAt=cutoff, limitToFirst=SYNC_LOG_PRUNE_BATCH)
+        if r.status_code != 200: return 0
+        stale = r.json() or {}
+        if stale:
+            self.session.patch(self.url(''), json={f"sync_log/{key}": None for key in stale}, timeout=REQUEST_TIMEOUT)
+        return len(stale)
+
+    def build_update(self, rows):
+        """
+        Folds outbox rows into one multi-path update, in order. Repeated writes
+        to the same path simply keep the latest value, except server increments,
+        which are added up so every sale in the batch still counts. Firebase
+        rejects an update naming both a path and one of its ancestors, so the
+        batch stops at the first row that would overlap an earlier one that way,
+        or that would increment a path the batch sets outright.
+        """
+        updates, ids = {}, []
+        ancestors = set()  # every proper ancestor of a path already in `updates`
+        for row_id, key, method, path, body, _ in rows:
+            data = json.loads(body) if body else None
+            if method == 'PATCH' and isinstance(data, dict):
+                paths = {f"{path}/{k}": v for k, v in data.items()}
+            elif method == 'DELETE':
+                paths = {path: None}
+            else:
+                paths = {path: data}
+
+            if ids and any(p in ancestors or self.has_ancestor_in(p, updates) for p in paths):
+                break
+            if ids and any(p in updates and increment_of(v) is not None and increment_of(updates[p]) is None
+                           for p, v in paths.items()):
+                break
+            for p, v in paths.items():
+                step = increment_of(v)
+                if step is not None and p in updates:
+                    paths[p] = {".sv": {"increment": increment_of(updates[p]) + step}}
+                parts = p.split('/')
+                ancestors.update('/'.join(parts[:i]) for i in range(1, len(parts)))
+            updates.update(paths)
+            updates[f"sync_log/{key}"] = SERVER_TIMESTAMP
+            ids.append(row_id)
+        return updates, ids
+
+    @staticmethod
+    def has_ancestor_in(path, updates):
+        parts = path.split('/')
+        return any('/'.join(parts[:i]) in updates for i in range(1, len(parts)))
@@ -0,0 +1,527 @@
+import json
+import re
+from datetime import datetime
+from cloud_sync import merge_stock_counters
+from timekeys import SECONDS_PER_DAY, day_from_epoch, local_epoch
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Max rows returned by a product search
+SEARCH_LIMIT = 50
+# Rows per page of the inventory list
+INVENTORY_PAGE_SIZE = 100
+# Rows in each list of the product performance report
+PERFORMANCE_LIMIT = 15
+# Sales stamped with this were counted into /rollups/hourly by the till itself
+ROLLUP_VERSION = 2
+
+# ==========================================
+# CLOUD HELPERS
+# ==========================================
+def hourly_cell(ts, method):
+    """Path under /rollups of the per-hour, per-method totals a sale at `ts` is counted in."""
+    day, secs = divmod(ts, SECONDS_PER_DAY)
+    return f"hourly/{day_from_epoch(day).isoformat()}/h{secs // 3600:02d}/{method}"
+
+def sales_rollup_update(ts, amount, profit, method, count=1, hourly=True):
+    """
+    Multi-path PATCH body for /rollups. The web dashboard reads its totals
+    and charts from here instead of downloading sales: all-time and daily
+    totals, plus revenue, profit and transactions per hour and payment
+    method under hourly/. Every write bumps the day's `revision`, so the
+    dashboard can tell which days changed.
+    Pass count=-1 (and the original figures) to take a deleted sale back out,
+    and hourly=False if it was posted before ROLLUP_VERSION and so never
+    counted into hourly/.
+    """
+    inc = lambda v: {".sv": {"increment": v}}
+    day = day_from_epoch(ts // SECONDS_PER_DAY).isoformat()
+    update = {
+        "all_time/total_amount": inc(amount * count),
+        "all_time/transactions": inc(count),
+        f"all_time/methods/{method}": inc(count),
+        f"daily/{day}/total_amount": inc(amount * count),
+        f"daily/{day}/transactions": inc(count),
+        f"daily/{day}/revision": inc(1),
+    }
+    if hourly:
+        cell = hourly_cell(ts, method)
+        update[f"{cell}/total_amount"] = inc(amount * count)
+        update[f"{cell}/profit"] = inc(profit * count)
+        update[f"{cell}/transactions"] = inc(count)
+    return update
+
+def fts_match_query(text):
+    """Turns free text into an FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{w}"*' for w in words) if words else None
+
+# ==========================================
+# PRODUCT INDEX (BARCODE FAST PATH)
+# ==========================================
+class ProductIndex:
+    """
+    In-memory sku -> (title, price, cost, stock) map, so a scanned barcode
+    goes to the cart without touching SQLite. Loaded once at start-up and
+    then kept in step with every write the till makes (refresh_skus) and
+    with each cloud sync (apply_sync).
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.items = {}
+        self.reload()
+
+    def reload(self):
+        self.items = {str(sku): (title, price, cost or 0.0, stock) for sku, title, price, cost, stock in
+                      self.cursor.execute("SELECT sku, title, price, cost_price, stock FROM products")}
+
+    def get(self, sku):
+        return self.items.get(str(sku))
+
+    def refresh_skus(self, skus):
+        """Re-reads the given SKUs after a local write; missing rows are dropped."""
+        skus = [str(s) for s in skus]
+        if not skus: return
+        for s in skus:
+            self.items.pop(s, None)
+        rows = self.cursor.execute(
+            f"SELECT sku, title, price, cost_price, stock FROM products WHERE sku IN ({','.join('?' * len(skus))})", skus)
+        for sku, title, price, cost, stock in rows:
+            self.items[str(sku)] = (title, price, cost or 0.0, stock)
+
+    def apply_sync(self, upserts, deletes, levels):
+        """Applies the rows written by SyncService.pull_products, with their merged stock levels."""
+        for sku, title, _, _, _, price, cost, _, _ in upserts:
+            self.items[str(sku)] = (title, price, cost, levels.get(sku, 0))
+        for (sku,) in deletes:
+            self.items.pop(str(sku), None)
+
+# ==========================================
+# CART
+# ==========================================
+class Cart:
+    """The basket being rung up: its lines, the discount, and the totals derived from them."""
+    def __init__(self):
+        self.items = []
+        self.discount = 0.0
+
+    @property
+    def subtotal(self):
+        return sum(item['price'] * item['qty'] for item in self.items)
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+    @property
+    def profit(self):
+        # Profit = Final Money Collected - Total Cost of goods
+        return self.total - sum(item['cost'] * item['qty'] for item in self.items)
+
+    def add(self, sku, title, price, cost, stock):
+        """Adds one unit; raises ValueError rather than put more in the cart than `stock`."""
+        for item in self.items:
+            if item['sku'] == sku:
+                if item['qty'] + 1 > stock:
+                    raise ValueError(f"Only {stock} available!")
+                item['qty'] += 1
+                return
+        if stock < 1:
+            raise ValueError(f"Only {stock} available!")
+        self.items.append({'sku': sku, 'title': title, 'price': price, 'cost': cost, 'qty': 1})
+
+    def set_discount(self, amount):
+        if amount < 0:
+            raise ValueError("Discount cannot be negative.")
+        if amount >= self.subtotal:
+            raise ValueError("Discount cannot exceed the subtotal.")
+        self.discount = amount
+
+    def clear(self):
+        self.items = []
+        self.discount = 0.0
+
+    def restore(self, sale):
+        """Puts a sale's lines back, e.g. after its commit failed."""
+        self.items = [dict(item) for item in sale['items']]
+        self.discount = sale['discount']
+
+    def checkout(self, paid, method, user):
+        """Checks the payment and returns a snapshot of the sale for CheckoutService.commit_sale."""
+        if not self.items:
+            raise ValueError("Cart is empty")
+        if paid < self.total:
+            raise ValueError("Insufficient Funds")
+        now = datetime.now()
+        return {
+            'date': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'ts': local_epoch(now),
+            'items': [dict(item) for item in self.items],
+            'subtotal': self.subtotal,
+            'discount': self.discount,
+            'total': self.total,
+            'profit': self.profit,
+            'method': method,
+            'user': user,
+            'paid': paid,
+            'change': paid - self.total
+        }
+
+# ==========================================
+# CHECKOUT
+# ==========================================
+class CheckoutService:
+    """
+    Writes and reverses sales. Every call takes the connection to use, so the
+    same service runs on the till's DB worker, a benchmark or a load test.
+    """
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def commit_sale(self, conn, sale):
+        """
+        Records a sale from Cart.checkout() and returns the new sale id.
+
+        The whole sale is one BEGIN IMMEDIATE transaction: the write lock is
+        taken up front, so another till or a cloud sync can't change stock
+        between the check and the decrement. Each line only decrements if
+        enough stock is left; if any line falls short, nothing is written.
+        """
+        cur = conn.cursor()
+        items = sale['items']
+        skus = [i['sku'] for i in items]
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            sale_date, sale_ts = sale['date'], sale['ts']
+            sale_day = sale_ts // SECONDS_PER_DAY
+
+            # 1. Decrement Stock (all lines in one statement, never below zero)
+            cur.executemany("UPDATE products SET stock = stock - ? WHERE sku=? AND stock >= ?",
+                            [(i['qty'], i['sku'], i['qty']) for i in items])
+            marks = ','.join('?' * len(skus))
+            if cur.rowcount != len(items):
+                conn.rollback()
+                levels = dict(cur.execute(f"SELECT sku, stock FROM products WHERE sku IN ({marks})", skus).fetchall())
+                short = [f"{i['title']} ({levels.get(i['sku'], 0)} left)" for i in items if levels.get(i['sku'], 0) < i['qty']]
+                raise ValueError("Not enough stock: " + ", ".join(short))
+
+            # 2. Record Sale
+            cur.execute("""
+                INSERT INTO sales (sale_date, sale_ts, sale_day, total_amount, discount, total_profit, payment_method, rollup_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (sale_date, sale_ts, sale_day, sale['total'], sale['discount'], sale['profit'], sale['method'], ROLLUP_VERSION))
+            sale_id = cur.lastrowid
+            cur.executemany("""
+                INSERT INTO sale_items (sale_id, sku, title, qty, price, cost, sale_date, sale_day)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(sale_id, i['sku'], i['title'], i['qty'], i['price'], i['cost'], sale_date, sale_day) for i in items])
+            self.cloud.adjust_stock(cur, [(i['sku'], -i['qty']) for i in items])
+
+            # 3. Queue Sale & Rollups for Firebase (same transaction as the sale)
+            # `epoch_day` is indexed on /sales so the dashboard can range-query the last week;
+            # `day` names the rollup paths
+            day = sale_date[:10]
+            sale_data = {
+                "sale_id": sale_id,
+                "timestamp": sale_date.replace(' ', 'T'),
+                "ts": sale_ts,
+                "epoch_day": sale_day,
+                "day": day,
+                "rollup_version": ROLLUP_VERSION,
+                "total_amount": sale['total'],
+                "discount": sale['discount'],
+                "profit": sale['profit'],
+                "payment_method": sale['method'],
+                "user": sale['user'],
+                "items": [{"sku": i['sku'], "title": i['title'], "qty": i['qty'], "price": i['price']} for i in sale['items']]
+            }
+            cloud_key = self.cloud.post(cur, "sales", sale_data)
+            self.cloud.patch(cur, "rollups", sales_rollup_update(sale_ts, sale['total'], sale['profit'], sale['method']))
+            cur.execute("UPDATE sales SET cloud_key=? WHERE id=?", (cloud_key, sale_id))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.cloud.wake()
+        return sale_id
+
+    def delete_sale(self, conn, sale_id):
+        """Deletes a sale and puts its stock back, locally and in the cloud. Returns the SKUs it touched."""
+        cur = conn.cursor()
+        try:
+            # 1. Revert Stock
+            sale_ts, sale_day, total_amount, profit, method, cloud_key, rollup_version = cur.execute(
+                "SELECT sale_ts, sale_day, total_amount, total_profit, payment_method, cloud_key, rollup_version FROM sales WHERE id=?",
+                (sale_id,)).fetchone()
+            items = cur.execute("SELECT sku, qty FROM sale_items WHERE sale_id=?", (sale_id,)).fetchall()
+            cur.executemany("UPDATE products SET stock = stock + ? WHERE sku=?", [(qty, sku) for sku, qty in items])
+            # Revert Firebase Stock
+            self.cloud.adjust_stock(cur, items)
+
+            # 2. Delete Record
+            cur.execute("DELETE FROM sale_items WHERE sale_id=?", (sale_id,))
+            cur.execute("DELETE FROM sales WHERE id=?", (sale_id,))
+
+            # Take the sale back out of the cloud and the dashboard rollups
+            if cloud_key:
+                self.cloud.delete(cur, f"sales/{cloud_key}")
+            if sale_ts is None:
+                sale_ts = sale_day * SECONDS_PER_DAY
+            # Older sales were never counted into the hourly cells, so taking them out would drive those negative
+            rollup_data = sales_rollup_update(sale_ts, total_amount or 0.0, profit or 0.0, method or 'Unknown', count=-1,
+                                              hourly=(rollup_version or 0) >= ROLLUP_VERSION)
+            self.cloud.patch(cur, "rollups", rollup_data)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.cloud.wake()
+        return [sku for sku, _ in items]
+
+# ==========================================
+# INVENTORY
+# ==========================================
+class InventoryService:
+    """Catalogue search, paging and edits on one connection."""
+    def __init__(self, conn, cloud):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.cloud = cloud
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        In-stock (sku, title, price, stock) rows: exact SKU first, then SKU
+        prefix (both ignoring case), then ranked full-text matches.
+        """
+        query = query.strip()
+        if not query:
+            return self.cursor.execute("SELECT sku, title, price, stock FROM products WHERE stock > 0 LIMIT ?", (limit,)).fetchall()
+
+        # 1. Exact SKU / barcode (idx_products_sku_nocase lookup)
+        rows = self.cursor.execute("SELECT sku, title, price, stock FROM products WHERE sku = ? COLLATE NOCASE AND stock > 0", (query,)).fetchall()
+
+        # 2. SKU prefix, as a range scan of the same index
+        if not rows:
+            rows = self.cursor.execute("""
+                SELECT sku, title, price, stock FROM products
+                WHERE sku >= ? COLLATE NOCASE AND sku < ? COLLATE NOCASE AND stock > 0
+                ORDER BY sku COLLATE NOCASE LIMIT ?
+            """, (query, query + '\uffff', limit)).fetchall()
+
+        # 3. Ranked full-text match on title / author / category
+        match = fts_match_query(query)
+        if match and len(rows) < limit:
+            seen = {r[0] for r in rows}
+            for row in self.cursor.execute("""
+                SELECT p.sku, p.title, p.price, p.stock
+                FROM products_fts JOIN products p ON p.id = products_fts.rowid
+                WHERE products_fts MATCH ? AND p.stock > 0
+                ORDER BY products_fts.rank LIMIT ?
+            """, (match, limit)):
+                if row[0] not in seen and len(rows) < limit:
+                    rows.append(row)
+        return rows
+
+    def page(self, after=None, size=INVENTORY_PAGE_SIZE):
+        """
+        One page of (sku, title, product_type, price, cost_price, stock) rows
+        with SKUs after `after` (keyset on the SKU index). Returns (rows, has_next).
+        """
+        if after is None:
+            rows = self.cursor.execute("""
+                SELECT sku, title, product_type, price, cost_price, stock FROM products
+                ORDER BY sku LIMIT ?
+            """, (size + 1,)).fetchall()
+        else:
+            rows = self.cursor.execute("""
+                SELECT sku, title, product_type, price, cost_price, stock FROM products
+                WHERE sku > ? ORDER BY sku LIMIT ?
+            """, (after, size + 1)).fetchall()
+        return rows[:size], len(rows) > size
+
+    def details(self, sku):
+        """(author_supplier, category) of a product, or None."""
+        return self.cursor.execute("SELECT author_supplier, category FROM products WHERE sku=?", (sku,)).fetchone()
+
+    # `data` is the inventory form: sku, title, author_supplier, category, product_type, price, cost_price, stock
+    def add_product(self, data):
+        try:
+            self.cursor.execute("""
+                INSERT INTO products (sku, title, author_supplier, category, product_type, price, cost_price, stock, date_added)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (data['sku'], data['title'], data['author_supplier'], data['category'], data['product_type'],
+                  float(data['price']), float(data['cost_price']), int(data['stock']), datetime.now().strftime('%Y-%m-%d')))
+            # Cloud Push
+            self.cloud.put_product(self.cursor, data['sku'], data)
+            self.cloud.adjust_stock(self.cursor, [(data['sku'], int(data['stock']))])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.cloud.wake()
+
+    def update_product(self, data):
+        try:
+            old_stock = self.cursor.execute("SELECT stock FROM products WHERE sku=?", (data['sku'],)).fetchone()[0]
+            self.cursor.execute("""
+                UPDATE products SET title=?, author_supplier=?, category=?, product_type=?, price=?, cost_price=?, stock=?
+                WHERE sku=?
+            """, (data['title'], data['author_supplier'], data['category'], data['product_type'],
+                  float(data['price']), float(data['cost_price']), int(data['stock']), data['sku']))
+            self.cloud.put_product(self.cursor, data['sku'], data)
+            # A stock count correction is recorded as this till's delta, not a new absolute value
+            self.cloud.adjust_stock(self.cursor, [(data['sku'], int(data['stock']) - old_stock)])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.cloud.wake()
+
+    def delete_product(self, sku):
+        try:
+            self.cursor.execute("DELETE FROM products WHERE sku=?", (sku,))
+            self.cursor.execute("DELETE FROM stock_counters WHERE sku=?", (sku,))
+            self.cloud.delete_product(self.cursor, sku)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.cloud.wake()
+
+# ==========================================
+# REPORTING
+# ==========================================
+class ReportingService:
+    """
+    Read-only sales figures. Totals come from the daily rollups, so their cost
+    depends on the number of days asked for, not on the number of sales.
+    Days are integer day keys (timekeys.epoch_day).
+    """
+    TOTALS_SQL = ("SELECT COALESCE(sum(revenue), 0), COALESCE(sum(discount), 0), COALESCE(sum(profit), 0), "
+                  "COALESCE(sum(transactions), 0) FROM daily_sales_summary")
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def totals(self, start=None, end=None):
+        """(revenue, discount, profit, transactions) from day `start` to day `end` inclusive, or for all time."""
+        if start is None:
+            return self.cursor.execute(self.TOTALS_SQL).fetchone()
+        return self.cursor.execute(self.TOTALS_SQL + " WHERE day BETWEEN ? AND ?", (start, end)).fetchone()
+
+    def payment_mix(self, start, end):
+        """(method, revenue, transactions) rows, largest revenue first."""
+        return self.cursor.execute("""
+            SELECT method, sum(revenue), sum(transactions) FROM daily_payment_summary
+            WHERE day BETWEEN ? AND ? GROUP BY method HAVING sum(transactions) > 0 ORDER BY 2 DESC
+        """, (start, end)).fetchall()
+
+    def recent_sales(self, limit=50):
+        return self.cursor.execute("SELECT id, total_amount, discount, sale_date FROM sales ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+    def product_performance(self, since, limit=PERFORMANCE_LIMIT):
+        """
+        Best sellers as (sku, units, revenue) and in-stock slow movers as
+        (sku, title, stock, units), over the sale_items from day `since` onwards.
+        """
+        best = self.cursor.execute("""
+            SELECT sku, sum(qty) AS units, sum(qty * price) AS revenue
+            FROM sale_items INDEXED BY idx_sale_items_day WHERE sale_day >= ?
+            GROUP BY sku ORDER BY units DESC LIMIT ?
+        """, (since, limit)).fetchall()
+
+        # In-stock products that sold least (or nothing) in the period
+        slow = self.cursor.execute("""
+            SELECT p.sku, p.title, p.stock, COALESCE(s.units, 0) AS units
+            FROM products p
+            LEFT JOIN (SELECT sku, sum(qty) AS units FROM sale_items INDEXED BY idx_sale_items_day WHERE sale_day >= ? GROUP BY sku) s ON s.sku = p.sku
+            WHERE p.stock > 0
+            ORDER BY units ASC, p.stock DESC LIMIT ?
+        """, (since, limit)).fetchall()
+        return best, slow
+
+# ==========================================
+# SYNC
+# ==========================================
+class SyncService:
+    """Pulls catalogue changes written by other tills (or the back office) into a local database."""
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def pull_products(self, conn):
+        """
+        Incremental pull of the cloud catalogue. Only products whose server
+        `updated_at` is at or past the stored high-water mark are downloaded
+        (needs ".indexOn": ["updated_at"] on /products), and a one-value read
+        of meta/products_updated_at skips the download entirely when nothing
+        has changed. The first sync on a till is a full download. If the
+        meta value is missing, the newest `updated_at` downloaded becomes
+        the high-water mark instead.
+
+        Returns the (upserts, deletes, levels) it wrote, or None when there
+        was nothing to fetch.
+        """
+        cur = conn.cursor()
+        row = cur.execute("SELECT value FROM sync_state WHERE key='products_hwm'").fetchone()
+        hwm = int(row[0]) if row else None
+
+        r = self.cloud.get("meta/products_updated_at")
+        latest = r.json() if r.status_code == 200 else None
+        if hwm is not None and latest is not None and latest <= hwm:
+            return None
+
+        if hwm is None:
+            r = self.cloud.get("products")
+        else:
+            r = self.cloud.get("products", orderBy='"updated_at"', startAt=hwm)
+        if r.status_code != 200:
+            print(f"Sync Error: {r.status_code} {r.text[:200]}")
+            return None
+
+        data = r.json() or {}
+        items = data.values() if isinstance(data, dict) else [x for x in data if x is not None]
+
+        if latest is None:
+            latest = max((i['updated_at'] for i in items if isinstance(i, dict) and isinstance(i.get('updated_at'), (int, float))),
+                         default=hwm)
+
+        upserts, deletes, counters, legacy_stock = [], [], [], []
+        for i in items:
+            if not isinstance(i, dict) or 'sku' not in i: continue
+            if i.get('deleted'):
+                deletes.append((i['sku'],))
+                continue
+            if i.get('title') is not None:
+                upserts.append((i.get('sku'), i.get('title'), i.get('author_supplier'), i.get('category'), i.get('product_type') or 'Book',
+                                float(i.get('price',0)), float(i.get('cost_price',0)), int(i.get('stock',0)), i.get('date_added')))
+            if i.get('counters'):
+                counters.extend((i['sku'], t, int(c.get('inc', 0)), int(c.get('dec', 0))) for t, c in i['counters'].items())
+            # Until a 'base' counter is published, the cloud's pre-counter `stock` is the baseline every till shares
+            if 'stock' in i and 'base' not in (i.get('counters') or {}):
+                legacy_stock.append((i['sku'], int(i['stock'])))
+
+        # One transaction for the whole delta; stock comes from the merged counters
+        try:
+            cur.executemany('''
+                INSERT INTO products (sku, title, author_supplier, category, product_type, price, cost_price, stock, date_added)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sku) DO UPDATE SET
+                    title=excluded.title, author_supplier=excluded.author_supplier, category=excluded.category,
+                    product_type=excluded.product_type, price=excluded.price, cost_price=excluded.cost_price,
+                    date_added=excluded.date_added
+            ''', upserts)
+            merge_stock_counters(cur, counters, legacy_stock)
+            cur.executemany("DELETE FROM products WHERE sku=?", deletes)
+            cur.executemany("DELETE FROM stock_counters WHERE sku=?", deletes)
+            levels = dict(cur.execute("SELECT sku, stock FROM products WHERE sku IN (SELECT value FROM json_each(?))",
+                                      (json.dumps([u[0] for u in upserts]),)))
+            # Anything written after `latest` was read has a later updated_at and is picked up next time
+            if latest is not None:
+                cur.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('products_hwm', ?)", (str(latest),))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return upserts, deletes, levels
@@ -0,0 +1,396 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from timekeys import SECONDS_PER_DAY
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Point each till at its own file, e.g. when running several on one machine
+DB_PATH = os.environ.get("BOOKSHOP_DB", "bookshop.db")
+
+# WAL lets the till, the sync worker and report readers work side by side:
+# readers never block the writer and the writer never blocks readers.
+# synchronous=NORMAL is durable across app crashes under WAL (only an OS
+# crash can lose the last commits), and avoids an fsync per sale.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-32000",      # 32 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped reads
+)
+# Wait this long for another connection's write lock instead of failing
+BUSY_TIMEOUT_SECONDS = 5
+# Per-connection cache of compiled statements, reused for repeated queries
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+# ==========================================
+# CONNECTIONS
+# ==========================================
+def connect(path=None):
+    """A new, tuned connection. The caller owns it and must close it."""
+    path = path or DB_PATH
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn, path)
+    return conn
+
+def get_connection(path=None):
+    """
+    The calling thread's shared connection, opened on first use. SQLite
+    connections must stay on the thread that made them, so each thread
+    (Tk, checkout worker, sync worker) gets exactly one and keeps it.
+    """
+    path = path or DB_PATH
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    if path not in conns:
+        conns[path] = connect(path)
+    return conns[path]
+
+def close_connection(path=None):
+    conns = getattr(_local, 'conns', {})
+    conn = conns.pop(path or DB_PATH, None)
+    if conn is not None:
+        conn.close()
+
+def migrate(conn, path=None):
+    """Brings the schema up to date, once per database file per process."""
+    path = path or DB_PATH
+    if path in _migrated:
+        return
+    with _migrate_lock:
+        if path in _migrated:
+            return
+        create_schema(conn)
+        _migrated.add(path)
+
+# ==========================================
+# SCHEMA
+# ==========================================
+def create_schema(conn):
+    cursor = conn.cursor()
+    
+    # 1. Create Products Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sku TEXT UNIQUE, 
+            title TEXT NOT NULL,
+            author_supplier TEXT, 
+            category TEXT,
+            product_type TEXT NOT NULL DEFAULT 'Book', 
+            price REAL NOT NULL,
+            cost_price REAL DEFAULT 0.0, 
+            stock INTEGER NOT NULL,
+            date_added TEXT
+        )
+    ''')
+    
+    # Product search matches SKUs whatever their case
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_sku_nocase ON products (sku COLLATE NOCASE)")
+
+    # 2. Create Sales Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_date TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            discount REAL DEFAULT 0.0,
+            total_profit REAL DEFAULT 0.0, 
+            payment_method TEXT,
+            items_json TEXT,
+            sale_ts INTEGER,
+            sale_day INTEGER
+        )
+    ''')
+    
+    # --- CHECK FOR NEW COLUMNS (MIGRATION) ---
+    try:
+        cursor.execute("SELECT discount FROM sales LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE sales ADD COLUMN discount REAL DEFAULT 0.0")
+
+    try:
+        cursor.execute("SELECT total_profit FROM sales LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE sales ADD COLUMN total_profit REAL DEFAULT 0.0")
+
+    try:
+        cursor.execute("SELECT cloud_key FROM sales LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE sales ADD COLUMN cloud_key TEXT")
+
+    try:
+        cursor.execute("SELECT sale_ts FROM sales LIMIT 1")
+    except sqlite3.OperationalError:
+        # Integer time keys (see timekeys.py), parsed once from sale_date
+        cursor.execute("ALTER TABLE sales ADD COLUMN sale_ts INTEGER")
+        cursor.execute("ALTER TABLE sales ADD COLUMN sale_day INTEGER")
+        cursor.execute(f"UPDATE sales SET sale_ts = CAST(strftime('%s', sale_date) AS INTEGER), sale_day = CAST(strftime('%s', sale_date) AS INTEGER) / {SECONDS_PER_DAY}")
+
+    try:
+        cursor.execute("SELECT rollup_version FROM sales LIMIT 1")
+    except sqlite3.OperationalError:
+        # Which cloud rollups the sale was counted into (see core.ROLLUP_VERSION); NULL before hourly cells
+        cursor.execute("ALTER TABLE sales ADD COLUMN rollup_version INTEGER")
+
+    # Time-range reads (exports)
+    cursor.execute("DROP INDEX IF EXISTS idx_sales_date")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_ts ON sales (sale_ts)")
+
+    # Pending cloud writes, replayed by the sync worker (see cloud_sync.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idem_key TEXT UNIQUE NOT NULL,
+            method TEXT NOT NULL,
+            path TEXT NOT NULL,
+            body TEXT,
+            created_at TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Outbox writes the server refused for good, kept for inspection instead of dropped
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_dead (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idem_key TEXT NOT NULL,
+            method TEXT NOT NULL,
+            path TEXT NOT NULL,
+            body TEXT,
+            created_at TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            failed_at TEXT NOT NULL
+        )
+    ''')
+
+    # Cloud sync bookkeeping (e.g. the products high-water mark)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # 3. Create Users Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password_hash TEXT,
+            role TEXT
+        )
+    ''')
+    
+    # 4. Full-Text Search Index (title / author / category), kept in step by triggers
+    fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'").fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            title, author_supplier, category,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.executescript('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, title, author_supplier, category)
+            VALUES (new.id, new.title, new.author_supplier, new.category);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, title, author_supplier, category)
+            VALUES ('delete', old.id, old.title, old.author_supplier, old.category);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF title, author_supplier, category ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, title, author_supplier, category)
+            VALUES ('delete', old.id, old.title, old.author_supplier, old.category);
+            INSERT INTO products_fts(rowid, title, author_supplier, category)
+            VALUES (new.id, new.title, new.author_supplier, new.category);
+        END;
+    ''')
+    if not fts_exists:
+        cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+    # 5. Sale Line Items (one row per cart line; replaces sales.items_json)
+    items_exist = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='sale_items'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sale_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER NOT NULL,
+            sku TEXT NOT NULL,
+            title TEXT,
+            qty INTEGER NOT NULL,
+            price REAL NOT NULL,
+            cost REAL DEFAULT 0.0,
+            sale_date TEXT NOT NULL,
+            sale_day INTEGER
+        )
+    ''')
+    try:
+        cursor.execute("SELECT sale_day FROM sale_items LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE sale_items ADD COLUMN sale_day INTEGER")
+        cursor.execute(f"UPDATE sale_items SET sale_day = CAST(strftime('%s', sale_date) AS INTEGER) / {SECONDS_PER_DAY}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items (sale_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sku ON sale_items (sku, sale_date)")
+    # Covers the day-range GROUP BY sku in the performance report
+    cursor.execute("DROP INDEX IF EXISTS idx_sale_items_date")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_day ON sale_items (sale_day, sku, qty, price)")
+
+    if not items_exist:
+        # One-time backfill from the old JSON blobs
+        rows = []
+        for sale_id, sale_date, sale_day, items_json in cursor.execute("SELECT id, sale_date, sale_day, items_json FROM sales WHERE items_json IS NOT NULL").fetchall():
+            try:
+                items = json.loads(items_json)
+            except ValueError:
+                continue
+            rows.extend((sale_id, str(i['sku']), i.get('title'), i['qty'], i['price'], i.get('cost', 0.0), sale_date, sale_day) for i in items)
+        cursor.executemany("INSERT INTO sale_items (sale_id, sku, title, qty, price, cost, sale_date, sale_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    # 6. Per-Till Stock Counters (see FirebaseSync.adjust_stock)
+    counters_exist = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='stock_counters'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_counters (
+            sku TEXT NOT NULL,
+            terminal TEXT NOT NULL,
+            inc INTEGER NOT NULL DEFAULT 0,
+            dec INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sku, terminal)
+        ) WITHOUT ROWID
+    ''')
+    if not counters_exist:
+        # Stock on hand before counters existed is the baseline until a cloud pull
+        # replaces it with the product's cloud `stock` (see SyncService.pull_products)
+        cursor.execute("INSERT INTO stock_counters (sku, terminal, inc, dec) SELECT sku, 'base', stock, 0 FROM products WHERE sku IS NOT NULL")
+
+    # 7. Daily Sales Rollups (Reports tab), kept in step with `sales` by triggers
+    day_type = cursor.execute("SELECT type FROM pragma_table_info('daily_sales_summary') WHERE name='day'").fetchone()
+    if day_type and day_type[0] == 'TEXT':
+        # Rollups used to be keyed by 'YYYY-MM-DD'; rebuild them keyed by sale_day
+        cursor.executescript('''
+            DROP TRIGGER IF EXISTS sales_summary_ai;
+            DROP TRIGGER IF EXISTS sales_summary_ad;
+            DROP TRIGGER IF EXISTS sales_summary_au;
+            DROP TABLE daily_sales_summary;
+            DROP TABLE IF EXISTS daily_payment_summary;
+        ''')
+    summary_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='daily_sales_summary'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_sales_summary (
+            day INTEGER PRIMARY KEY,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            discount REAL NOT NULL DEFAULT 0.0,
+            profit REAL NOT NULL DEFAULT 0.0,
+            transactions INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_payment_summary (
+            day INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            transactions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, method)
+        ) WITHOUT ROWID
+    ''')
+    cursor.executescript('''
+        CREATE TRIGGER IF NOT EXISTS sales_summary_ai AFTER INSERT ON sales BEGIN
+            INSERT INTO daily_sales_summary (day, revenue, discount, profit, transactions)
+            VALUES (new.sale_day, COALESCE(new.total_amount, 0), COALESCE(new.discount, 0), COALESCE(new.total_profit, 0), 1)
+            ON CONFLICT(day) DO UPDATE SET
+                revenue = revenue + excluded.revenue, discount = discount + excluded.discount,
+                profit = profit + excluded.profit, transactions = transactions + 1;
+            INSERT INTO daily_payment_summary (day, method, revenue, transactions)
+            VALUES (new.sale_day, COALESCE(new.payment_method, 'Unknown'), COALESCE(new.total_amount, 0), 1)
+            ON CONFLICT(day, method) DO UPDATE SET
+                revenue = revenue + excluded.revenue, transactions = transactions + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS sales_summary_ad AFTER DELETE ON sales BEGIN
+            UPDATE daily_sales_summary SET
+                revenue = revenue - COALESCE(old.total_amount, 0), discount = discount - COALESCE(old.discount, 0),
+                profit = profit - COALESCE(old.total_profit, 0), transactions = transactions - 1
+            WHERE day = old.sale_day;
+            UPDATE daily_payment_summary SET
+                revenue = revenue - COALESCE(old.total_amount, 0), transactions = transactions - 1
+            WHERE day = old.sale_day AND method = COALESCE(old.payment_method, 'Unknown');
+        END;
+        CREATE TRIGGER IF NOT EXISTS sales_summary_au AFTER UPDATE OF sale_day, total_amount, discount, total_profit, payment_method ON sales BEGIN
+            UPDATE daily_sales_summary SET
+                revenue = revenue - COALESCE(old.total_amount, 0), discount = discount - COALESCE(old.discount, 0),
+                profit = profit - COALESCE(old.total_profit, 0), transactions = transactions - 1
+            WHERE day = old.sale_day;
+            UPDATE daily_payment_summary SET
+                revenue = revenue - COALESCE(old.total_amount, 0), transactions = transactions - 1
+            WHERE day = old.sale_day AND method = COALESCE(old.payment_method, 'Unknown');
+            INSERT INTO daily_sales_summary (day, revenue, discount, profit, transactions)
+            VALUES (new.sale_day, COALESCE(new.total_amount, 0), COALESCE(new.discount, 0), COALESCE(new.total_profit, 0), 1)
+            ON CONFLICT(day) DO UPDATE SET
+                revenue = revenue + excluded.revenue, discount = discount + excluded.discount,
+                profit = profit + excluded.profit, transactions = transactions + 1;
+            INSERT INTO daily_payment_summary (day, method, revenue, transactions)
+            VALUES (new.sale_day, COALESCE(new.payment_method, 'Unknown'), COALESCE(new.total_amount, 0), 1)
+            ON CONFLICT(day, method) DO UPDATE SET
+                revenue = revenue + excluded.revenue, transactions = transactions + 1;
+        END;
+    ''')
+    if not summary_exists:
+        # One-time backfill from existing sales
+        cursor.execute('''
+            INSERT INTO daily_sales_summary (day, revenue, discount, profit, transactions)
+            SELECT sale_day, COALESCE(sum(total_amount), 0), COALESCE(sum(discount), 0), COALESCE(sum(total_profit), 0), count(*)
+            FROM sales GROUP BY 1
+        ''')
+        cursor.execute('''
+            INSERT INTO daily_payment_summary (day, method, revenue, transactions)
+            SELECT sale_day, COALESCE(payment_method, 'Unknown'), COALESCE(sum(total_amount), 0), count(*)
+            FROM sales GROUP BY 1, 2
+        ''')
+
+    # 8. Operation Timings (see perf.py): counts per log-scale latency bucket, per day
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS op_timings (
+            day TEXT NOT NULL,
+            op TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, op, bucket)
+        ) WITHOUT ROWID
+    ''')
+
+    # 9. Seed Default Users
+    cursor.execute("SELECT count(*) FROM users")
+    if cursor.fetchone()[0] == 0:
+        # Default: admin/admin123 and user/user123
+        admin_pw = hashlib.sha256("admin123".encode()).hexdigest()
+        user_pw = hashlib.sha256("user123".encode()).hexdigest()
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", ("admin", admin_pw, "Director"))
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", ("user", user_pw, "Attendant"))
+        
+    conn.commit()
+
+def get_terminal_id(conn):
+    """This till's id for its stock counters: $BOOKSHOP_TERMINAL, else one generated and kept in the database."""
+    terminal = os.environ.get("BOOKSHOP_TERMINAL")
+    if terminal:
+        return terminal
+    row = conn.execute("SELECT value FROM sync_state WHERE key='terminal_id'").fetchone()
+    if row:
+        return row[0]
+    terminal = uuid.uuid4().hex[:8]
+    conn.execute("INSERT INTO sync_state (key, value) VALUES ('terminal_id', ?)", (terminal,))
+    conn.commit()
+    return terminal
@@ -0,0 +1,335 @@
+import argparse
+import hashlib
+import json
+import queue
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from cloud_sync import generate_push_id
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DEFAULT_PORT = 9000
+# Streaming clients get a keep-alive frame this often
+KEEP_ALIVE_SECONDS = 30
+
+# ==========================================
+# IN-MEMORY DATABASE
+# ==========================================
+def split_path(path):
+    return [p for p in path.strip('/').split('/') if p]
+
+class FakeDatabase:
+    """
+    A JSON tree with the parts of the Realtime Database REST semantics the
+    POS and dashboard use: PUT/PATCH/POST/DELETE, multi-path PATCH,
+    server values (timestamp and increment), ordered range queries, ETag
+    conditional PUTs (what SDK transactions run on) and event streams. Good enough to run several tills against one "cloud" on a
+    laptop; it does no auth, rules or persistence. Set `refuse_writes` to
+    a status code (e.g. 403) to refuse every write, as a rules change or
+    an expired credential would.
+    """
+    def __init__(self, data=None):
+        self.root = data or {}
+        self.lock = threading.Lock()
+        self.listeners = []  # (path parts, queue)
+        self.refuse_writes = None
+
+    # --- Reads ---
+    def get(self, path):
+        with self.lock:
+            return json.loads(json.dumps(self.node(split_path(path))))
+
+    @staticmethod
+    def etag_of(value):
+        return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+    def node(self, parts):
+        node = self.root
+        for p in parts:
+            if not isinstance(node, dict) or p not in node:
+                return None
+            node = node[p]
+        return node
+
+    def query(self, path, params):
+        if 'orderBy' not in params:
+            data = self.get(path)
+            if params.get('shallow') == 'true' and isinstance(data, dict):
+                return {k: True for k in data}
+            return data
+        with self.lock:
+            data = self.node(split_path(path))
+            if not isinstance(data, dict):
+                return json.loads(json.dumps(data))
+            # Only the matching children are copied out
+            return json.loads(json.dumps(self.filter(data, params)))
+
+    def filter(self, data, params):
+        order_by = json.loads(params['orderBy'])
+        if order_by == '$key':
+            sort_key = lambda kv: kv[0]
+        elif order_by == '$value':
+            sort_key = lambda kv: kv[1]
+        else:
+            child = split_path(order_by)
+            def sort_key(kv):
+                node = kv[1]
+                for p in child:
+                    node = node.get(p) if isinstance(node, dict) else None
+                return node
+
+        def comparable(v):
+            # Realtime Database order: null, false, true, numbers, strings, objects
+            if v is None: return (0, 0)
+            if isinstance(v, bool): return (1, v)
+            if isinstance(v, (int, float)): return (2, v)
+            if isinstance(v, str): return (3, v)
+            return (4, 0)
+
+        items = sorted(data.items(), key=lambda kv: (comparable(sort_key(kv)), kv[0]))
+        for param, test in (('startAt', lambda v, b: v >= b), ('endAt', lambda v, b: v <= b),
+                            ('equalTo', lambda v, b: v == b)):
+            if param in params:
+                bound = comparable(json.loads(params[param]))
+                items = [kv for kv in items if test(comparable(sort_key(kv)), bound)]
+        if 'limitToFirst' in params:
+            items = items[:int(params['limitToFirst'])]
+        if 'limitToLast' in params:
+            items = items[-int(params['limitToLast']):]
+        return dict(items)
+
+    # --- Writes ---
+    def put(self, path, value):
+        with self.lock:
+            parts = split_path(path)
+            self.write(parts, self.resolve(value, parts))
+        self.notify([parts])
+        return value
+
+    def put_if_match(self, path, value, etag):
+        """PUT only if the node still has ETag `etag`. Returns (written, value now there, its ETag)."""
+        parts = split_path(path)
+        with self.lock:
+            current = json.loads(json.dumps(self.node(parts)))
+            if self.etag_of(current) != etag:
+                return False, current, self.etag_of(current)
+            self.write(parts, self.resolve(value, parts))
+            current = json.loads(json.dumps(self.node(parts)))
+        self.notify([parts])
+        return True, current, self.etag_of(current)
+
+    def patch(self, path, values):
+        base = split_path(path)
+        with self.lock:
+            resolved = [(base + split_path(k), self.resolve(v, base + split_path(k))) for k, v in values.items()]
+            for parts, v in resolved:
+                self.write(parts, v)
+        self.notify([parts for parts, _ in resolved])
+        return values
+
+    def post(self, path, value):
+        key = generate_push_id()
+        self.put(f"{path.strip('/')}/{key}", value)
+        return key
+
+    def write(self, parts, value):
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        trail = []
+        for p in parts[:-1]:
+            if not isinstance(node.get(p), dict):
+                if value is None: return
+                node[p] = {}
+            trail.append((node, p))
+            node = node[p]
+        if value is None:
+            node.pop(parts[-1], None)
+            # Empty parents disappear, as in the real database
+            for parent, key in reversed(trail):
+                if parent[key]: break
+                del parent[key]
+        else:
+            node[parts[-1]] = value
+
+    def resolve(self, value, parts):
+        """Replaces {".sv": ...} placeholders with their server-side values."""
+        if isinstance(value, dict):
+            sv = value.get('.sv')
+            if sv == 'timestamp':
+                return int(time.time() * 1000)
+            if isinstance(sv, dict) and 'increment' in sv:
+                current = self.node(parts)
+                return (current if isinstance(current, (int, float)) else 0) + sv['increment']
+            out = {k: self.resolve(v, parts + [k]) for k, v in value.items() if v is not None}
+            return out or None
+        return value
+
+    # --- Streaming ---
+    def listen(self, path):
+        q = queue.Queue()
+        parts = split_path(path)
+        with self.lock:
+            self.listeners.append((parts, q))
+        return q
+
+    def unlisten(self, q):
+        with self.lock:
+            self.listeners = [(p, lq) for p, lq in self.listeners if lq is not q]
+
+    def notify(self, changed):
+        with self.lock:
+            listeners = list(self.listeners)
+        for parts, q in listeners:
+            # A write touches a listener if either path contains the other
+            if any(c[:len(parts)] == parts or parts[:len(c)] == c for c in changed):
+                q.put(True)
+
+# ==========================================
+# HTTP FRONT END
+# ==========================================
+class FakeFirebaseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    database = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse(self):
+        url = urlsplit(self.path)
+        path = url.path[:-5] if url.path.endswith('.json') else url.path
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return path, params
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def reply(self, data, status=200, params=None, etag=None):
+        if params and params.get('print') == 'silent':
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path, params = self.parse()
+        if 'text/event-stream' in self.headers.get('Accept', ''):
+            return self.stream(path)
+        try:
+            data = self.database.query(path, params)
+            etag = self.database.etag_of(data) if self.headers.get('X-Firebase-ETag') == 'true' else None
+            self.reply(data, etag=etag)
+        except (ValueError, KeyError) as e:
+            self.reply({"error": str(e)}, 400)
+
+    def refused(self):
+        status = self.database.refuse_writes
+        if status:
+            self.reply({"error": "Permission denied"}, status)
+        return bool(status)
+
+    def do_PUT(self):
+        path, params = self.parse()
+        data = self.body()
+        if self.refused(): return
+        if_match = self.headers.get('if-match')
+        if if_match is None:
+            return self.reply(self.database.put(path, data), params=params)
+        # Conditional write; a 412 carries the current value and ETag so the client can retry
+        written, data, etag = self.database.put_if_match(path, data, if_match)
+        self.reply(data, 200 if written else 412, params=params if written else None, etag=etag)
+
+    def do_PATCH(self):
+        path, params = self.parse()
+        data = self.body()
+        if self.refused(): return
+        if not isinstance(data, dict):
+            return self.reply({"error": "PATCH body must be an object"}, 400)
+        self.reply(self.database.patch(path, data), params=params)
+
+    def do_POST(self):
+        path, params = self.parse()
+        data = self.body()
+        if self.refused(): return
+        self.reply({"name": self.database.post(path, data)}, params=params)
+
+    def do_DELETE(self):
+        path, params = self.parse()
+        if self.refused(): return
+        self.database.put(path, None)
+        self.reply(None, params=params)
+
+    def stream(self, path):
+        """Server-sent events: a full `put` of the node now and after every change under it."""
+        q = self.database.listen(path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            changed = True
+            while True:
+                if changed:
+                    frame = json.dumps({"path": "/", "data": self.database.get(path)})
+                    self.wfile.write(f"event: put\ndata: {frame}\n\n".encode())
+                else:
+                    self.wfile.write(b"event: keep-alive\ndata: null\n\n")
+                self.wfile.flush()
+                try:
+                    changed = q.get(timeout=KEEP_ALIVE_SECONDS)
+                    # Coalesce a burst of writes into one frame
+                    while not q.empty(): q.get_nowait()
+                except queue.Empty:
+                    changed = False
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.database.unlisten(q)
+
+def start_server(port=0, data=None, host='127.0.0.1'):
+    """Serves a fresh FakeDatabase on a background thread. Returns (server, base_url)."""
+    handler = type('Handler', (FakeFirebaseHandler,), {'database': FakeDatabase(data)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Firebase Realtime Database REST API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--data', help="JSON file to seed the database with")
+    args = parser.parse_args()
+
+    seed = None
+    if args.data:
+        with open(args.data) as f:
+            seed = json.load(f)
+    server, url = start_server(args.port, seed, args.host)
+    print(f"✅ Fake Firebase listening on {url} (set BOOKSHOP_FIREBASE_URL={url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,844 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, scrolledtext, simpledialog, filedialog
+from datetime import datetime, timedelta
+import os
+import hashlib
+import threading
+import queue
+import db
+from cloud_sync import FirebaseSync
+from core import Cart, CheckoutService, InventoryService, ProductIndex, ReportingService, SyncService
+import perf
+from printing import open_printer, render_receipt
+import sales_export
+from timekeys import epoch_day
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PRINTER_NAME = "BTP-R880NP(U) 1"
+# win32:<name>, tcp:<host>[:port], file:/dev/usb/lp0 or fake (see printing.open_printer)
+PRINTER = os.environ.get("BOOKSHOP_PRINTER", f"win32:{PRINTER_NAME}")
+# 👇 REPLACE WITH YOUR ACTUAL FIREBASE DB URL (or set BOOKSHOP_FIREBASE_URL, e.g. to fake_firebase.py)
+FIREBASE_URL = os.environ.get("BOOKSHOP_FIREBASE_URL", "https://heriwadi-bookshop-default-rtdb.firebaseio.com")
+# Reports tab periods
+REPORT_RANGES = ("Today", "This Week", "This Month", "Custom...")
+# Days shown in the Till Performance summary
+PERF_SUMMARY_DAYS = 7
+
+# ==========================================
+# LOGIN WINDOW
+# ==========================================
+class LoginWindow:
+    def __init__(self, root, on_login_success):
+        self.root = root
+        self.on_login_success = on_login_success
+        self.root.title("Login - HERIWADI BOOKSHOP")
+        self.root.geometry("400x350")
+        
+        # UI Elements
+        tk.Label(root, text="LOGIN", font=('Arial', 18, 'bold')).pack(pady=20)
+        
+        tk.Label(root, text="Username").pack()
+        self.user_entry = tk.Entry(root, font=('Arial', 12))
+        self.user_entry.pack(pady=5)
+        
+        tk.Label(root, text="Password").pack()
+        self.pass_entry = tk.Entry(root, show="*", font=('Arial', 12))
+        self.pass_entry.pack(pady=5)
+        self.pass_entry.bind('<Return>', self.attempt_login)
+        
+        tk.Button(root, text="Login", command=self.attempt_login, bg="#4CAF50", fg="white", font=('Arial', 12), width=15).pack(pady=20)
+
+    def attempt_login(self, event=None):
+        username = self.user_entry.get().strip()
+        password = self.pass_entry.get().strip()
+        hashed_pw = hashlib.sha256(password.encode()).hexdigest()
+        
+        cursor = db.get_connection().cursor()
+        cursor.execute("SELECT role FROM users WHERE username=? AND password_hash=?", (username, hashed_pw))
+        result = cursor.fetchone()
+        
+        if result:
+            role = result[0]
+            # Clear login widgets
+            for widget in self.root.winfo_children():
+                widget.destroy()
+            self.on_login_success(username, role)
+        else:
+            messagebox.showerror("Error", "Invalid Username or Password")
+
+# ==========================================
+# BACKGROUND WORKERS
+# ==========================================
+class BackgroundWorker:
+    """
+    Runs jobs one at a time, in order, on a dedicated thread, and hands each
+    result (or exception) back to the Tk thread through root.after().
+    With connect_db=True the thread owns its own SQLite connection (self.conn).
+    """
+    def __init__(self, root, connect_db=False):
+        self.root = root
+        self.connect_db = connect_db
+        self.conn = None
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, job, on_done=None, on_error=None):
+        self.jobs.put((job, on_done, on_error))
+
+    def run(self):
+        if self.connect_db:
+            self.conn = db.get_connection()
+        while True:
+            job, on_done, on_error = self.jobs.get()
+            try:
+                result = job()
+            except Exception as e:
+                print(f"Background Job Error: {e}")
+                if on_error:
+                    self.root.after(0, lambda e=e: on_error(e))
+                continue
+            if on_done:
+                self.root.after(0, lambda r=result: on_done(r))
+
+# ==========================================
+# MAIN POS APPLICATION
+# ==========================================
+class BookshopPOS:
+    def __init__(self, root, username, role):
+        self.root = root
+        self.current_user = username
+        self.current_role = role 
+        
+        self.root.title(f"HERIWADI BOOKSHOP POS | User: {username} ({role})")
+        self.root.geometry("1300x750")
+        
+        # The Tk thread's connection; workers get their own (see db.py). Every statement is timed (see perf.py)
+        self.conn = perf.TimedConnection(db.get_connection())
+        self.cursor = self.conn.cursor()
+        # All cloud writes go through one pooled background worker
+        self.cloud = FirebaseSync(FIREBASE_URL, terminal=db.get_terminal_id(self.conn))
+        # Business logic lives in core.py; this class only drives the widgets
+        self.product_index = ProductIndex(self.cursor)
+        self.inventory = InventoryService(self.conn, self.cloud)
+        self.reports = ReportingService(self.conn)
+        self.checkout = CheckoutService(self.cloud)
+        self.sync = SyncService(self.cloud)
+        # Checkout commits and receipt printing run off the Tk thread
+        self.db_worker = BackgroundWorker(root, connect_db=True)
+        self.print_worker = BackgroundWorker(root)
+        self.export_worker = BackgroundWorker(root)
+        self.printer = open_printer(PRINTER)
+        perf.recorder.start()
+        
+        self.cart = Cart()
+        
+        self.create_ui()
+        
+        # Initial Load & Sync
+        self.refresh_inventory()
+        # Start background sync
+        threading.Thread(target=self.sync_inventory_from_firebase, daemon=True).start()
+
+    def create_ui(self):
+        # Tabs
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.pack(fill='both', expand=True)
+        
+        self.create_sales_tab()
+        self.create_inventory_tab()
+        self.create_reports_tab()
+        
+        # Bind Tab Change to refresh
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
+
+    def on_tab_change(self, event):
+        selected_tab = self.notebook.tab(self.notebook.select(), "text")
+        if selected_tab == "Reports":
+            self.generate_report()
+        elif selected_tab == "Inventory Management":
+            self.refresh_inventory()
+
+    # =========================================================================
+    # 🛒 SALES TAB (MODIFIED FOR DISCOUNT)
+    # =========================================================================
+    def create_sales_tab(self):
+        sales_frame = tk.Frame(self.notebook)
+        self.notebook.add(sales_frame, text="Sales Terminal")
+        
+        # LEFT SIDE: SEARCH & LIST
+        left_frame = tk.Frame(sales_frame, padx=10, pady=10)
+        left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # Search
+        search_frame = tk.Frame(left_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 10))
+        tk.Label(search_frame, text="Search (SKU/Title):").pack(side=tk.LEFT)
+        self.search_entry = tk.Entry(search_frame, font=('Arial', 12))
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.search_entry.bind('<Return>', self.on_search_enter)
+        tk.Button(search_frame, text="Search", command=self.search_product).pack(side=tk.LEFT)
+        # Scan mode: Enter on an exact SKU (barcode scanners send one) adds it straight to the cart
+        self.scan_mode = tk.BooleanVar(value=True)
+        tk.Checkbutton(search_frame, text="Scan Mode", variable=self.scan_mode).pack(side=tk.LEFT, padx=5)
+        
+        # Search Results List
+        columns = ('SKU', 'Title', 'Price', 'Stock')
+        self.search_tree = ttk.Treeview(left_frame, columns=columns, show='headings', height=15)
+        for col in columns:
+            self.search_tree.heading(col, text=col)
+            self.search_tree.column(col, width=100)
+        self.search_tree.column('Title', width=300)
+        self.search_tree.pack(fill=tk.BOTH, expand=True)
+        
+        # Add to Cart Button
+        tk.Button(left_frame, text="Add to Cart ➡", command=self.add_to_cart, bg="#2196F3", fg="white", font=('Arial', 12, 'bold')).pack(fill=tk.X, pady=10)
+
+        # RIGHT SIDE: CART & PAYMENT
+        right_frame = tk.Frame(sales_frame, padx=10, pady=10, bg="#f0f0f0", width=400)
+        right_frame.pack(side=tk.RIGHT, fill=tk.Y)
+        right_frame.pack_propagate(False)
+        
+        tk.Label(right_frame, text="CURRENT CART", bg="#f0f0f0", font=('Arial', 12, 'bold')).pack()
+        
+        self.cart_text = scrolledtext.ScrolledText(right_frame, height=15, width=40)
+        self.cart_text.pack(pady=5)
+        
+        # --- NEW DISCOUNT BUTTON ---
+        tk.Button(right_frame, text="✂ Apply Discount", command=self.prompt_discount, bg="orange", fg="black").pack(fill=tk.X, pady=5)
+        
+        # Totals
+        self.total_label = tk.Label(right_frame, text="Total: KES 0.00", font=('Arial', 16, 'bold'), bg="#f0f0f0", fg="red")
+        self.total_label.pack(pady=10)
+        
+        # Payment Input
+        tk.Label(right_frame, text="Amount Paid:", bg="#f0f0f0").pack()
+        self.amount_paid_entry = tk.Entry(right_frame, font=('Arial', 14))
+        self.amount_paid_entry.pack(pady=5)
+        self.amount_paid_entry.bind('<KeyRelease>', self.calculate_change)
+        
+        self.change_label = tk.Label(right_frame, text="Change: KES 0.00", font=('Arial', 12), bg="#f0f0f0")
+        self.change_label.pack(pady=5)
+        
+        # Payment Method
+        tk.Label(right_frame, text="Payment Method:", bg="#f0f0f0").pack()
+        self.payment_var = tk.StringVar(value="Cash")
+        ttk.Combobox(right_frame, textvariable=self.payment_var, values=["Cash", "M-Pesa", "Card"], state="readonly").pack(pady=5)
+        
+        # Buttons
+        tk.Button(right_frame, text="COMPLETE SALE", command=self.complete_sale, bg="#4CAF50", fg="white", font=('Arial', 14, 'bold'), height=2).pack(fill=tk.X, pady=(20, 5))
+        tk.Button(right_frame, text="Clear Cart", command=self.clear_cart, bg="#f44336", fg="white").pack(fill=tk.X)
+        self.sale_status_label = tk.Label(right_frame, text="", font=('Arial', 11, 'bold'), bg="#f0f0f0", wraplength=360)
+        self.sale_status_label.pack(pady=10)
+
+    # =========================================================================
+    # 📦 INVENTORY TAB
+    # =========================================================================
+    def create_inventory_tab(self):
+        inv_frame = tk.Frame(self.notebook)
+        self.notebook.add(inv_frame, text="Inventory Management")
+        
+        # Form
+        form_frame = tk.LabelFrame(inv_frame, text="Product Details", padx=10, pady=10)
+        form_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.inv_entries = {}
+        fields = ['SKU', 'Title', 'Author/Supplier', 'Category', 'Product Type', 'Sell Price', 'Cost Price', 'Stock']
+        
+        # Grid layout for form
+        for i, field in enumerate(fields):
+            row = i // 4
+            col = (i % 4) * 2
+            
+            # Helper for keys
+            key = field.lower().replace(' ', '_').replace('/', '_')
+            if field == 'Sell Price': key = 'price'
+            if field == 'Author/Supplier': key = 'author_supplier'
+            
+            # Hide Cost Price for Attendant
+            if key == 'cost_price' and self.current_role == "Attendant":
+                continue
+            
+            tk.Label(form_frame, text=field).grid(row=row, column=col, sticky='e', padx=5, pady=5)
+            
+            if field == 'Product Type':
+                entry = ttk.Combobox(form_frame, values=["Book", "Stationery", "Other"], state='readonly')
+            else:
+                entry = tk.Entry(form_frame)
+                
+            entry.grid(row=row, column=col+1, sticky='w', padx=5, pady=5)
+            self.inv_entries[key] = entry
+
+        # CRUD Buttons
+        btn_frame = tk.Frame(form_frame)
+        btn_frame.grid(row=2, column=0, columnspan=8, pady=10)
+        
+        tk.Button(btn_frame, text="New", command=self.reset_form_for_new).pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Add Product", command=self.add_product, bg="#2196F3", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Update Selected", command=self.update_product, bg="orange").pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Delete Selected", command=self.delete_product, bg="red", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Sync from Cloud", command=lambda: threading.Thread(target=self.sync_inventory_from_firebase, daemon=True).start(), bg="purple", fg="white").pack(side=tk.LEFT, padx=5)
+
+        # Inventory List
+        cols = ('SKU', 'Title', 'Type', 'Price', 'Cost', 'Stock')
+        self.inventory_tree = ttk.Treeview(inv_frame, columns=cols, show='headings')
+        for c in cols:
+            self.inventory_tree.heading(c, text=c)
+            self.inventory_tree.column(c, width=80)
+        self.inventory_tree.column('Title', width=200)
+        
+        # Hide cost column if attendant
+        if self.current_role == "Attendant":
+            self.inventory_tree.column('Cost', width=0, stretch=False)
+
+        # Pager (keyset pagination over the SKU index)
+        self.inv_page_after = [None]   # stack: the page shows SKUs after this key
+        self.inv_has_next = False
+        self.inv_rows = {}             # sku -> row currently shown, to update only what changed
+        nav_frame = tk.Frame(inv_frame)
+        nav_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 5))
+        tk.Button(nav_frame, text="◀ Prev", command=self.inventory_prev_page).pack(side=tk.LEFT)
+        self.inv_page_label = tk.Label(nav_frame, text="Page 1")
+        self.inv_page_label.pack(side=tk.LEFT, padx=10)
+        tk.Button(nav_frame, text="Next ▶", command=self.inventory_next_page).pack(side=tk.LEFT)
+            
+        self.inventory_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        if self.current_role != "Attendant":
+            self.inventory_tree.bind('<<TreeviewSelect>>', self.on_inventory_select)
+
+    # =========================================================================
+    # 📈 REPORTS TAB
+    # =========================================================================
+    def create_reports_tab(self):
+        rep_frame = tk.Frame(self.notebook)
+        self.notebook.add(rep_frame, text="Reports")
+        
+        # Controls
+        ctrl_frame = tk.Frame(rep_frame, pady=10)
+        ctrl_frame.pack(fill=tk.X)
+        tk.Label(ctrl_frame, text="Period:").pack(side=tk.LEFT, padx=(10, 0))
+        self.report_range = tk.StringVar(value="Today")
+        range_box = ttk.Combobox(ctrl_frame, textvariable=self.report_range, values=list(REPORT_RANGES), state="readonly", width=12)
+        range_box.pack(side=tk.LEFT, padx=5)
+        range_box.bind('<<ComboboxSelected>>', self.on_report_range)
+        self.report_custom = None  # (from_day, to_day) picked for "Custom..."
+        tk.Button(ctrl_frame, text="Refresh Reports", command=self.generate_report).pack(side=tk.LEFT, padx=10)
+        tk.Button(ctrl_frame, text="Product Performance", command=self.show_product_performance).pack(side=tk.LEFT, padx=10)
+        tk.Button(ctrl_frame, text="Till Performance", command=self.show_perf_summary).pack(side=tk.LEFT, padx=10)
+        
+        if self.current_role == "Director":
+            tk.Button(ctrl_frame, text="Export Sales", command=self.export_sales_prompt).pack(side=tk.LEFT, padx=10)
+            tk.Button(ctrl_frame, text="Delete Selected Sale", command=self.delete_sale_prompt, bg="red", fg="white").pack(side=tk.RIGHT, padx=10)
+
+        # Summary Text
+        self.reports_text = scrolledtext.ScrolledText(rep_frame, height=14)
+        self.reports_text.pack(fill=tk.X, padx=10)
+        
+        # Sales List
+        cols = ('ID', 'Total', 'Discount', 'Date')
+        self.sales_tree = ttk.Treeview(rep_frame, columns=cols, show='headings')
+        self.sales_tree.heading('ID', text='ID')
+        self.sales_tree.heading('Total', text='Total Amount')
+        self.sales_tree.heading('Discount', text='Discount')
+        self.sales_tree.heading('Date', text='Date')
+        self.sales_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    # =========================================================================
+    # LOGIC: SEARCH, CART, DISCOUNT, SALE
+    # =========================================================================
+    @perf.timed('search_product', detail=lambda self: self.search_entry.get())
+    def search_product(self):
+        self.search_tree.delete(*self.search_tree.get_children())
+        for row in self.inventory.search(self.search_entry.get()):
+            self.search_tree.insert('', 'end', values=row)
+
+    def on_search_enter(self, event=None):
+        if self.scan_mode.get() and self.scan_to_cart():
+            return
+        self.search_product()
+
+    def scan_to_cart(self):
+        """Barcode fast path: exact SKU from the in-memory index, no query, no results tree."""
+        sku = self.search_entry.get().strip()
+        item = self.product_index.get(sku)
+        if item is None:
+            return False
+        title, price, cost, stock = item
+        if stock <= 0:
+            messagebox.showwarning("Out of Stock", f"{title} is out of stock!")
+            self.search_entry.delete(0, 'end')
+            return True
+        self.add_item_to_cart(sku, title, float(price), cost, int(stock))
+        return True
+
+    def add_to_cart(self):
+        selected_item = self.search_tree.selection()
+        if not selected_item:
+            return
+        
+        item_values = self.search_tree.item(selected_item[0])['values']
+        sku, title, price, stock = str(item_values[0]), item_values[1], float(item_values[2]), int(item_values[3])
+        
+        # Get cost price for profit calc
+        indexed = self.product_index.get(sku)
+        cost = indexed[2] if indexed else 0.0
+        self.add_item_to_cart(sku, title, price, cost, stock)
+
+    def add_item_to_cart(self, sku, title, price, cost, stock):
+        try:
+            self.cart.add(sku, title, price, cost, stock)
+        except ValueError as e:
+            messagebox.showwarning("Stock Limit", str(e))
+            return
+        self.update_cart_display()
+        
+        # Clear search for next item
+        self.search_entry.delete(0, 'end')
+        self.search_entry.focus()
+
+    def prompt_discount(self):
+        """Allows user to enter a discount amount"""
+        if not self.cart.items:
+            messagebox.showwarning("Empty Cart", "Add items before giving a discount.")
+            return
+
+        amount = simpledialog.askfloat("Input Discount", f"Enter Discount Amount (Max {self.cart.subtotal}):", parent=self.root)
+        
+        if amount is not None:
+            try:
+                self.cart.set_discount(amount)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.update_cart_display()
+
+    def update_cart_display(self):
+        self.cart_text.delete(1.0, tk.END)
+        
+        self.cart_text.insert(tk.END, f"{'ITEM':<20} {'QTY':<5} {'TOTAL':<10}\n")
+        self.cart_text.insert(tk.END, "-"*40 + "\n")
+        
+        for item in self.cart.items:
+            line_total = item['price'] * item['qty']
+            self.cart_text.insert(tk.END, f"{item['title'][:18]:<20} {item['qty']:<5} {line_total:<10.2f}\n")
+        
+        self.cart_text.insert(tk.END, "-"*40 + "\n")
+        self.cart_text.insert(tk.END, f"Subtotal: {self.cart.subtotal:,.2f}\n")
+        if self.cart.discount > 0:
+            self.cart_text.insert(tk.END, f"Discount: -{self.cart.discount:,.2f}\n")
+        
+        self.total_label.config(text=f"Total: KES {self.cart.total:,.2f}")
+        
+        # Recalculate change if user already typed amount
+        self.calculate_change()
+
+    def calculate_change(self, event=None):
+        try:
+            paid_str = self.amount_paid_entry.get()
+            if not paid_str:
+                self.change_label.config(text="Change: KES 0.00")
+                return
+                
+            paid = float(paid_str)
+            change = paid - self.cart.total
+            self.change_label.config(text=f"Change: KES {change:,.2f}")
+        except ValueError:
+            pass
+
+    def clear_cart(self):
+        self.cart.clear()
+        self.update_cart_display()
+        self.amount_paid_entry.delete(0, tk.END)
+        self.change_label.config(text="Change: KES 0.00")
+
+    @perf.timed('complete_sale')
+    def complete_sale(self):
+        """
+        Validates on the Tk thread, then hands a snapshot of the cart to the
+        DB worker and clears the till straight away. The commit result comes
+        back through root.after(); the receipt goes to the print queue.
+        """
+        if not self.cart.items:
+            messagebox.showwarning("Warning", "Cart is empty")
+            return
+        
+        try:
+            paid = float(self.amount_paid_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid Amount Paid")
+            return
+        try:
+            sale = self.cart.checkout(paid, self.payment_var.get(), self.current_user)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        self.db_worker.submit(lambda: self.commit_sale(sale),
+                              on_done=lambda sale_id: self.on_sale_committed(sale, sale_id),
+                              on_error=lambda e: self.on_sale_failed(sale, e))
+
+        self.clear_cart()
+        self.sale_status_label.config(text=f"Saving sale... Change: KES {sale['change']:,.2f}", fg="black")
+        self.search_entry.focus()
+
+    @perf.timed('commit_sale')
+    def commit_sale(self, sale):
+        """Runs on the DB worker thread, with its own connection. Returns the new sale id."""
+        return self.checkout.commit_sale(perf.TimedConnection(self.db_worker.conn), sale)
+
+    def on_sale_committed(self, sale, sale_id):
+        # 4. Print Receipt (print queue thread)
+        self.print_worker.submit(lambda: self.print_receipt(sale))
+        self.sale_status_label.config(text=f"Sale #{sale_id} complete. Change: KES {sale['change']:,.2f}", fg="green")
+        self.product_index.refresh_skus([i['sku'] for i in sale['items']])
+        self.refresh_inventory()
+
+    def on_sale_failed(self, sale, error):
+        self.sale_status_label.config(text="Sale NOT saved", fg="red")
+        # Put the items back unless the cashier has already started the next customer
+        if not self.cart.items:
+            self.cart.restore(sale)
+            self.update_cart_display()
+        messagebox.showerror("Error", f"Sale was not saved: {error}")
+
+    @perf.timed('print_receipt')
+    def print_receipt(self, data):
+        """Both copies go to the printer as one pre-rendered ESC/POS job."""
+        if not self.printer:
+            return
+        try:
+            self.printer.send(render_receipt(data, self.current_user))
+        except Exception as e:
+            print(f"Printing Error: {e}")
+
+    # =========================================================================
+    # INVENTORY LOGIC (CRUD)
+    # =========================================================================
+    @perf.timed('sync_inventory')
+    def sync_inventory_from_firebase(self):
+        """Background thread: pulls what changed in the cloud catalogue (see SyncService.pull_products)."""
+        conn = db.connect()
+        try:
+            changes = self.sync.pull_products(perf.TimedConnection(conn))
+            if changes and (changes[0] or changes[1]):
+                # Use after() to update UI from main thread
+                self.root.after(0, lambda: self.product_index.apply_sync(*changes))
+                self.root.after(0, self.refresh_inventory)
+        except Exception as e:
+            print(f"Sync Error: {e}")
+        finally:
+            conn.close()
+
+    @perf.timed('refresh_inventory')
+    def refresh_inventory(self):
+        """
+        Re-reads only the visible page (one InventoryService.page, keyset on
+        sku) and patches the tree in place: unchanged rows are left alone,
+        changed rows are updated, and only new or vanished rows are inserted
+        or removed.
+        """
+        rows, self.inv_has_next = self.inventory.page(self.inv_page_after[-1])
+        self.inv_page_label.config(text=f"Page {len(self.inv_page_after)}")
+
+        new_rows = {str(row[0]): row for row in rows}
+        for sku in [s for s in self.inv_rows if s not in new_rows]:
+            self.inventory_tree.delete(sku)
+        for index, (sku, row) in enumerate(new_rows.items()):
+            if sku not in self.inv_rows:
+                self.inventory_tree.insert('', index, iid=sku, values=row)
+                continue
+            if self.inv_rows[sku] != row:
+                self.inventory_tree.item(sku, values=row)
+            if self.inventory_tree.index(sku) != index:
+                self.inventory_tree.move(sku, '', index)
+        self.inv_rows = new_rows
+
+    def inventory_next_page(self):
+        if not self.inv_has_next or not self.inv_rows: return
+        self.inv_page_after.append(list(self.inv_rows)[-1])
+        self.refresh_inventory()
+
+    def inventory_prev_page(self):
+        if len(self.inv_page_after) == 1: return
+        self.inv_page_after.pop()
+        self.refresh_inventory()
+
+    def reset_form_for_new(self):
+        if self.current_role == "Attendant": return
+        for k, v in self.inv_entries.items():
+            v.config(state='normal')
+            if isinstance(v, ttk.Combobox): v.set('')
+            else: v.delete(0, tk.END)
+        self.inv_entries['sku'].config(bg="white")
+
+    def on_inventory_select(self, event):
+        selected = self.inventory_tree.selection()
+        if not selected: return
+        values = self.inventory_tree.item(selected[0])['values']
+        
+        self.reset_form_for_new()
+        
+        # Populate basic fields
+        self.inv_entries['sku'].insert(0, values[0])
+        self.inv_entries['title'].insert(0, values[1])
+        self.inv_entries['product_type'].set(values[2])
+        self.inv_entries['price'].insert(0, values[3])
+        self.inv_entries['cost_price'].insert(0, values[4])
+        self.inv_entries['stock'].insert(0, values[5])
+        
+        # Get extra fields
+        res = self.inventory.details(values[0])
+        if res:
+            self.inv_entries['author_supplier'].insert(0, res[0])
+            self.inv_entries['category'].insert(0, res[1])
+            
+        # Lock SKU
+        self.inv_entries['sku'].config(state='readonly', bg="#cccccc")
+
+    def add_product(self):
+        try:
+            data = {k: v.get() for k, v in self.inv_entries.items()}
+            if not data['sku'] or not data['title']: return
+            
+            self.inventory.add_product(data)
+            self.product_index.refresh_skus([data['sku']])
+            
+            messagebox.showinfo("Success", "Product Added")
+            self.refresh_inventory()
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def update_product(self):
+        try:
+            data = {k: v.get() for k, v in self.inv_entries.items()}
+            self.inventory.update_product(data)
+            self.product_index.refresh_skus([data['sku']])
+            
+            messagebox.showinfo("Success", "Product Updated")
+            self.refresh_inventory()
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def delete_product(self):
+        sku = self.inv_entries['sku'].get()
+        if not sku: return
+        if messagebox.askyesno("Confirm", "Delete this product?"):
+            self.inventory.delete_product(sku)
+            self.product_index.refresh_skus([sku])
+            self.refresh_inventory()
+            self.reset_form_for_new()
+
+    # =========================================================================
+    # REPORTS
+    # =========================================================================
+    def on_report_range(self, event=None):
+        if self.report_range.get() == "Custom...":
+            today = datetime.now().strftime('%Y-%m-%d')
+            prev = self.report_custom or (today, today)
+            start = simpledialog.askstring("Custom Range", "From (YYYY-MM-DD):", initialvalue=prev[0], parent=self.root)
+            end = start and simpledialog.askstring("Custom Range", "To (YYYY-MM-DD):", initialvalue=prev[1], parent=self.root)
+            try:
+                self.report_custom = tuple(datetime.strptime(d.strip(), '%Y-%m-%d').strftime('%Y-%m-%d') for d in (start, end))
+            except (AttributeError, ValueError):
+                if end: messagebox.showerror("Error", "Dates must be YYYY-MM-DD")
+                if not self.report_custom: self.report_range.set("Today")
+        self.generate_report()
+
+    def report_period(self):
+        """(label, from_day, to_day) for the selected Reports period, as integer day keys."""
+        today = datetime.now().date()
+        choice = self.report_range.get()
+        if choice == "Custom..." and self.report_custom:
+            start, end = self.report_custom
+            return (f"{start} TO {end}", epoch_day(datetime.strptime(start, '%Y-%m-%d')), epoch_day(datetime.strptime(end, '%Y-%m-%d')))
+        if choice == "This Week":
+            start = today - timedelta(days=today.weekday())
+        elif choice == "This Month":
+            start = today.replace(day=1)
+        else:
+            return (f"TODAY ({today})", epoch_day(today), epoch_day(today))
+        return (f"{choice.upper()} ({start} TO {today})", epoch_day(start), epoch_day(today))
+
+    @perf.timed('generate_report', detail=lambda self: self.report_range.get())
+    def generate_report(self):
+        """Reads the daily rollups, so the cost depends on the number of days shown, not on the number of sales."""
+        label, start, end = self.report_period()
+
+        self.sales_tree.delete(*self.sales_tree.get_children())
+        self.reports_text.delete(1.0, tk.END)
+
+        res_period = self.reports.totals(start, end)
+        res_all = self.reports.totals()
+        methods = self.reports.payment_mix(start, end)
+
+        rpt = f"--- {label} ---\n"
+        rpt += self.format_totals(*res_period)
+        for method, revenue, count in methods:
+            rpt += f"  {method:<10} KES {revenue:,.2f} ({count})\n"
+        rpt += "\n--- ALL TIME ---\n"
+        rpt += self.format_totals(*res_all)
+
+        self.reports_text.insert(tk.END, rpt)
+        
+        # Fill List
+        for r in self.reports.recent_sales():
+            self.sales_tree.insert('', 'end', values=r)
+
+    @staticmethod
+    def format_totals(revenue, discount, profit, count):
+        txt = f"Revenue:  KES {revenue:,.2f}\n"
+        txt += f"Discount: KES {discount:,.2f}\n"
+        txt += f"Profit:   KES {profit:,.2f}\n"
+        txt += f"Sales:    {count}"
+        if count:
+            txt += f" (avg KES {revenue / count:,.2f})"
+        return txt + "\n"
+
+    def show_product_performance(self):
+        """Best sellers and slow movers over the last N days, from sale_items."""
+        days = simpledialog.askinteger("Product Performance", "Look back how many days?", initialvalue=7, minvalue=1, parent=self.root)
+        if not days: return
+        since = (datetime.now() - timedelta(days=days - 1)).date()
+
+        best, slow = self.reports.product_performance(epoch_day(since))
+
+        win = tk.Toplevel(self.root)
+        win.title(f"Product Performance (since {since})")
+        win.geometry("700x600")
+        txt = scrolledtext.ScrolledText(win, font=('Courier', 10))
+        txt.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        rpt = f"--- BEST SELLERS (since {since}) ---\n"
+        rpt += f"{'SKU':<16} {'TITLE':<28} {'UNITS':>6} {'REVENUE':>12}\n"
+        for sku, units, revenue in best:
+            item = self.product_index.get(sku)
+            title = item[0] if item else ''
+            rpt += f"{str(sku)[:16]:<16} {str(title)[:28]:<28} {units:>6} {revenue:>12,.2f}\n"
+        rpt += f"\n--- SLOW MOVERS (in stock, since {since}) ---\n"
+        rpt += f"{'SKU':<16} {'TITLE':<28} {'UNITS':>6} {'STOCK':>6}\n"
+        for sku, title, stock, units in slow:
+            rpt += f"{str(sku)[:16]:<16} {str(title)[:28]:<28} {units:>6} {stock:>6}\n"
+        txt.insert(tk.END, rpt)
+
+    def show_perf_summary(self):
+        """p50/p95 per timed operation per day (see perf.py); slow calls are itemized in the slow log."""
+        rows = perf.recorder.summary(self.conn, PERF_SUMMARY_DAYS)
+
+        win = tk.Toplevel(self.root)
+        win.title(f"Till Performance (last {PERF_SUMMARY_DAYS} days)")
+        win.geometry("640x500")
+        txt = scrolledtext.ScrolledText(win, font=('Courier', 10))
+        txt.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        rpt = f"Slow calls (>= {perf.recorder.threshold_ms:g} ms) are logged to {os.path.abspath(perf.recorder.log_path)}\n\n"
+        rpt += f"{'DAY':<12} {'OPERATION':<20} {'CALLS':>8} {'P50 MS':>10} {'P95 MS':>10}\n"
+        for day, op, count, p50, p95 in rows:
+            rpt += f"{day:<12} {op:<20} {count:>8} {p50:>10.2f} {p95:>10.2f}\n"
+        if not rows:
+            rpt += "No timings recorded yet.\n"
+        txt.insert(tk.END, rpt)
+
+    def export_sales_prompt(self):
+        """Date-range export dialog; the export itself streams on the export worker (see sales_export.py)."""
+        win = tk.Toplevel(self.root)
+        win.title("Export Sales")
+        win.geometry("380x280")
+        today = datetime.now()
+
+        form = tk.Frame(win, padx=10, pady=10)
+        form.pack(fill=tk.X)
+        tk.Label(form, text="From (YYYY-MM-DD)").grid(row=0, column=0, sticky='w', pady=3)
+        from_entry = tk.Entry(form)
+        from_entry.insert(0, today.replace(month=1, day=1).strftime('%Y-%m-%d'))
+        from_entry.grid(row=0, column=1, pady=3)
+        tk.Label(form, text="To (YYYY-MM-DD)").grid(row=1, column=0, sticky='w', pady=3)
+        to_entry = tk.Entry(form)
+        to_entry.insert(0, today.strftime('%Y-%m-%d'))
+        to_entry.grid(row=1, column=1, pady=3)
+        tk.Label(form, text="Format").grid(row=2, column=0, sticky='w', pady=3)
+        fmt_var = tk.StringVar(value="CSV (gzip)")
+        ttk.Combobox(form, textvariable=fmt_var, values=list(sales_export.FORMATS), state="readonly").grid(row=2, column=1, pady=3)
+        items_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(form, text="One row per item sold", variable=items_var).grid(row=3, column=0, columnspan=2, sticky='w')
+        if "Parquet" not in sales_export.FORMATS:
+            tk.Label(form, text="Parquet export needs pyarrow (pip install pyarrow)", fg="gray").grid(row=4, column=0, columnspan=2, sticky='w')
+
+        progress = ttk.Progressbar(win, mode='determinate', maximum=1)
+        progress.pack(fill=tk.X, padx=10, pady=5)
+        status = tk.Label(win, text="")
+        status.pack()
+
+        def show_progress(done, total):
+            if win.winfo_exists():  # the dialog may have been closed mid-export
+                progress.config(maximum=max(total, 1), value=done)
+                status.config(text=f"{done:,} / {total:,} rows")
+
+        def on_progress(done, total):
+            # Called on the export thread
+            self.root.after(0, lambda: show_progress(done, total))
+
+        def start():
+            try:
+                start_day = datetime.strptime(from_entry.get().strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+                end_day = datetime.strptime(to_entry.get().strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD", parent=win)
+                return
+            fmt = fmt_var.get()
+            ext = sales_export.FORMATS[fmt]
+            path = filedialog.asksaveasfilename(parent=win, defaultextension=ext,
+                                                initialfile=f"sales_{start_day}_{end_day}{ext}")
+            if not path: return
+            export_btn.config(state='disabled')
+            status.config(text="Exporting...")
+
+            def job():
+                conn = db.connect()
+                try:
+                    return sales_export.export_sales(conn, path, start_day, end_day, fmt, items_var.get(), on_progress)
+                finally:
+                    conn.close()
+
+            def done(rows):
+                messagebox.showinfo("Export", f"{rows:,} rows exported to {path}")
+                if win.winfo_exists():
+                    status.config(text=f"Exported {rows:,} rows")
+                    export_btn.config(state='normal')
+
+            def failed(e):
+                messagebox.showerror("Error", f"Export failed: {e}")
+                if win.winfo_exists():
+                    status.config(text="Export failed")
+                    export_btn.config(state='normal')
+
+            self.export_worker.submit(job, on_done=done, on_error=failed)
+
+        export_btn = tk.Button(win, text="Export", command=start, bg="#4CAF50", fg="white", width=15)
+        export_btn.pack(pady=5)
+
+    def delete_sale_prompt(self):
+        selected = self.sales_tree.selection()
+        if not selected: return
+        sale_id = self.sales_tree.item(selected[0])['values'][0]
+        
+        if messagebox.askyesno("Delete Sale", "This will revert stock counts locally.\nContinue?"):
+            try:
+                skus = self.checkout.delete_sale(self.conn, sale_id)
+            except Exception as e:
+                messagebox.showerror("Error", f"Sale was not deleted: {e}")
+                # Nothing was written; reload in case the list is out of date (e.g. the sale is already gone)
+                self.generate_report()
+                return
+            self.product_index.refresh_skus(skus)
+            
+            messagebox.showinfo("Deleted", "Sale deleted and stock reverted.")
+            self.generate_report()
+            self.refresh_inventory()
+
+if __name__ == "__main__":
+    db.get_connection()  # opens the database and runs migrations
+    root = tk.Tk()
+    LoginWindow(root, lambda u, r: BookshopPOS(root, u, r))
+    root.mainloop()
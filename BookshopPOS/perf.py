@@ -0,0 +1,198 @@
+import functools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from logging.handlers import RotatingFileHandler
+import db
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Operations and SQL statements at or over this many milliseconds go to the slow log
+SLOW_OP_MS = float(os.environ.get("BOOKSHOP_SLOW_MS", "200"))
+SLOW_LOG_PATH = os.environ.get("BOOKSHOP_SLOW_LOG", "bookshop_slow.log")
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+SLOW_LOG_DETAIL_CHARS = 200
+# Timings are kept as counts per log-scale bucket: bucket i holds
+# (BUCKET_BASE_MS * g^i, BUCKET_BASE_MS * g^(i+1)], so percentiles are within ~10%
+BUCKET_BASE_MS = 0.01
+BUCKET_GROWTH = 1.2
+# Pending counts are written to op_timings this often
+FLUSH_SECONDS = 30
+
+def bucket_of(ms):
+    return int(math.log(ms / BUCKET_BASE_MS, BUCKET_GROWTH)) if ms > BUCKET_BASE_MS else 0
+
+def bucket_ms(bucket):
+    """Representative value (geometric middle) of a bucket."""
+    return BUCKET_BASE_MS * BUCKET_GROWTH ** (bucket + 0.5)
+
+# ==========================================
+# RECORDER
+# ==========================================
+class PerfRecorder:
+    """
+    Times till operations and SQL statements. Each timing costs a clock read
+    and a dict update; counts per (day, op, bucket) are written to the
+    op_timings table in the background, which is all the p50/p95 summary
+    needs. Anything at or over the threshold is also written, with its
+    details, to a rotating slow-operation log.
+    """
+    def __init__(self, threshold_ms=SLOW_OP_MS, log_path=SLOW_LOG_PATH):
+        self.threshold_ms = threshold_ms
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)  # (day, op, bucket) -> count
+        self.logger = None
+        self.flusher = None
+
+    def record(self, op, seconds, detail=None):
+        ms = seconds * 1000
+        key = (time.strftime('%Y-%m-%d'), op, bucket_of(ms))
+        with self.lock:
+            self.pending[key] += 1
+        if ms >= self.threshold_ms:
+            self.log_slow(op, ms, detail)
+
+    def log_slow(self, op, ms, detail):
+        if self.logger is None:
+            with self.lock:
+                if self.logger is None:
+                    logger = logging.getLogger("bookshop.slow")
+                    handler = RotatingFileHandler(self.log_path, maxBytes=SLOW_LOG_BYTES,
+                                                  backupCount=SLOW_LOG_BACKUPS, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter("%(asctime)s [%(threadName)s] %(message)s"))
+                    logger.addHandler(handler)
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    self.logger = logger
+        detail = ' '.join(str(detail).split())[:SLOW_LOG_DETAIL_CHARS] if detail else ''
+        self.logger.warning(f"SLOW {op} {ms:.1f} ms {detail}".rstrip())
+
+    def timed(self, op, detail=None):
+        """Method decorator; `detail` gets the same arguments and describes the call in the slow log."""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.record(op, elapsed, detail(*args, **kwargs) if detail and elapsed * 1000 >= self.threshold_ms else None)
+            return wrapper
+        return decorate
+
+    # --- Storage ---
+    def flush(self, conn):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+        if not pending: return
+        try:
+            conn.executemany('''
+                INSERT INTO op_timings (day, op, bucket, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, op, bucket) DO UPDATE SET count = count + excluded.count
+            ''', [(day, op, bucket, count) for (day, op, bucket), count in pending.items()])
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Perf Flush Error: {e}")
+            with self.lock:
+                for key, count in pending.items():
+                    self.pending[key] += count
+
+    def start(self):
+        """Starts the background flusher (once)."""
+        if self.flusher: return
+        def run():
+            conn = db.connect()
+            while True:
+                time.sleep(FLUSH_SECONDS)
+                self.flush(conn)
+        self.flusher = threading.Thread(target=run, daemon=True, name="perf-flush")
+        self.flusher.start()
+
+    def summary(self, conn, days=7):
+        """(day, op, count, p50_ms, p95_ms) for the last `days` days, newest day first."""
+        self.flush(conn)
+        since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        groups = defaultdict(list)
+        for day, op, bucket, count in conn.execute(
+                "SELECT day, op, bucket, count FROM op_timings WHERE day >= ? ORDER BY day DESC, op, bucket", (since,)):
+            groups[(day, op)].append((bucket, count))
+        rows = []
+        for (day, op), buckets in groups.items():
+            total = sum(c for _, c in buckets)
+            rows.append((day, op, total, self.percentile(buckets, total, 0.50), self.percentile(buckets, total, 0.95)))
+        return rows
+
+    @staticmethod
+    def percentile(buckets, total, q):
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen >= q * total:
+                return bucket_ms(bucket)
+        return bucket_ms(buckets[-1][0])
+
+recorder = PerfRecorder()
+timed = recorder.timed
+
+# ==========================================
+# SQL TIMING
+# ==========================================
+class TimedCursor:
+    """
+    sqlite3 cursor stand-in that times every execute/executemany under the
+    'sql' operation, with the statement as the slow-log detail. Rows read
+    later by iterating or fetching are not part of the timing.
+    """
+    def __init__(self, cursor, recorder=recorder):
+        self._cursor = cursor
+        self._recorder = recorder
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._recorder.record('sql', time.perf_counter() - start, sql)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._recorder.record('sql', time.perf_counter() - start, sql)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TimedConnection:
+    """Connection stand-in whose cursors are TimedCursors; everything else goes to the real connection."""
+    def __init__(self, conn, recorder=recorder):
+        self._conn = conn
+        self._recorder = recorder
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._recorder)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,228 @@
+import os
+import select
+import socket
+import threading
+
+# --- TRY IMPORTING PRINTER LIBRARIES ---
+try:
+    import win32print
+except ImportError:
+    win32print = None
+
+# ==========================================
+# ESC/POS
+# ==========================================
+ESC_INIT = b'\x1b\x40'
+# Feed and partial cut (GS V 66 0)
+ESC_CUT = b'\x1d\x56\x42\x00'
+RECEIPT_ENCODING = 'utf-8'
+
+SOCKET_TIMEOUT = 10
+
+def render_receipt(data, served_by, copies=("*** CUSTOMER COPY ***", "*** SHOP COPY ***")):
+    """Renders every copy of a receipt into one ESC/POS buffer, each copy ending in a paper cut."""
+    txt = "      HERIWADI BOOKSHOP      \n"
+    txt += "      Tel: 0700-000-000      \n"
+    txt += "-----------------------------\n"
+    txt += f"Date: {data['date']}\n"
+    txt += f"Served by: {served_by}\n"
+    txt += "-----------------------------\n"
+    txt += "ITEM             QTY    TOTAL\n"
+    for item in data['items']:
+        # Truncate title if too long
+        title = (item['title'][:14] + '..') if len(item['title']) > 14 else item['title']
+        txt += f"{title:<16} {item['qty']:<3} {item['price']*item['qty']:>8.2f}\n"
+    txt += "-----------------------------\n"
+    txt += f"SUBTOTAL:      KES {data['subtotal']:,.2f}\n"
+    if data['discount'] > 0:
+        txt += f"DISCOUNT:     -KES {data['discount']:,.2f}\n"
+    txt += f"TOTAL:         KES {data['total']:,.2f}\n"
+    txt += "-----------------------------\n"
+    txt += f"PAID:          KES {data['paid']:,.2f}\n"
+    txt += f"CHANGE:        KES {data['change']:,.2f}\n"
+    txt += "-----------------------------\n"
+    txt += "      Thank You! Karibu!      \n\n\n\n"
+
+    body = txt.encode(RECEIPT_ENCODING)
+    buf = bytearray(ESC_INIT)
+    for copy in copies:
+        buf += f"{copy}\n".encode(RECEIPT_ENCODING) + body + ESC_CUT
+    return bytes(buf)
+
+# ==========================================
+# PRINTER BACKENDS
+# ==========================================
+class PrinterUnavailable(Exception):
+    """Nothing of the job reached the printer, so sending it again cannot print it twice."""
+
+class Printer:
+    """
+    A receipt printer that stays open between jobs. send() writes one
+    pre-rendered job. If it fails before any of the job went out (the
+    connection had gone stale, or the device was unplugged), the printer is
+    reopened once and the job retried, so a printer that was power-cycled
+    recovers by itself. Anything that fails mid-job, timeouts included, is
+    raised instead: the receipt may already be on paper.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handle = None
+
+    def send(self, job):
+        with self.lock:
+            try:
+                self.attempt(job)
+            except PrinterUnavailable:
+                self.attempt(job)
+
+    def attempt(self, job):
+        try:
+            if self.handle is None:
+                try:
+                    self.handle = self.open()
+                except Exception as e:
+                    raise PrinterUnavailable(e) from e
+            self.write(job)
+        except Exception:
+            # Whatever happened, the next job starts on a fresh connection
+            self.close_handle()
+            raise
+
+    def close(self):
+        with self.lock:
+            self.close_handle()
+
+    def close_handle(self):
+        if self.handle is not None:
+            try:
+                self.release()
+            except Exception:
+                pass
+            self.handle = None
+
+    def open(self):
+        raise NotImplementedError
+
+    def write(self, job):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+class Win32Printer(Printer):
+    """Windows spooler printer, sent RAW so the ESC/POS codes pass through."""
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def open(self):
+        return win32print.OpenPrinter(self.name)
+
+    def write(self, job):
+        try:
+            win32print.StartDocPrinter(self.handle, 1, ("Receipt", None, "RAW"))
+        except Exception as e:
+            raise PrinterUnavailable(e) from e
+        try:
+            win32print.StartPagePrinter(self.handle)
+            win32print.WritePrinter(self.handle, job)
+            win32print.EndPagePrinter(self.handle)
+        finally:
+            win32print.EndDocPrinter(self.handle)
+
+    def release(self):
+        win32print.ClosePrinter(self.handle)
+
+class NetworkPrinter(Printer):
+    """Raw TCP (JetDirect, port 9100) printer."""
+    def __init__(self, host, port=9100):
+        super().__init__()
+        self.host = host
+        self.port = port
+
+    def open(self):
+        sock = socket.create_connection((self.host, self.port), timeout=SOCKET_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def write(self, job):
+        # A printer that was power-cycled has dropped the connection, but the OS
+        # would still accept the job; check for the hang-up before sending
+        if select.select([self.handle], [], [], 0)[0]:
+            try:
+                if not self.handle.recv(1, socket.MSG_PEEK):
+                    raise PrinterUnavailable("connection closed by printer")
+            except OSError as e:
+                raise PrinterUnavailable(e) from e
+        view = memoryview(job)
+        sent = 0
+        try:
+            while sent < len(view):
+                sent += self.handle.send(view[sent:])
+        except socket.timeout:
+            raise
+        except OSError as e:
+            if sent:
+                raise
+            raise PrinterUnavailable(e) from e
+
+    def release(self):
+        self.handle.close()
+
+class DevicePrinter(Printer):
+    """Character device (e.g. /dev/usb/lp0) or plain file; a file doubles as a spool for testing."""
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def open(self):
+        return open(self.path, 'ab', buffering=0)
+
+    def write(self, job):
+        view = memoryview(job)
+        written = 0
+        try:
+            while written < len(view):
+                written += self.handle.write(view[written:])
+        except OSError as e:
+            if written:
+                raise
+            raise PrinterUnavailable(e) from e
+
+    def release(self):
+        self.handle.close()
+
+class FakePrinter(Printer):
+    """Keeps jobs in memory; for tests and tills without a printer."""
+    def __init__(self):
+        super().__init__()
+        self.jobs = []
+
+    def open(self):
+        return self.jobs
+
+    def write(self, job):
+        self.jobs.append(job)
+
+def open_printer(spec):
+    """
+    Builds a printer from a spec string:
+      win32:<printer name>   Windows spooler
+      tcp:<host>[:<port>]    raw socket, port 9100 by default
+      file:<path>            USB device node or spool file
+      fake                   in-memory
+    """
+    kind, _, target = spec.partition(':')
+    if kind == 'win32':
+        if not win32print:
+            print("⚠️ WARNING: 'pywin32' not installed. Printing will not work.")
+            return None
+        return Win32Printer(target)
+    if kind == 'tcp':
+        host, _, port = target.partition(':')
+        return NetworkPrinter(host, int(port or 9100))
+    if kind == 'file':
+        return DevicePrinter(os.path.expanduser(target))
+    if kind == 'fake':
+        return FakePrinter()
+    raise ValueError(f"Unknown printer spec: {spec}")
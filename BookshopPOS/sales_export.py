@@ -0,0 +1,127 @@
+import csv
+import gzip
+import os
+from datetime import datetime
+from timekeys import SECONDS_PER_DAY, epoch_day
+
+# --- OPTIONAL: PARQUET SUPPORT (pip install pyarrow; the export dialog only offers Parquet with it) ---
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Rows held in memory at once while exporting
+EXPORT_CHUNK_ROWS = 5000
+
+SALE_COLUMNS = ('id', 'sale_date', 'payment_method', 'total_amount', 'discount', 'total_profit', 'cloud_key')
+ITEM_COLUMNS = ('sale_id', 'sale_date', 'payment_method', 'sku', 'title', 'qty', 'price', 'cost', 'line_total')
+
+SALES_SQL = f"""
+    SELECT {', '.join(SALE_COLUMNS)} FROM sales
+    WHERE sale_ts >= ? AND sale_ts < ? ORDER BY sale_ts, id
+"""
+ITEMS_SQL = """
+    SELECT s.id, s.sale_date, s.payment_method, i.sku, i.title, i.qty, i.price, i.cost, i.qty * i.price
+    FROM sales s JOIN sale_items i ON i.sale_id = s.id
+    WHERE s.sale_ts >= ? AND s.sale_ts < ? ORDER BY s.sale_ts, s.id, i.id
+"""
+
+FORMATS = {
+    "CSV": ".csv",
+    "CSV (gzip)": ".csv.gz",
+}
+if pa:
+    FORMATS["Parquet"] = ".parquet"
+
+# Column types for Parquet; CSV is untyped
+ARROW_TYPES = {
+    'id': 'int64', 'sale_id': 'int64', 'qty': 'int64',
+    'total_amount': 'float64', 'discount': 'float64', 'total_profit': 'float64',
+    'price': 'float64', 'cost': 'float64', 'line_total': 'float64',
+}
+
+# ==========================================
+# WRITERS
+# ==========================================
+class CsvWriter:
+    def __init__(self, path, columns, compress=False):
+        self.f = gzip.open(path, 'wt', compresslevel=6, newline='', encoding='utf-8') if compress else open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+class ParquetWriter:
+    """One row group per chunk, so memory stays bounded by EXPORT_CHUNK_ROWS."""
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.schema = pa.schema([(c, getattr(pa, ARROW_TYPES.get(c, 'string'))()) for c in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        cols = list(zip(*rows))
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(col, type=f.type) for col, f in zip(cols, self.schema)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def open_writer(path, fmt, columns):
+    if fmt == "Parquet":
+        return ParquetWriter(path, columns)
+    return CsvWriter(path, columns, compress=(fmt == "CSV (gzip)"))
+
+# ==========================================
+# EXPORT
+# ==========================================
+def export_sales(conn, path, start_day, end_day, fmt="CSV", line_items=False, progress=None):
+    """
+    Streams sales between start_day and end_day (inclusive, YYYY-MM-DD) to
+    `path`, EXPORT_CHUNK_ROWS at a time. With line_items=True there is one
+    row per item sold instead of one per sale. progress(done, total) is
+    called after each chunk. Returns the number of rows written.
+
+    Rows go to a temporary file next to `path` that is renamed over it only
+    once the export has finished, so a failed export leaves no partial file.
+    """
+    # Whole days as a half-open sale_ts range (idx_sales_ts)
+    bounds = (epoch_day(datetime.strptime(start_day, '%Y-%m-%d')) * SECONDS_PER_DAY,
+              (epoch_day(datetime.strptime(end_day, '%Y-%m-%d')) + 1) * SECONDS_PER_DAY)
+    if line_items:
+        columns, sql = ITEM_COLUMNS, ITEMS_SQL
+        total = conn.execute("SELECT count(*) FROM sales s JOIN sale_items i ON i.sale_id = s.id WHERE s.sale_ts >= ? AND s.sale_ts < ?", bounds).fetchone()[0]
+    else:
+        columns, sql = SALE_COLUMNS, SALES_SQL
+        total = conn.execute("SELECT count(*) FROM sales WHERE sale_ts >= ? AND sale_ts < ?", bounds).fetchone()[0]
+
+    part = f"{path}.part"
+    done = 0
+    try:
+        writer = open_writer(part, fmt, columns)
+        try:
+            cur = conn.execute(sql, bounds)
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows: break
+                writer.write(rows)
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+        finally:
+            writer.close()
+        os.replace(part, path)
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    return done
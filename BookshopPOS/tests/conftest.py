@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The POS modules live next to this folder, not in an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import fake_firebase
+from cloud_sync import FirebaseSync
+
+@pytest.fixture
+def cloud():
+    """A fresh fake Realtime Database, served over HTTP. Yields (database, url)."""
+    server, url = fake_firebase.start_server()
+    yield server.RequestHandlerClass.database, url
+    server.shutdown()
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "till.db")
+
+@pytest.fixture
+def sync(cloud, db_path):
+    return FirebaseSync(cloud[1], db_path, terminal='t1')
+
+def wait_for_outbox(path, timeout=10):
+    """Blocks until the drainer has sent everything staged in the till at `path`."""
+    conn = db.connect(path)
+    try:
+        deadline = time.time() + timeout
+        while conn.execute("SELECT count(*) FROM outbox").fetchone()[0]:
+            assert time.time() < deadline, "outbox never drained"
+            time.sleep(0.05)
+    finally:
+        conn.close()
@@ -0,0 +1,89 @@
+import random
+from datetime import date
+
+import pytest
+
+import analytics
+from analytics import SalesColumns, window_start
+from timekeys import SECONDS_PER_DAY, epoch_day
+
+METHODS = ("Cash", "M-Pesa", "Card")
+
+def random_columns(today, rows, seed=1):
+    """Rows spread from before the window to today, some of them multi-sale cells."""
+    rng = random.Random(seed)
+    columns = SalesColumns()
+    first = window_start(today) - 40
+    for _ in range(rows):
+        ts = rng.randrange(first * SECONDS_PER_DAY, (today + 1) * SECONDS_PER_DAY)
+        count = rng.choice((1, 1, 2, 5))
+        amount = round(rng.uniform(100, 5000), 2) * count
+        columns.append(ts, amount, amount * 0.3, rng.choice(METHODS), count)
+    return columns
+
+def trimmed(grouped):
+    """group() output with leading empty days dropped, so both backends line up."""
+    first, revenue, profit, count, m_revenue, m_count, heat = grouped
+    skip = next(i for i, n in enumerate(count) if n)
+    return (first + skip, revenue[skip:], profit[skip:], count[skip:], m_revenue, m_count, heat)
+
+@pytest.mark.skipif(analytics.np is None, reason="numpy not installed")
+def test_numpy_and_python_group_bys_agree():
+    today = epoch_day(date(2024, 6, 15))
+    columns = random_columns(today, 5000)
+    since = window_start(today)
+    fast, slow = trimmed(columns.group_numpy(since)), trimmed(columns.group_python(since))
+    assert fast[0] == slow[0]
+    for a, b in zip(fast[1:], slow[1:]):
+        assert a == pytest.approx(b)
+    assert all(isinstance(n, int) for n in fast[3] + fast[5] + fast[6])
+
+@pytest.mark.parametrize("backend", ["group_numpy", "group_python"])
+def test_counts_weight_every_figure(backend, monkeypatch):
+    if backend == "group_numpy" and analytics.np is None:
+        pytest.skip("numpy not installed")
+    monkeypatch.setattr(SalesColumns, "group", getattr(SalesColumns, backend))
+    today = epoch_day(date(2024, 6, 15))
+    noon = today * SECONDS_PER_DAY + 12 * 3600
+    cells, sales = SalesColumns(), SalesColumns()
+    cells.append(noon, 300.0, 90.0, "Cash", 3)
+    for _ in range(3):
+        sales.append(noon, 100.0, 30.0, "Cash")
+    assert cells.summarize(today) == sales.summarize(today)
+    summary = cells.summarize(today)
+    assert summary["daily_revenue"]["transactions"][-1] == 3
+    assert summary["payment_mix"] == {"labels": ["Cash"], "data": [300.0], "transactions": [3]}
+    assert sum(map(sum, summary["hourly_heatmap"]["data"])) == 3
+
+def test_window_rolls_over():
+    day = epoch_day(date(2024, 5, 31))
+    columns = SalesColumns()
+    columns.append(day * SECONDS_PER_DAY + 3600, 100.0, 25.0, "Cash")
+
+    same_day = columns.summarize(day)
+    assert same_day["daily_revenue"]["data"][-1] == 100.0
+    assert same_day["monthly_revenue"]["labels"][-1] == "May 2024"
+    assert same_day["monthly_revenue"]["data"][-1] == 100.0
+
+    # Next day, a new month: May moves back one column and June starts empty
+    next_day = columns.summarize(day + 1)
+    assert next_day["daily_revenue"]["data"][-2:] == [100.0, 0.0]
+    assert next_day["monthly_revenue"]["labels"][-2:] == ["May 2024", "Jun 2024"]
+    assert next_day["monthly_revenue"]["data"][-2:] == [100.0, 0.0]
+
+    # Past the daily chart but still inside the monthly window
+    later = columns.summarize(day + analytics.DAILY_DAYS)
+    assert sum(later["daily_revenue"]["data"]) == 0
+    assert later["monthly_revenue"]["data"][-2] == 100.0
+    assert later["payment_mix"]["data"] == [100.0]
+
+    # Once the month leaves the window the sale is gone from every chart
+    gone = columns.summarize(epoch_day(date(2025, 5, 1)))
+    assert "May 2024" not in gone["monthly_revenue"]["labels"]
+    assert sum(gone["monthly_revenue"]["data"]) == 0
+    assert gone["payment_mix"]["data"] == []
+    assert gone["margin"] == 0.0
+
+def test_window_start_is_the_first_of_the_month_eleven_months_back():
+    assert window_start(epoch_day(date(2024, 5, 31))) == epoch_day(date(2023, 6, 1))
+    assert window_start(epoch_day(date(2024, 1, 1))) == epoch_day(date(2023, 2, 1))
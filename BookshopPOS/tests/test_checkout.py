@@ -0,0 +1,92 @@
+import threading
+from datetime import datetime
+import pytest
+import db
+from conftest import wait_for_outbox
+from core import Cart, CheckoutService, hourly_cell
+from timekeys import local_epoch
+
+def add_book(conn, sku="B1", stock=5, price=10.0):
+    conn.execute("INSERT INTO products (sku, title, price, cost_price, stock) VALUES (?, ?, ?, ?, ?)",
+                 (sku, f"Book {sku}", price, price / 2, stock))
+    conn.commit()
+
+def ring_up(sku="B1", qty=1, price=10.0):
+    cart = Cart()
+    for _ in range(qty):
+        cart.add(sku, f"Book {sku}", price, price / 2, qty)
+    return cart.checkout(qty * price, "Cash", "admin")
+
+def test_deleted_sale_leaves_its_hourly_cell(cloud, db_path, sync):
+    database, _ = cloud
+    conn = db.connect(db_path)
+    add_book(conn)
+    checkout = CheckoutService(sync)
+    sale = ring_up()
+    sale_id = checkout.commit_sale(conn, sale)
+    wait_for_outbox(db_path)
+    cell = f"rollups/{hourly_cell(sale['ts'], 'Cash')}"
+    assert database.get(cell)["transactions"] == 1
+
+    checkout.delete_sale(conn, sale_id)
+    wait_for_outbox(db_path)
+    assert database.get(cell) == {"total_amount": 0.0, "profit": 0.0, "transactions": 0}
+    conn.close()
+
+def test_deleting_a_legacy_sale_leaves_the_hourly_cells_alone(cloud, db_path, sync):
+    database, _ = cloud
+    conn = db.connect(db_path)
+    add_book(conn)
+    # Rung up before the till counted sales into /rollups/hourly
+    ts = local_epoch(datetime(2024, 5, 1, 10, 30))
+    sale_id = conn.execute("""
+        INSERT INTO sales (sale_date, sale_ts, sale_day, total_amount, total_profit, payment_method)
+        VALUES ('2024-05-01 10:30:00', ?, ?, 10.0, 5.0, 'Cash')
+    """, (ts, ts // 86400)).lastrowid
+    conn.execute("INSERT INTO sale_items (sale_id, sku, title, qty, price, sale_date) VALUES (?, 'B1', 'Book B1', 1, 10.0, '2024-05-01 10:30:00')",
+                 (sale_id,))
+    conn.commit()
+
+    CheckoutService(sync).delete_sale(conn, sale_id)
+    wait_for_outbox(db_path)
+    assert database.get("rollups/hourly") is None
+    conn.close()
+
+def counts(conn):
+    return [conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in ("sales", "sale_items", "outbox")]
+
+def test_short_stock_rolls_the_whole_sale_back(db_path, sync):
+    conn = db.connect(db_path)
+    add_book(conn, "B1", stock=5)
+    add_book(conn, "B2", stock=2)
+    sale = ring_up("B1", qty=1)
+    sale['items'] += ring_up("B2", qty=3)['items']
+    with pytest.raises(ValueError, match="Not enough stock"):
+        CheckoutService(sync).commit_sale(conn, sale)
+    assert counts(conn) == [0, 0, 0]
+    assert dict(conn.execute("SELECT sku, stock FROM products").fetchall()) == {"B1": 5, "B2": 2}
+    conn.close()
+
+def test_two_tills_racing_for_the_last_copy_sell_it_once(db_path, sync):
+    conn = db.connect(db_path)
+    add_book(conn, stock=1)
+    checkout = CheckoutService(sync)
+    start = threading.Barrier(2)
+    results = []
+    def sell():
+        till = db.connect(db_path)
+        try:
+            start.wait()
+            results.append(checkout.commit_sale(till, ring_up()))
+        except ValueError as e:
+            results.append(e)
+        finally:
+            till.close()
+    threads = [threading.Thread(target=sell) for _ in range(2)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert sorted(type(r).__name__ for r in results) == ["ValueError", "int"]
+    assert conn.execute("SELECT count(*) FROM sales").fetchone()[0] == 1
+    assert conn.execute("SELECT stock FROM products WHERE sku='B1'").fetchone()[0] == 0
+    conn.close()
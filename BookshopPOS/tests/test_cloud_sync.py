@@ -0,0 +1,177 @@
+import time
+from datetime import datetime
+import db
+from conftest import wait_for_outbox
+from cloud_sync import FirebaseSync
+from core import SyncService, sales_rollup_update
+from timekeys import local_epoch
+
+MAY_1_10AM = local_epoch(datetime(2024, 5, 1, 10, 30))
+
+def test_increments_to_one_path_add_up_within_a_batch(cloud, db_path, sync):
+    database, _ = cloud
+    conn = db.connect(db_path)
+    cur = conn.cursor()
+    for _ in range(3):
+        sync.patch(cur, "rollups", sales_rollup_update(MAY_1_10AM, 100.0, 25.0, "Cash"))
+    sync.patch(cur, "rollups", sales_rollup_update(MAY_1_10AM, 40.0, 10.0, "M-Pesa"))
+    conn.commit()
+    sync.wake()
+    wait_for_outbox(db_path)
+
+    rollups = database.get("rollups")
+    assert rollups["all_time"]["total_amount"] == 340.0
+    assert rollups["all_time"]["transactions"] == 4
+    assert rollups["all_time"]["methods"] == {"Cash": 3, "M-Pesa": 1}
+    assert rollups["daily"]["2024-05-01"] == {"total_amount": 340.0, "transactions": 4, "revision": 4}
+    assert rollups["hourly"]["2024-05-01"]["h10"] == {
+        "Cash": {"total_amount": 300.0, "profit": 75.0, "transactions": 3},
+        "M-Pesa": {"total_amount": 40.0, "profit": 10.0, "transactions": 1}}
+    conn.close()
+
+def test_batch_stops_before_incrementing_a_path_it_sets(sync):
+    rows = [
+        (1, "a", "PUT", "rollups/all_time/transactions", "5", 0),
+        (2, "b", "PATCH", "rollups/all_time", '{"transactions": {".sv": {"increment": 1}}}', 0),
+    ]
+    updates, ids = sync.build_update(rows)
+    assert ids == [1]
+    assert updates["rollups/all_time/transactions"] == 5
+
+def test_already_applied_looks_up_each_key(cloud, sync):
+    database, _ = cloud
+    # Keys come from several tills, so applied ones need not sort together
+    database.put("sync_log", {"m-first": 1, "a-second": 1})
+    rows = [(1, "m-first", "PUT", "x", "1", 1), (2, "a-second", "PUT", "y", "1", 1),
+            (3, "z-third", "PUT", "z", "1", 1), (4, "b-fourth", "PUT", "w", "1", 0)]
+    assert sync.already_applied(rows) == [1, 2]
+    database.put("sync_log", None)
+    assert sync.already_applied(rows) == []
+
+def test_ambiguous_failure_is_not_applied_twice(cloud, db_path, sync):
+    database, _ = cloud
+    conn = db.connect(db_path)
+    cur = conn.cursor()
+    for amount in (100.0, 50.0):
+        sync.patch(cur, "rollups", sales_rollup_update(MAY_1_10AM, amount, amount / 4, "Cash"))
+    # The server applied the batch but the reply was lost (done before the rows are
+    # committed, so the drainer can't send them first)
+    rows = cur.execute("SELECT id, idem_key, method, path, body, attempts FROM outbox ORDER BY id").fetchall()
+    updates, _ = sync.build_update(rows)
+    database.patch("", updates)
+    cur.execute("UPDATE outbox SET attempts = 1")
+    conn.commit()
+    sync.wake()
+    wait_for_outbox(db_path)
+
+    assert database.get("rollups/all_time") == {"total_amount": 150.0, "transactions": 2, "methods": {"Cash": 2}}
+    assert all(isinstance(v, int) for v in database.get("sync_log").values())
+    conn.close()
+
+def test_prune_sync_log_drops_old_keys(cloud, sync):
+    database, _ = cloud
+    now = int(time.time() * 1000)
+    database.put("sync_log", {"old": now - 30 * 86400 * 1000, "legacy": True, "fresh": now})
+    assert sync.prune_sync_log() == 2
+    assert database.get("sync_log") == {"fresh": now}
+
+def stock_of(path, sku):
+    conn = db.connect(path)
+    try:
+        return conn.execute("SELECT stock FROM products WHERE sku=?", (sku,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_tills_selling_the_same_title_converge(cloud, db_path, sync, tmp_path):
+    database, url = cloud
+    database.put("", {
+        "products": {"B1": {"sku": "B1", "title": "Dune", "price": 10, "stock": 10, "updated_at": 1,
+                            "counters": {"base": {"inc": 10, "dec": 0}}}},
+        "meta": {"products_updated_at": 1}})
+    other_path = str(tmp_path / "other.db")
+    tills = [(db_path, sync), (other_path, FirebaseSync(url, other_path, terminal='t2'))]
+    for path, till in tills:
+        conn = db.connect(path)
+        SyncService(till).pull_products(conn)
+        conn.close()
+        assert stock_of(path, "B1") == 10
+
+    for (path, till), sold in zip(tills, (3, 2)):
+        conn = db.connect(path)
+        till.adjust_stock(conn.cursor(), [("B1", -sold)])
+        conn.commit()
+        conn.close()
+        till.wake()
+        wait_for_outbox(path)
+
+    for path, till in tills:
+        conn = db.connect(path)
+        SyncService(till).pull_products(conn)
+        conn.close()
+        assert stock_of(path, "B1") == 5
+
+def test_high_water_mark_advances_without_meta(cloud, db_path, sync):
+    database, _ = cloud
+    book = lambda sku, at: {"sku": sku, "title": sku, "price": 10, "stock": 1, "updated_at": at}
+    database.put("products", {"B1": book("B1", 5), "B2": book("B2", 7)})
+    conn = db.connect(db_path)
+    pulls = SyncService(sync)
+    assert len(pulls.pull_products(conn)[0]) == 2
+    assert conn.execute("SELECT value FROM sync_state WHERE key='products_hwm'").fetchone() == ("7",)
+
+    database.put("products/B3", book("B3", 9))
+    upserts = pulls.pull_products(conn)[0]
+    assert sorted(u[0] for u in upserts) == ["B2", "B3"]
+    assert conn.execute("SELECT value FROM sync_state WHERE key='products_hwm'").fetchone() == ("9",)
+    conn.close()
+
+def test_fresh_till_takes_legacy_stock_as_the_base(cloud, db_path, sync):
+    database, _ = cloud
+    database.put("products/B1", {"sku": "B1", "title": "Dune", "price": 10, "stock": 50, "updated_at": 1,
+                                 "counters": {"t1": {"inc": 0, "dec": 1}}})
+    conn = db.connect(db_path)
+    SyncService(sync).pull_products(conn)
+    conn.close()
+    assert stock_of(db_path, "B1") == 49
+
+def outbox_rows(path, table="outbox"):
+    conn = db.connect(path)
+    try:
+        return conn.execute(f"SELECT path, attempts FROM {table} ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def test_refused_auth_keeps_the_outbox(cloud, db_path, sync):
+    database, _ = cloud
+    database.refuse_writes = 403
+    conn = db.connect(db_path)
+    sync.put(conn.cursor(), "sales/s1", {"total_amount": 10.0})
+    sync.put(conn.cursor(), "sales/s2", {"total_amount": 20.0})
+    conn.commit()
+    sync.wake()
+    deadline = time.time() + 10
+    while not all(attempts for _, attempts in outbox_rows(db_path)):
+        assert time.time() < deadline, "drainer never tried the batch"
+        time.sleep(0.05)
+    assert [p for p, _ in outbox_rows(db_path)] == ["sales/s1", "sales/s2"]
+    assert outbox_rows(db_path, "outbox_dead") == []
+
+    # Once the credential or rules are fixed, everything goes through
+    database.refuse_writes = None
+    sync.wake()
+    wait_for_outbox(db_path)
+    assert database.get("sales") == {"s1": {"total_amount": 10.0}, "s2": {"total_amount": 20.0}}
+    conn.close()
+
+def test_rejected_writes_move_to_dead_letter(cloud, db_path, sync):
+    database, _ = cloud
+    database.refuse_writes = 400
+    conn = db.connect(db_path)
+    sync.put(conn.cursor(), "sales/s1", {"total_amount": 10.0})
+    sync.put(conn.cursor(), "sales/s2", {"total_amount": 20.0})
+    conn.commit()
+    sync.wake()
+    wait_for_outbox(db_path)
+    assert [p for p, _ in outbox_rows(db_path, "outbox_dead")] == ["sales/s1", "sales/s2"]
+    assert database.get("sales") is None
+    conn.close()
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import fake_firebase
+from core import ROLLUP_VERSION, sales_rollup_update
+from timekeys import epoch_day, local_epoch
+
+@pytest.fixture(scope='module')
+def dashboard_module(tmp_path_factory):
+    """web_dashboard wired to a fake Realtime Database; the SDK reads the emulator host on import."""
+    server, url = fake_firebase.start_server()
+    saved = {k: os.environ.get(k) for k in ('FIREBASE_DATABASE_EMULATOR_HOST', 'DASHBOARD_CACHE_DIR')}
+    os.environ['FIREBASE_DATABASE_EMULATOR_HOST'] = url.split('//', 1)[1]
+    os.environ['DASHBOARD_CACHE_DIR'] = str(tmp_path_factory.mktemp('dashboard'))
+    import web_dashboard
+    yield web_dashboard, server.RequestHandlerClass.database
+    server.shutdown()
+    for k, v in saved.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+
+@pytest.fixture
+def dashboard(dashboard_module, monkeypatch, tmp_path):
+    web_dashboard, database = dashboard_module
+    database.put("", None)
+    monkeypatch.setattr(web_dashboard, 'sales_aggregate', web_dashboard.SalesAggregate(str(tmp_path)))
+    return web_dashboard, database
+
+def post_sale(database, key, sale_id, amount, method="Cash"):
+    """Writes a sale and its rollups the way a till's outbox does."""
+    now = datetime.now()
+    database.put(f"sales/{key}", {"sale_id": sale_id, "timestamp": now.strftime('%Y-%m-%dT%H:%M:%S'),
+                                  "day": now.strftime('%Y-%m-%d'), "ts": local_epoch(now), "epoch_day": epoch_day(now),
+                                  "rollup_version": ROLLUP_VERSION, "total_amount": amount, "profit": amount / 4,
+                                  "payment_method": method, "items": []})
+    database.patch("rollups", sales_rollup_update(local_epoch(now), amount, amount / 4, method))
+
+def delete_sale(database, key):
+    sale = database.get(f"sales/{key}")
+    database.put(f"sales/{key}", None)
+    database.patch("rollups", sales_rollup_update(sale["ts"], sale["total_amount"], sale["profit"],
+                                                  sale["payment_method"], count=-1))
+
+MIGRATED = {"bootstrapped": True, "epochs_backfilled": True, "hourly_backfilled": True}
+
+def legacy_sale(i):
+    return {"sale_id": i, "timestamp": f"2024-05-01T10:{i:02d}:00", "total_amount": 100.0, "payment_method": "Cash"}
+
+def test_bootstrap_counts_legacy_sales_once_across_workers(dashboard):
+    web_dashboard, database = dashboard
+    database.put("sales", {f"s{i:02d}": legacy_sale(i) for i in range(30)})
+
+    workers = [threading.Thread(target=web_dashboard.bootstrap_rollups) for _ in range(4)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+    web_dashboard.bootstrap_rollups()
+
+    rollups = database.get("rollups")
+    assert rollups["all_time"]["total_amount"] == 3000.0
+    assert rollups["all_time"]["transactions"] == 30
+    assert rollups["daily"]["2024-05-01"] == {"total_amount": 3000.0, "transactions": 30}
+    assert rollups["meta"]["bootstrapped"] is True
+
+def test_live_claim_from_another_worker_is_respected(dashboard):
+    web_dashboard, database = dashboard
+    database.put("sales", {"s00": legacy_sale(0)})
+    database.put("rollups/meta/bootstrapped", {"owner": "other", "claimed_at": time.time() * 1000})
+    web_dashboard.bootstrap_rollups()
+    assert database.get("rollups/all_time") is None
+
+def test_stale_claim_is_taken_over(dashboard):
+    web_dashboard, database = dashboard
+    database.put("sales", {"s00": legacy_sale(0)})
+    stale = (time.time() - web_dashboard.MIGRATION_CLAIM_SECONDS - 1) * 1000
+    database.put("rollups/meta/bootstrapped", {"owner": "other", "claimed_at": stale})
+    web_dashboard.bootstrap_rollups()
+    assert database.get("rollups/all_time/transactions") == 1
+    assert database.get("rollups/meta/bootstrapped") is True
+
+def test_failed_read_does_not_mark_bootstrap_done(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    database.put("sales", {"s00": legacy_sale(0)})
+    def timeout(*args, **kwargs):
+        raise TimeoutError("read timed out")
+    with monkeypatch.context() as m:
+        m.setattr(web_dashboard, 'get_sales_page', timeout)
+        assert web_dashboard.bootstrap_rollups() is False
+    # The claim is released, so the next refresh retries at once
+    assert database.get("rollups/meta/bootstrapped")["claimed_at"] == 0
+    assert web_dashboard.bootstrap_rollups() is True
+    assert database.get("rollups/all_time/transactions") == 1
+
+def test_bootstrap_stops_when_its_claim_is_taken_over(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    monkeypatch.setattr(web_dashboard, 'MIGRATION_BATCH', 10)
+    database.put("sales", {f"s{i:02d}": legacy_sale(i) for i in range(30)})
+    read_page = web_dashboard.get_sales_page
+    def slow_page(start_key=None, limit=None, end_key=None):
+        if start_key is not None and end_key is None:
+            # The claim expired during the first batch and another worker took it
+            database.put("rollups/meta/bootstrapped", {"owner": "other", "claimed_at": time.time() * 1000})
+        return read_page(start_key, limit, end_key)
+    with monkeypatch.context() as m:
+        m.setattr(web_dashboard, 'get_sales_page', slow_page)
+        assert web_dashboard.bootstrap_rollups() is False
+    assert database.get("rollups/all_time/transactions") == 10
+    assert database.get("rollups/meta/bootstrapped")["owner"] == "other"
+
+    # The other worker finishes the job without recounting the first batch
+    database.put("rollups/meta/bootstrapped", None)
+    assert web_dashboard.bootstrap_rollups() is True
+    assert database.get("rollups/all_time/transactions") == 30
+
+def test_sale_deleted_during_bootstrap_leaves_no_stub(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    database.put("sales", {"s00": legacy_sale(0), "s01": legacy_sale(1)})
+    read_page = web_dashboard.get_sales_page
+    def page_then_delete(start_key=None, limit=None, end_key=None):
+        page = read_page(start_key, limit, end_key)
+        database.put("sales/s01", None)
+        return page
+    monkeypatch.setattr(web_dashboard, 'get_sales_page', page_then_delete)
+    assert web_dashboard.bootstrap_rollups() is True
+    assert database.get("sales/s01") is None
+    assert database.get("sales/s00/day") == "2024-05-01"
+
+def test_failed_read_does_not_mark_epochs_backfilled(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    database.put("sales", {"s00": legacy_sale(0)})
+    def timeout(*args, **kwargs):
+        raise TimeoutError("read timed out")
+    with monkeypatch.context() as m:
+        m.setattr(web_dashboard, 'get_sales_page', timeout)
+        assert web_dashboard.backfill_sale_epochs() is False
+    assert database.get("rollups/meta/epochs_backfilled") is not True
+    assert web_dashboard.backfill_sale_epochs() is True
+    assert database.get("sales/s00/epoch_day") == epoch_day(datetime(2024, 5, 1))
+    assert database.get("rollups/meta/epochs_backfilled") is True
+
+def test_deleted_sale_leaves_the_dashboard(dashboard):
+    web_dashboard, database = dashboard
+    database.put("rollups/meta", MIGRATED)
+    post_sale(database, "-k1", 1, 100.0)
+    post_sale(database, "-k2", 2, 250.0, "M-Pesa")
+    payload = json.loads(web_dashboard.build_dashboard_payload())
+    assert payload["stats"]["today_sales"] == 350.0
+    assert payload["charts"]["weekly_sales"]["data"][-1] == 350.0
+    assert payload["charts"]["daily_revenue"]["data"][-1] == 350.0
+    assert payload["charts"]["payment_mix"]["labels"] == ["M-Pesa", "Cash"]
+    assert [s["id"] for s in payload["sales"]] == [2, 1]
+
+    delete_sale(database, "-k2")
+    payload = json.loads(web_dashboard.build_dashboard_payload())
+    assert payload["stats"]["today_sales"] == 100.0
+    assert payload["stats"]["total_transactions"] == 1
+    assert payload["charts"]["weekly_sales"]["data"][-1] == 100.0
+    assert payload["charts"]["daily_revenue"]["data"][-1] == 100.0
+    assert payload["charts"]["daily_revenue"]["transactions"][-1] == 1
+    assert payload["charts"]["payment_mix"]["labels"] == ["Cash"]
+    assert sum(map(sum, payload["charts"]["hourly_heatmap"]["data"])) == 1
+    assert [s["id"] for s in payload["sales"]] == [1]
+
+def test_only_changed_days_are_read_again(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    database.put("rollups/meta", MIGRATED)
+    post_sale(database, "-k1", 1, 100.0)
+    web_dashboard.build_dashboard_payload()
+    reads = []
+    monkeypatch.setattr(web_dashboard, 'get_hourly_rollup', lambda day: reads.append(day) or {})
+    web_dashboard.build_dashboard_payload()
+    assert reads == []
+    post_sale(database, "-k2", 2, 100.0)
+    web_dashboard.build_dashboard_payload()
+    assert reads == [datetime.now().strftime('%Y-%m-%d')]
+
+def test_sales_posted_before_hourly_rollups_are_backfilled_once(dashboard):
+    web_dashboard, database = dashboard
+    database.put("rollups/meta", {"bootstrapped": True, "epochs_backfilled": True})
+    post_sale(database, "-k1", 1, 100.0)
+    # An older till: day totals but no hourly cells
+    now = datetime.now()
+    database.put("sales/-k2", {"sale_id": 2, "timestamp": now.strftime('%Y-%m-%dT%H:%M:%S'), "day": now.strftime('%Y-%m-%d'),
+                               "ts": local_epoch(now), "epoch_day": epoch_day(now), "total_amount": 50.0,
+                               "profit": 10.0, "payment_method": "Card", "items": []})
+
+    for _ in range(2):
+        web_dashboard.sales_aggregate.migrated = False
+        payload = json.loads(web_dashboard.build_dashboard_payload())
+        assert payload["charts"]["daily_revenue"]["data"][-1] == 150.0
+        assert payload["charts"]["daily_revenue"]["transactions"][-1] == 2
+    assert database.get("sales/-k2/rollup_version") == ROLLUP_VERSION
+    assert database.get("rollups/meta/hourly_backfilled") is True
+
+def test_failed_query_does_not_mark_hourly_backfilled(dashboard, monkeypatch):
+    web_dashboard, database = dashboard
+    database.put("rollups/meta", {"bootstrapped": True, "epochs_backfilled": True})
+    with monkeypatch.context() as m:
+        # e.g. the rules lack ".indexOn": "epoch_day"
+        m.setattr(web_dashboard, 'get_sales_since_day', lambda day: None)
+        assert web_dashboard.backfill_hourly_rollups() is False
+    assert database.get("rollups/meta/hourly_backfilled") is not True
+    assert web_dashboard.backfill_hourly_rollups() is True
+
+def test_workers_share_hourly_cells_through_the_cache_directory(dashboard, monkeypatch, tmp_path):
+    web_dashboard, database = dashboard
+    database.put("rollups/meta", MIGRATED)
+    post_sale(database, "-k1", 1, 100.0)
+    first = web_dashboard.sales_aggregate
+    first.refresh(force=True)
+
+    reads = []
+    monkeypatch.setattr(web_dashboard, 'get_hourly_rollup', lambda day: reads.append(day) or None)
+    monkeypatch.setattr(web_dashboard, 'get_hourly_rollups', lambda since: reads.append(since) or None)
+    second = web_dashboard.SalesAggregate(str(tmp_path))
+    second.refresh(force=True)
+    assert reads == []
+    assert second.summary() == first.summary()
@@ -0,0 +1,16 @@
+import db
+from core import InventoryService
+
+def test_sku_search_ignores_case(db_path):
+    conn = db.connect(db_path)
+    conn.executemany("INSERT INTO products (sku, title, price, stock) VALUES (?, ?, 10, 1)",
+                     [("ISBN-978A", "Dune"), ("isbn-979b", "Emma"), ("MAP-01", "Atlas")])
+    conn.commit()
+    inventory = InventoryService(conn, None)
+    assert [r[0] for r in inventory.search("isbn-978a")] == ["ISBN-978A"]
+    assert [r[0] for r in inventory.search("ISBN")] == ["ISBN-978A", "isbn-979b"]
+    assert [r[0] for r in inventory.search("map")] == ["MAP-01"]
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT sku FROM products WHERE sku >= ? COLLATE NOCASE AND sku < ? COLLATE NOCASE",
+                        ("isbn", "isbn\uffff")).fetchall()
+    assert "idx_products_sku_nocase" in plan[0][3]
+    conn.close()
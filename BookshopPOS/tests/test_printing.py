@@ -0,0 +1,116 @@
+import socket
+import threading
+
+import pytest
+
+import printing
+from printing import DevicePrinter, NetworkPrinter, PrinterUnavailable, render_receipt
+
+RECEIPT = {'date': '2024-05-01 10:00:00', 'items': [{'title': 'Dune', 'qty': 2, 'price': 500.0}],
+           'subtotal': 1000.0, 'discount': 0.0, 'total': 1000.0, 'paid': 1000.0, 'change': 0.0}
+
+class TcpPrinter:
+    """A local stand-in for a JetDirect printer: records what each connection sent."""
+    def __init__(self, hang_up_first=False, read=True):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.hang_up_first = hang_up_first
+        self.read = read
+        self.connections = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            if self.hang_up_first and not self.connections:
+                self.connections.append(b'')
+                conn.close()
+                continue
+            self.connections.append(b'')
+            if self.read:
+                threading.Thread(target=self.receive, args=(conn, len(self.connections) - 1), daemon=True).start()
+
+    def receive(self, conn, i):
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            self.connections[i] += data
+
+    def received(self, size, timeout=5):
+        """Waits until `size` bytes have arrived in total."""
+        for _ in range(timeout * 100):
+            if sum(map(len, self.connections)) >= size:
+                break
+            threading.Event().wait(0.01)
+        return self.connections
+
+def test_both_copies_go_out_as_one_job_on_one_connection():
+    stand_in = TcpPrinter()
+    printer = NetworkPrinter('127.0.0.1', stand_in.port)
+    job = render_receipt(RECEIPT, 'admin')
+    printer.send(job)
+    printer.send(job)
+    connections = stand_in.received(2 * len(job))
+    printer.close()
+    assert connections == [job + job]
+    assert job.count(printing.ESC_CUT) == 2
+    assert b'CUSTOMER COPY' in job and b'SHOP COPY' in job
+
+def test_stale_connection_is_reopened_and_the_job_sent_once():
+    stand_in = TcpPrinter(hang_up_first=True)
+    printer = NetworkPrinter('127.0.0.1', stand_in.port)
+    printer.handle = printer.open()
+    threading.Event().wait(0.2)  # let the hang-up arrive
+    printer.send(b'receipt')
+    connections = stand_in.received(len(b'receipt'))
+    printer.close()
+    assert connections == [b'', b'receipt']
+
+def test_timeout_mid_job_is_not_retried(monkeypatch):
+    monkeypatch.setattr(printing, 'SOCKET_TIMEOUT', 0.2)
+    stand_in = TcpPrinter(read=False)
+    printer = NetworkPrinter('127.0.0.1', stand_in.port)
+    with pytest.raises(socket.timeout):
+        printer.send(b'x' * (64 * 1024 * 1024))
+    assert len(stand_in.connections) == 1
+    assert printer.handle is None
+
+class FlakyDevice:
+    def __init__(self, accept):
+        self.accept = accept  # bytes taken before the device fails
+
+    def write(self, data):
+        if not self.accept:
+            raise OSError("device went away")
+        n = min(self.accept, len(data))
+        self.accept -= n
+        return n
+
+    def close(self):
+        pass
+
+def flaky_printer(*devices):
+    printer = DevicePrinter('/dev/null')
+    opened = iter(devices)
+    printer.open = lambda: next(opened)
+    return printer
+
+def test_device_failing_before_the_first_byte_is_retried():
+    retry = FlakyDevice(100)
+    printer = flaky_printer(FlakyDevice(0), retry)
+    printer.send(b'receipt')
+    assert retry.accept == 100 - len(b'receipt')
+
+def test_device_failing_mid_job_is_not_retried():
+    printer = flaky_printer(FlakyDevice(3), FlakyDevice(100))
+    with pytest.raises(OSError) as failure:
+        printer.send(b'receipt')
+    assert not isinstance(failure.value, PrinterUnavailable)
+    assert printer.handle is None
+
+def test_unreachable_printer_raises_after_one_retry():
+    with socket.create_server(('127.0.0.1', 0)) as s:
+        port = s.getsockname()[1]
+    with pytest.raises(PrinterUnavailable):
+        NetworkPrinter('127.0.0.1', port).send(b'receipt')
@@ -0,0 +1,85 @@
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+import db
+from core import ReportingService
+from timekeys import epoch_day, local_epoch
+
+def add_sale(conn, when, amount, method="Cash", discount=0.0):
+    ts = local_epoch(when)
+    return conn.execute("""
+        INSERT INTO sales (sale_date, sale_ts, sale_day, total_amount, discount, total_profit, payment_method)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (when.strftime('%Y-%m-%d %H:%M:%S'), ts, ts // 86400, amount, discount, amount / 4, method)).lastrowid
+
+def direct_totals(conn, start, end):
+    return conn.execute("""
+        SELECT COALESCE(sum(total_amount), 0), COALESCE(sum(discount), 0), COALESCE(sum(total_profit), 0), count(*)
+        FROM sales WHERE sale_day BETWEEN ? AND ?
+    """, (start, end)).fetchone()
+
+def direct_mix(conn, start, end):
+    return conn.execute("""
+        SELECT COALESCE(payment_method, 'Unknown'), sum(total_amount), count(*) FROM sales
+        WHERE sale_day BETWEEN ? AND ? GROUP BY 1 ORDER BY 2 DESC
+    """, (start, end)).fetchall()
+
+def periods():
+    today = datetime.now().date()
+    return [(epoch_day(start), epoch_day(today))
+            for start in (today, today - timedelta(days=today.weekday()), today.replace(day=1))]
+
+def test_report_totals_match_the_sales_table(db_path):
+    conn = db.connect(db_path)
+    now = datetime.now().replace(microsecond=0)
+    for days_ago, amount, method in ((0, 120.0, "Cash"), (0, 80.0, "M-Pesa"), (1, 45.5, "Card"), (3, 300.0, "Cash"),
+                                     (9, 60.0, "M-Pesa"), (40, 999.0, "Cash")):
+        add_sale(conn, now - timedelta(days=days_ago), amount, method, discount=amount / 10)
+    doomed = add_sale(conn, now, 500.0, "Card")
+    conn.execute("UPDATE sales SET payment_method='Cash' WHERE total_amount=45.5")
+    conn.execute("DELETE FROM sales WHERE id=?", (doomed,))
+    conn.commit()
+
+    reports = ReportingService(conn)
+    for start, end in periods():
+        assert reports.totals(start, end) == pytest.approx(direct_totals(conn, start, end))
+        assert reports.payment_mix(start, end) == direct_mix(conn, start, end)
+    assert reports.totals() == pytest.approx(direct_totals(conn, 0, 10 ** 6))
+    conn.close()
+
+def test_text_keyed_rollups_are_rebuilt(tmp_path):
+    path = str(tmp_path / "old.db")
+    now = datetime.now().replace(microsecond=0)
+    old = sqlite3.connect(path)
+    # A till from before integer time keys: sale_date only, rollups keyed by 'YYYY-MM-DD'
+    old.executescript("""
+        CREATE TABLE sales (id INTEGER PRIMARY KEY AUTOINCREMENT, sale_date TEXT NOT NULL, total_amount REAL NOT NULL,
+                            discount REAL DEFAULT 0.0, total_profit REAL DEFAULT 0.0, payment_method TEXT, items_json TEXT);
+        CREATE TABLE daily_sales_summary (day TEXT PRIMARY KEY, revenue REAL NOT NULL DEFAULT 0.0,
+                                          discount REAL NOT NULL DEFAULT 0.0, profit REAL NOT NULL DEFAULT 0.0,
+                                          transactions INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE daily_payment_summary (day TEXT NOT NULL, method TEXT NOT NULL, revenue REAL NOT NULL DEFAULT 0.0,
+                                            transactions INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (day, method));
+    """)
+    for days_ago, amount, method in ((0, 100.0, "Cash"), (0, 50.0, "Card"), (2, 70.0, "Cash"), (35, 10.0, None)):
+        when = now - timedelta(days=days_ago)
+        old.execute("INSERT INTO sales (sale_date, total_amount, discount, total_profit, payment_method) VALUES (?, ?, 0, ?, ?)",
+                    (when.strftime('%Y-%m-%d %H:%M:%S'), amount, amount / 2, method))
+    old.execute("INSERT INTO daily_sales_summary VALUES (?, 1.0, 0, 0, 1)", (now.strftime('%Y-%m-%d'),))
+    old.commit()
+    old.close()
+
+    conn = db.connect(path)
+    assert conn.execute("SELECT type FROM pragma_table_info('daily_sales_summary') WHERE name='day'").fetchone() == ("INTEGER",)
+    reports = ReportingService(conn)
+    for start, end in periods():
+        assert reports.totals(start, end) == pytest.approx(direct_totals(conn, start, end))
+        assert reports.payment_mix(start, end) == direct_mix(conn, start, end)
+    assert reports.totals() == pytest.approx((230.0, 0.0, 115.0, 4))
+
+    # The rebuilt triggers keep it in step from here on
+    add_sale(conn, now, 25.0, "Card")
+    conn.commit()
+    start, end = periods()[0]
+    assert reports.totals(start, end) == pytest.approx(direct_totals(conn, start, end))
+    conn.close()
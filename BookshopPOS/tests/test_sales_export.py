@@ -0,0 +1,44 @@
+import csv
+import os
+from datetime import date
+
+import pytest
+
+import db
+import sales_export
+from timekeys import SECONDS_PER_DAY, epoch_day
+
+def make_sales(path, count):
+    conn = db.connect(path)
+    day = epoch_day(date(2024, 5, 1))
+    conn.executemany(
+        "INSERT INTO sales (sale_date, sale_ts, sale_day, total_amount, payment_method) VALUES (?, ?, ?, ?, 'Cash')",
+        [(f"2024-05-01 10:00:{i % 60:02d}", day * SECONDS_PER_DAY + 36000 + i, day, 100.0) for i in range(count)])
+    conn.commit()
+    return conn
+
+def test_export_writes_every_sale_in_range(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(sales_export, 'EXPORT_CHUNK_ROWS', 4)
+    conn = make_sales(db_path, 10)
+    out = str(tmp_path / "sales.csv")
+    progress = []
+    assert sales_export.export_sales(conn, out, "2024-05-01", "2024-05-01", progress=lambda d, t: progress.append(d)) == 10
+    with open(out, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(sales_export.SALE_COLUMNS)
+    assert len(rows) == 11
+    assert progress == [4, 8, 10]
+    assert not os.path.exists(out + ".part")
+    conn.close()
+
+def test_failed_export_leaves_no_file(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(sales_export, 'EXPORT_CHUNK_ROWS', 4)
+    conn = make_sales(db_path, 10)
+    out = tmp_path / "sales.csv.gz"
+
+    def cancel(done, total):
+        raise RuntimeError("disk full")
+    with pytest.raises(RuntimeError):
+        sales_export.export_sales(conn, str(out), "2024-05-01", "2024-05-01", "CSV (gzip)", progress=cancel)
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith("sales.csv")]
+    conn.close()
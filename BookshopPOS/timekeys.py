@@ -0,0 +1,33 @@
+import calendar
+from datetime import date, datetime
+
+# Sales carry integer time keys, in shop-local wall-clock time: `ts` counts
+# seconds from 1970-01-01 00:00 *local*, so the day of a sale is
+# ts // SECONDS_PER_DAY and its hour is ts % SECONDS_PER_DAY // 3600, with
+# no timezone or string handling. The till writes them with every sale and
+# the dashboard reads them as-is.
+SECONDS_PER_DAY = 86400
+EPOCH = date(1970, 1, 1)
+
+def local_epoch(dt):
+    """`ts` of a datetime, taken at its wall-clock value (any tzinfo is ignored)."""
+    return calendar.timegm(dt.timetuple())
+
+def epoch_day(d):
+    """Day key of a date or datetime."""
+    if isinstance(d, datetime):
+        d = d.date()
+    return (d - EPOCH).days
+
+def day_from_epoch(day):
+    return date.fromordinal(EPOCH.toordinal() + day)
+
+def parse_sale_time(text):
+    """
+    datetime of a 'YYYY-MM-DD HH:MM:SS' or ISO timestamp string, or None.
+    Only needed for records written before sales carried `ts`.
+    """
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
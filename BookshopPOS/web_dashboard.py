@@ -1,10 +1,29 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, g
 import firebase_admin
 from firebase_admin import credentials, db
 import json
-from datetime import datetime, timedelta
+import hashlib
+from datetime import date, datetime
+import bisect
+import cProfile
+import glob
+import io
 import os
+import pstats
 import sys
+import tempfile
+import threading
+import time
+import queue
+import uuid
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: the payload cache is then only shared between threads
+    fcntl = None
+from timekeys import SECONDS_PER_DAY, day_from_epoch, epoch_day, local_epoch, parse_sale_time
+import analytics
+from core import ROLLUP_VERSION, hourly_cell
 
 app = Flask(__name__)
 
@@ -12,6 +31,8 @@ app = Flask(__name__)
 # Ensure this URL matches the one in your POS code
 FIREBASE_DATABASE_URL = 'https://heriwadi-bookshop-default-rtdb.firebaseio.com/'
 firebase_initialized = False
+# Shared by every gunicorn worker on the host: the dashboard payload and each worker's metrics
+DASHBOARD_CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'bookshop-dashboard'))
 
 # --- INITIALIZATION ---
 try:
@@ -26,145 +47,1025 @@ try:
             firebase_initialized = True
         except Exception as json_e:
             print(f"❌ Error loading credentials: {json_e}")
+    elif os.environ.get('FIREBASE_DATABASE_EMULATOR_HOST'):
+        # Emulator or fake_firebase.py: the SDK routes every call there and needs no credentials
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(options={'databaseURL': FIREBASE_DATABASE_URL})
+        print(f"✅ Firebase initialized against emulator {os.environ['FIREBASE_DATABASE_EMULATOR_HOST']}.")
+        firebase_initialized = True
     else:
         print("⚠️ FIREBASE_CREDENTIALS_JSON not found. Running in offline mode.")
 except Exception as e:
     print(f"❌ Critical Initialization Error: {e}")
 
+# --- METRICS ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+HISTOGRAMS = {
+    'dashboard_http_request_duration_seconds': LATENCY_BUCKETS,
+    'dashboard_http_response_bytes': SIZE_BUCKETS,
+    'dashboard_firebase_call_duration_seconds': LATENCY_BUCKETS,
+    'dashboard_cache_payload_bytes': SIZE_BUCKETS,
+    'dashboard_analytics_seconds': LATENCY_BUCKETS,
+}
+# A worker writes its metrics for /metrics at most this often
+METRICS_FLUSH_SECONDS = 1
+# Opt-in: with DASHBOARD_PROFILING=1, a request made with ?profile=1 returns its cProfile stats instead
+PROFILING_ENABLED = os.environ.get('DASHBOARD_PROFILING') == '1'
+PROFILE_STATS_LINES = 40
+
+def metric_labels(labels):
+    return ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+def metric_series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Metrics:
+    """
+    Prometheus counters and histograms. Each worker process counts its own
+    and writes them to metrics.<pid>.json in DASHBOARD_CACHE_DIR; /metrics
+    adds up the files of every live worker, so a scrape shows the whole
+    host whichever worker it lands on.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.counters = {}    # 'name|labels' -> value
+        self.histograms = {}  # 'name|labels' -> [count per bucket..., +Inf count, sum]
+        self.last_flush = 0.0
+
+    def inc(self, name, amount=1, **labels):
+        key = f"{name}|{metric_labels(labels)}"
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        bounds = HISTOGRAMS[name]
+        key = f"{name}|{metric_labels(labels)}"
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(bounds) + 1) + [0.0]
+            h[bisect.bisect_left(bounds, value)] += 1
+            h[-1] += value
+
+    @contextmanager
+    def firebase_call(self, call):
+        """Counts and times one upstream Firebase request."""
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            self.observe('dashboard_firebase_call_duration_seconds', time.perf_counter() - start, call=call)
+            self.inc('dashboard_firebase_calls_total', call=call, outcome=outcome)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < METRICS_FLUSH_SECONDS:
+            return
+        self.last_flush = now
+        with self.lock:
+            snapshot = json.dumps({'counters': self.counters, 'histograms': self.histograms})
+        path = os.path.join(self.directory, f"metrics.{os.getpid()}.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """(counters, histograms) summed over every live worker; files left by dead workers are removed."""
+        self.flush(force=True)
+        if fcntl is None:
+            # Not POSIX: no shared cache directory between processes, report this one only
+            with self.lock:
+                return dict(self.counters), {k: list(v) for k, v in self.histograms.items()}
+        counters, histograms = {}, {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics.*.json')):
+            try:
+                pid = int(os.path.basename(path).split('.')[1])
+                if pid != os.getpid() and not pid_alive(pid):
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for key, value in snapshot['counters'].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, h in snapshot['histograms'].items():
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, value in enumerate(h):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """The Prometheus text exposition format."""
+        counters, histograms = self.collect()
+        lines, typed = [], set()
+        for key in sorted(counters):
+            name, labels = key.split('|', 1)
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{metric_series(name, labels)} {counters[key]}")
+        for key in sorted(histograms):
+            name, labels = key.split('|', 1)
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            h = histograms[key]
+            sep = ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(HISTOGRAMS[name] + ('+Inf',), h[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{{{labels}{sep}le=\"{bound}\"}} {cumulative}")
+            lines.append(f"{metric_series(name + '_sum', labels)} {h[-1]}")
+            lines.append(f"{metric_series(name + '_count', labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(DASHBOARD_CACHE_DIR)
+
 # --- HELPER FUNCTIONS ---
-def get_safe_sales_data():
-    """Fetches ALL sales and ensures it is a dictionary."""
+def normalize_sales(sales_data):
+    """Firebase returns a list when keys look like indices; always hand back a dict."""
+    if sales_data is None: return {}
+    if isinstance(sales_data, list):
+        return {str(i): item for i, item in enumerate(sales_data) if item is not None}
+    return sales_data
+
+def get_sales_since_day(day):
+    """Fetches sales whose `epoch_day` is on or after `day` (an integer day key), or None if the read fails.
+    Needs ".indexOn": ["epoch_day", "timestamp"] on /sales in the database rules."""
+    if not firebase_initialized: return {}
+    try:
+        ref = db.reference('/sales')
+        with metrics.firebase_call('sales_since_day'):
+            data = ref.order_by_child('epoch_day').start_at(day).get()
+        return normalize_sales(data)
+    except Exception as e:
+        print(f"❌ Error in get_sales_since_day: {e}")
+        return None
+
+def get_sales_page(start_key=None, limit=None, end_key=None):
+    """
+    Sales in key order from `start_key` to `end_key` (both inclusive, either
+    open-ended if None), at most `limit` of them. For the migrations: a
+    failed read raises rather than passing for an empty history.
+    """
+    ref = db.reference('/sales').order_by_key()
+    if start_key is not None: ref = ref.start_at(start_key)
+    if end_key is not None: ref = ref.end_at(end_key)
+    if limit is not None: ref = ref.limit_to_first(limit)
+    with metrics.firebase_call('sales_page'):
+        return normalize_sales(ref.get())
+
+def iter_sales_pages():
+    """Walks all of /sales in key order, MIGRATION_BATCH sales per read, yielding each page."""
+    start = None
+    while True:
+        # After the first page, start_at repeats the last key seen, so read one more and drop it
+        page = get_sales_page(start, MIGRATION_BATCH + (start is not None))
+        if start is not None:
+            page.pop(start, None)
+        if not page:
+            return
+        yield page
+        start = max(page, key=sale_key_order)
+
+def get_latest_sales(limit):
+    """Fetches the last `limit` sales pushed."""
     if not firebase_initialized: return {}
     try:
         ref = db.reference('/sales')
-        sales_data = ref.get()
-        if sales_data is None: return {}
-        if isinstance(sales_data, list):
-            return {str(i): item for i, item in enumerate(sales_data) if item is not None}
-        return sales_data
+        with metrics.firebase_call('latest_sales'):
+            data = ref.order_by_key().limit_to_last(limit).get()
+        return normalize_sales(data)
+    except Exception as e:
+        print(f"❌ Error in get_latest_sales: {e}")
+        return {}
+
+def get_all_time_rollup():
+    """Reads the running totals the POS maintains at /rollups/all_time."""
+    if not firebase_initialized: return {}
+    try:
+        with metrics.firebase_call('all_time_rollup'):
+            return db.reference('/rollups/all_time').get() or {}
     except Exception as e:
-        print(f"❌ Error in get_safe_sales_data: {e}")
+        print(f"❌ Error in get_all_time_rollup: {e}")
         return {}
 
-def parse_date(date_str):
-    """Robust date parser handling POS format and ISO format."""
+# The rollup readers below return None, not {}, when the read fails, so a
+# refresh keeps what it had instead of blanking the charts.
+def get_daily_rollups(since):
+    """Reads /rollups/daily from day `since` ('YYYY-MM-DD') on. Day keys sort by date, so no index is needed."""
+    if not firebase_initialized: return {}
+    try:
+        with metrics.firebase_call('daily_rollups'):
+            return db.reference('/rollups/daily').order_by_key().start_at(since).get() or {}
+    except Exception as e:
+        print(f"❌ Error in get_daily_rollups: {e}")
+        return None
+
+def get_hourly_rollups(since):
+    """Reads the per-hour, per-method cells of every day from `since` ('YYYY-MM-DD') on."""
+    if not firebase_initialized: return {}
+    try:
+        with metrics.firebase_call('hourly_rollups'):
+            return db.reference('/rollups/hourly').order_by_key().start_at(since).get() or {}
+    except Exception as e:
+        print(f"❌ Error in get_hourly_rollups: {e}")
+        return None
+
+def get_hourly_rollup(day):
+    """Reads the per-hour, per-method cells of one day ('YYYY-MM-DD')."""
+    if not firebase_initialized: return {}
+    try:
+        with metrics.firebase_call('hourly_rollup'):
+            return db.reference(f'/rollups/hourly/{day}').get() or {}
+    except Exception as e:
+        print(f"❌ Error in get_hourly_rollup: {e}")
+        return None
+
+def sale_key_order(key):
+    """Sort key matching Firebase's $key ordering (integer-like keys first)."""
+    return (0, int(key), '') if key.isdigit() else (1, 0, key)
+
+# Older POS builds posted `amount`/`method`/`date` instead of the current field names
+def sale_amount(sale):
+    try:
+        return float(sale.get('total_amount', sale.get('amount', 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+def sale_method(sale):
+    return sale.get('payment_method') or sale.get('method') or 'Unknown'
+
+def sale_profit(sale):
+    try:
+        return float(sale.get('profit', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def sale_epoch_ts(sale):
+    """
+    Integer `ts` of a sale (see timekeys.py). Only records written before the
+    POS sent `ts` need their timestamp string parsed, or failing that their
+    `day` taken as midnight.
+    """
+    if isinstance(sale.get('ts'), (int, float)):
+        return int(sale['ts'])
+    dt_obj = parse_sale_time(sale.get('timestamp') or sale.get('sale_date') or sale.get('date') or sale.get('day'))
+    return local_epoch(dt_obj) if dt_obj else None
+
+def sale_epoch_day(sale):
+    if isinstance(sale.get('epoch_day'), int):
+        return sale['epoch_day']
+    ts = sale_epoch_ts(sale)
+    return ts // SECONDS_PER_DAY if ts is not None else None
+
+def sale_day(sale):
+    """'YYYY-MM-DD' of a sale, as used in the /rollups/daily paths."""
+    if sale.get('day'):
+        return sale['day']
+    day = sale_epoch_day(sale)
+    return day_from_epoch(day).isoformat() if day is not None else None
+
+def increment(amount):
+    return {'.sv': {'increment': amount}}
+
+# A migration claim older than this is assumed to have died with its worker
+MIGRATION_CLAIM_SECONDS = 600
+MIGRATION_OWNER = uuid.uuid4().hex
+# Sales read, stamped and counted per multi-path update
+MIGRATION_BATCH = 500
+# Threads of one worker share its claim, so they take turns
+migration_lock = threading.Lock()
+
+class MigrationTaken(Exception):
+    """Raised inside the claim transaction to abort it without writing."""
+    def __init__(self, state='busy'):
+        super().__init__(state)
+        self.state = state
+
+def claim_migration(marker):
+    """
+    Claims, or renews this process's claim on, the one-time migration
+    recorded at /rollups/meta/{marker}, in a transaction, so only one worker
+    on any host runs it. The marker holds the claim while the migration runs
+    and True once it is done. Returns 'claimed' if this process now owns the
+    work, 'done' if it is finished, or 'busy' while another worker's claim
+    is live.
+    """
+    def claim(current):
+        if current is True:
+            raise MigrationTaken('done')
+        if isinstance(current, dict) and current.get('owner') != MIGRATION_OWNER:
+            if time.time() * 1000 - current.get('claimed_at', 0) < MIGRATION_CLAIM_SECONDS * 1000:
+                raise MigrationTaken()
+        return {'owner': MIGRATION_OWNER, 'claimed_at': int(time.time() * 1000)}
+
+    with metrics.firebase_call('migration_claim'):
+        try:
+            db.reference(f'/rollups/meta/{marker}').transaction(claim)
+            return 'claimed'
+        except MigrationTaken as taken:
+            return taken.state
+
+def release_migration(marker):
+    """Expires this process's claim after a failed run, so any worker can retry it at once."""
+    def release(current):
+        if not (isinstance(current, dict) and current.get('owner') == MIGRATION_OWNER):
+            raise MigrationTaken()
+        return dict(current, claimed_at=0)  # transactions can't delete the node
+
     try:
-        # Try POS format first (YYYY-MM-DD HH:MM:SS)
-        return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-    except:
+        with metrics.firebase_call('migration_claim'):
+            db.reference(f'/rollups/meta/{marker}').transaction(release)
+    except Exception:
+        pass  # The claim then simply expires
+
+def write_migration_batch(marker, updates):
+    """
+    Renews the claim, then applies one batch of a migration as a multi-path
+    update. Raises MigrationTaken if the claim lapsed and another worker took
+    the work over, so the two never count the same sales.
+    """
+    if claim_migration(marker) != 'claimed':
+        raise MigrationTaken()
+    with metrics.firebase_call('migration_update'):
+        db.reference('/').update(updates)
+
+def remove_stubs(stamped, fields):
+    """
+    A batch's stamps land on sales that may have been deleted since they were
+    read, leaving records with nothing else in them. Re-reads the `stamped`
+    keys' range and deletes any record holding only `fields`.
+    """
+    if not stamped: return
+    current = get_sales_page(min(stamped, key=sale_key_order), end_key=max(stamped, key=sale_key_order))
+    stubs = {f'sales/{key}': None for key in stamped
+             if isinstance(current.get(key), dict) and set(current[key]) <= fields}
+    if stubs:
+        with metrics.firebase_call('migration_update'):
+            db.reference('/').update(stubs)
+
+def run_migration(marker, work):
+    """
+    Runs work(marker) as the one-time migration recorded at
+    /rollups/meta/{marker} if this process can claim it, then sets the
+    marker to True. work writes its batches with write_migration_batch. If
+    it fails, e.g. on a read timeout, the claim is released and the marker
+    left unset, so the work is retried rather than recorded as done.
+    Returns True once the migration is done, by this worker or another.
+    """
+    if not firebase_initialized: return True
+    with migration_lock:
+        try:
+            state = claim_migration(marker)
+            if state != 'claimed':
+                return state == 'done'
+            work(marker)
+            write_migration_batch(marker, {f'rollups/meta/{marker}': True})
+            return True
+        except Exception as e:
+            print(f"❌ Error in migration {marker}: {e}")
+            release_migration(marker)
+            return False
+
+def bootstrap_rollups():
+    """
+    One-time migration for sales written before the POS kept rollups: stamps
+    each legacy sale with its `day` and adds it to /rollups in the same
+    multi-path update, a page of /sales at a time, so a re-run never counts
+    a sale twice. See run_migration.
+    """
+    return run_migration('bootstrapped', count_legacy_sales)
+
+def count_legacy_sales(marker):
+    print("⏳ Building sales rollups from existing history...")
+    counted = 0
+    for page in iter_sales_pages():
+        updates = {}
+        totals = {'total_amount': 0.0, 'transactions': 0, 'methods': {}, 'daily': {}}
+        for key, sale in page.items():
+            if not isinstance(sale, dict) or sale.get('day'):
+                continue
+            amt = sale_amount(sale)
+            pm = sale_method(sale)
+            d_str = sale_day(sale) or '0000-00-00'
+            updates[f'sales/{key}/day'] = d_str
+            totals['total_amount'] += amt
+            totals['transactions'] += 1
+            totals['methods'][pm] = totals['methods'].get(pm, 0) + 1
+            day = totals['daily'].setdefault(d_str, {'total_amount': 0.0, 'transactions': 0})
+            day['total_amount'] += amt
+            day['transactions'] += 1
+        if not updates:
+            continue
+
+        stamped = [path.split('/')[1] for path in updates]
+        updates['rollups/all_time/total_amount'] = increment(totals['total_amount'])
+        updates['rollups/all_time/transactions'] = increment(totals['transactions'])
+        for pm, count in totals['methods'].items():
+            updates[f'rollups/all_time/methods/{pm}'] = increment(count)
+        for d_str, day in totals['daily'].items():
+            updates[f'rollups/daily/{d_str}/total_amount'] = increment(day['total_amount'])
+            updates[f'rollups/daily/{d_str}/transactions'] = increment(day['transactions'])
+        write_migration_batch(marker, updates)
+        remove_stubs(stamped, {'day'})
+        counted += totals['transactions']
+    print(f"✅ Rollups built ({counted} legacy sales).")
+
+def backfill_sale_epochs():
+    """
+    One-time migration for sales written before the POS sent integer time
+    keys: stamps each with `ts` and `epoch_day`, a page of /sales per
+    multi-path update. Sales whose time can't be read are left out of
+    the chart window rather than guessed. See run_migration.
+    """
+    return run_migration('epochs_backfilled', stamp_sale_epochs)
+
+def stamp_sale_epochs(marker):
+    print("⏳ Adding integer time keys to existing sales...")
+    stamped = 0
+    for page in iter_sales_pages():
+        updates = {}
+        for key, sale in page.items():
+            if not isinstance(sale, dict) or isinstance(sale.get('epoch_day'), int):
+                continue
+            ts = sale_epoch_ts(sale)
+            if ts is None:
+                continue
+            updates[f'sales/{key}/ts'] = ts
+            updates[f'sales/{key}/epoch_day'] = ts // SECONDS_PER_DAY
+        if updates:
+            write_migration_batch(marker, updates)
+            keys = list({path.split('/')[1] for path in updates})
+            remove_stubs(keys, {'ts', 'epoch_day'})
+            stamped += len(keys)
+    print(f"✅ Time keys added ({stamped} sales).")
+
+def backfill_hourly_rollups():
+    """
+    One-time migration for sales in the chart window that their till did
+    not count into /rollups/hourly (posted before ROLLUP_VERSION): adds
+    each to its hour's cell, bumps its day's revision and stamps it with
+    `rollup_version`, all in the same multi-path update, MIGRATION_BATCH
+    sales at a time, so a re-run never counts a sale twice. Older sales
+    never enter the window again and are left alone. See run_migration.
+    """
+    return run_migration('hourly_backfilled', count_hourly_sales)
+
+def count_hourly_sales(marker):
+    print("⏳ Adding existing sales to the hourly rollups...")
+    since = analytics.window_start(epoch_day(datetime.now()))
+    batch, counted = [], 0
+    sales = get_sales_since_day(since)
+    if sales is None:
+        raise RuntimeError("could not read the sales in the chart window")
+    for key in sorted(sales, key=sale_key_order):
+        sale = sales[key]
+        if not isinstance(sale, dict) or (sale.get('rollup_version') or 0) >= ROLLUP_VERSION:
+            continue
+        ts = sale_epoch_ts(sale)
+        if ts is None:
+            continue
+        batch.append((key, ts, sale))
+        if len(batch) >= MIGRATION_BATCH:
+            counted += add_to_hourly_rollups(marker, batch)
+            batch = []
+    counted += add_to_hourly_rollups(marker, batch)
+    print(f"✅ Hourly rollups built ({counted} sales).")
+
+def add_to_hourly_rollups(marker, batch):
+    """Counts (key, ts, sale) into the hourly cells and stamps each sale, in one update."""
+    updates = {}
+    cells, days = {}, {}
+    for key, ts, sale in batch:
+        cell = cells.setdefault(hourly_cell(ts, sale_method(sale)), [0.0, 0.0, 0])
+        cell[0] += sale_amount(sale)
+        cell[1] += sale_profit(sale)
+        cell[2] += 1
+        day = day_from_epoch(ts // SECONDS_PER_DAY).isoformat()
+        days[day] = days.get(day, 0) + 1
+        updates[f'sales/{key}/rollup_version'] = ROLLUP_VERSION
+    for path, (amount, profit, count) in cells.items():
+        updates[f'rollups/{path}/total_amount'] = increment(amount)
+        updates[f'rollups/{path}/profit'] = increment(profit)
+        updates[f'rollups/{path}/transactions'] = increment(count)
+    for day, count in days.items():
+        updates[f'rollups/daily/{day}/revision'] = increment(count)
+    if updates:
+        write_migration_batch(marker, updates)
+        remove_stubs([key for key, _, _ in batch], {'rollup_version'})
+    return len(batch)
+
+# --- AGGREGATE CACHE ---
+# Polls from several browser tabs inside this window share one refresh.
+CACHE_REFRESH_SECONDS = 2
+RECENT_SALES_LIMIT = 20
+CHART_DAYS = 7
+# More changed days than this are re-read with one range query rather than one read each
+HOURLY_RANGE_READ_DAYS = 7
+
+def hourly_rows(day, cells):
+    """SalesColumns rows (ts, amount, profit, method, count) for one day ('YYYY-MM-DD') of /rollups/hourly."""
+    start = epoch_day(date.fromisoformat(day)) * SECONDS_PER_DAY
+    for hour, methods in cells.items():
+        if not isinstance(methods, dict): continue
+        for method, cell in methods.items():
+            count = int(cell.get('transactions', 0)) if isinstance(cell, dict) else 0
+            if count > 0:
+                yield (start + int(hour[1:]) * 3600, float(cell.get('total_amount', 0)),
+                       float(cell.get('profit', 0)), method, count)
+
+class SalesAggregate:
+    """
+    Materialized dashboard state, built only from what the POS maintains
+    under /rollups and never from raw sales, so a deleted sale drops out as
+    soon as its till's decrements land. All-time totals and payment-method
+    counts come from /rollups/all_time and day totals from /rollups/daily.
+    The charts come from /rollups/hourly (revenue, profit and transactions
+    per day, hour and payment method), loaded into a columnar store one
+    row per cell and summarized once per version. Each day's cells are kept
+    with the `revision` its /rollups/daily entry had when they were read,
+    and a refresh re-reads only the days whose revision has moved since,
+    normally just today. The payload built from them is shared by every request.
+
+    The cells are also saved to hourly.json in the shared cache directory,
+    and a refresh first picks up whatever another worker saved there. A
+    worker that starts, or takes over the rebuild from another, therefore
+    only downloads the days that changed since anyone last looked, not
+    the whole window.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.hourly_path = os.path.join(directory, 'hourly.json')
+        self.hourly_mtime = None  # mtime_ns of hourly.json when last read or written
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.migrated = False    # one-time migrations all done
+        self.last_refresh = 0.0
+        self.all_time = {}       # /rollups/all_time
+        self.daily = {}          # /rollups/daily over the analytics window
+        self.hourly = {}         # day -> (revision, /rollups/hourly/{day})
+        self.columns = analytics.SalesColumns()
+        self.summary_cache = None  # ((version, today), analytics summary)
+        self.recent = []         # table rows for the latest sales, newest first
+        self.version = 0         # bumped whenever the rollups change
+        self.payload_cache = None  # (etag, json body) for /api/dashboard
+
+    @staticmethod
+    def recent_row(sale):
+        return {
+            'id': sale.get('sale_id', 'N/A'),
+            'amount': sale_amount(sale),
+            'method': sale_method(sale),
+            'timestamp': sale.get('timestamp') or sale.get('date', ''),
+            'items': len(sale.get('items', []))
+        }
+
+    def refresh(self, force=False):
+        """Re-reads the rollups and latest sales, downloading hourly cells only for the days that changed."""
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.loaded and now - self.last_refresh < CACHE_REFRESH_SECONDS:
+                return
+            self.last_refresh = now
+            if not self.migrated:
+                # In order, as each relies on the last; a failed one is retried on the next refresh
+                self.migrated = bootstrap_rollups() and backfill_sale_epochs() and backfill_hourly_rollups()
+
+            since = day_from_epoch(analytics.window_start(epoch_day(datetime.now()))).isoformat()
+            daily = get_daily_rollups(since)
+            changed = False
+            if daily is not None:
+                changed = self.update_hourly(daily, since)
+                if daily != self.daily:
+                    self.daily = daily
+                    changed = True
+
+            latest = get_latest_sales(RECENT_SALES_LIMIT)
+            recent = [self.recent_row(latest[key]) for key in sorted(latest, key=sale_key_order, reverse=True)
+                      if isinstance(latest[key], dict)]
+            all_time = get_all_time_rollup()
+            if (all_time, recent) != (self.all_time, self.recent):
+                self.all_time, self.recent = all_time, recent
+                changed = True
+            if changed:
+                self.version += 1
+            self.loaded = self.loaded or firebase_initialized
+
+    def load_hourly(self):
+        """Takes the cells from hourly.json if another worker saved them since. True if they were replaced."""
+        try:
+            mtime = os.stat(self.hourly_path).st_mtime_ns
+            if mtime == self.hourly_mtime:
+                return False
+            with open(self.hourly_path, encoding='utf-8') as f:
+                hourly = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.hourly = {day: tuple(entry) for day, entry in hourly.items()}
+        self.hourly_mtime = mtime
+        return True
+
+    def save_hourly(self):
+        tmp = f"{self.hourly_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.hourly, f)
+        os.replace(tmp, self.hourly_path)
+        self.hourly_mtime = os.stat(self.hourly_path).st_mtime_ns
+
+    def update_hourly(self, daily, since):
+        """Re-reads the cells of days whose revision moved and drops days that left the window. True if any changed."""
+        reloaded = self.load_hourly()
+        revisions = {day: totals.get('revision') if isinstance(totals, dict) else None for day, totals in daily.items()}
+        stale = [day for day, rev in revisions.items() if day not in self.hourly or self.hourly[day][0] != rev]
+        gone = [day for day in self.hourly if day not in revisions]
+        fetched = {}
+        if len(stale) > HOURLY_RANGE_READ_DAYS:
+            cells = get_hourly_rollups(since)
+            if cells is not None:
+                fetched = {day: cells.get(day) or {} for day in stale}
+        else:
+            for day in stale:
+                cells = get_hourly_rollup(day)
+                if cells is not None:
+                    fetched[day] = cells
+        if not (gone or fetched or reloaded):
+            return False
+        for day in gone:
+            del self.hourly[day]
+        for day, cells in fetched.items():
+            self.hourly[day] = (revisions[day], cells)
+        if gone or fetched:
+            try:
+                self.save_hourly()
+            except OSError as e:
+                print(f"❌ Error saving hourly cells: {e}")
+        self.columns = analytics.SalesColumns()
+        for day in sorted(self.hourly):
+            self.columns.extend(hourly_rows(day, self.hourly[day][1]))
+        return True
+
+    def summary(self):
+        """analytics summary of the window, computed at most once per version and day."""
+        key = (self.version, epoch_day(datetime.now()))
+        with self.lock:
+            cached = self.summary_cache
+            if cached and cached[0] == key:
+                return cached[1]
+            started = time.perf_counter()
+            summary = self.columns.summarize(key[1])
+            metrics.observe('dashboard_analytics_seconds', time.perf_counter() - started)
+            self.summary_cache = (key, summary)
+            return summary
+
+    def day_total(self, day):
+        return round(float((self.daily.get(day_from_epoch(day).isoformat()) or {}).get('total_amount', 0)), 2)
+
+    def snapshot_stats(self):
+        with self.lock:
+            return {
+                'total_sales': round(float(self.all_time.get('total_amount', 0)), 2),
+                'total_transactions': int(self.all_time.get('transactions', 0)),
+                'today_sales': self.day_total(epoch_day(datetime.now()))
+            }
+
+    def snapshot_charts(self):
+        today = epoch_day(datetime.now())
+        last_7_days = range(today - (CHART_DAYS - 1), today + 1)
+        summary = self.summary()
+        with self.lock:
+            methods = self.all_time.get('methods') or {}
+            weekly = [self.day_total(d) for d in last_7_days]
+        return dict(summary, **{
+            'payment_methods': {
+                'labels': list(methods.keys()),
+                'data': list(methods.values())
+            },
+            'weekly_sales': {
+                'labels': [day_from_epoch(d).strftime('%a %d') for d in last_7_days],
+                'data': weekly
+            }
+        })
+
+    def etag(self):
+        # The date is part of the tag so "today" rolls over at midnight even without new sales
+        return f"{self.version}-{datetime.now().strftime('%Y%m%d')}"
+
+    def dashboard_payload(self, etag):
+        """Returns the serialized /api/dashboard body, built at most once per ETag."""
+        cached = self.payload_cache
+        if cached and cached[0] == etag:
+            return cached[1]
+        with self.lock:
+            recent = self.recent
+        body = json.dumps({
+            'stats': self.snapshot_stats(),
+            'charts': self.snapshot_charts(),
+            'sales': recent
+        })
+        self.payload_cache = (etag, body)
+        return body
+
+sales_aggregate = SalesAggregate(DASHBOARD_CACHE_DIR)
+
+# --- SHARED PAYLOAD CACHE ---
+LOCK_POLL_SECONDS = 0.01
+
+class SharedPayloadCache:
+    """
+    The serialized /api/dashboard payload, shared by all worker processes
+    through a file, so adding workers adds throughput without multiplying
+    Firebase reads. When the file is older than `max_age`, one worker takes
+    an exclusive flock and rebuilds it; the others keep serving the previous
+    payload meanwhile. The new payload is written to a temp file and renamed
+    into place, so readers never see half of one. The ETag is a hash of the
+    body, so every worker hands out the same tag for the same data.
+    """
+    def __init__(self, directory, max_age):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'dashboard.json')
+        self.lock_path = os.path.join(directory, 'dashboard.lock')
+        self.max_age = max_age
+        self.local_lock = threading.Lock()  # one rebuilding thread per process
+        self.entry = None   # (mtime_ns, etag, body) last read from the file
+        self.parsed = None  # (etag, dict) for the JSON endpoints
+
+    def read(self):
         try:
-            # Try ISO format (YYYY-MM-DDTHH:MM:SS...)
-            return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        except:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
             return None
+        if self.entry and self.entry[0] == mtime:
+            return self.entry
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                etag, body = f.read().split('\n', 1)
+        except (OSError, ValueError):
+            return None
+        self.entry = (mtime, etag, body)
+        return self.entry
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry[0] / 1e9 < self.max_age
+
+    def write(self, body):
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f"{etag}\n{body}")
+        os.replace(tmp, self.path)
+        return self.read()
+
+    def try_flock(self, lock_file, blocking):
+        """Polls for the lock rather than blocking in flock(), so a gevent worker keeps serving meanwhile."""
+        if fcntl is None: return True
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if not blocking: return False
+                time.sleep(LOCK_POLL_SECONDS)
+
+    def get(self, build, force=False):
+        """
+        Returns (etag, body), calling build() -> body first if the payload is
+        stale. force=True rebuilds unless another worker did so meanwhile,
+        waiting for it rather than returning the old payload.
+        """
+        entry = self.read()
+        if not force and self.is_fresh(entry):
+            metrics.inc('dashboard_cache_requests_total', result='hit')
+            return entry[1], entry[2]
+
+        blocking = force or entry is None
+        if not self.local_lock.acquire(blocking=blocking):
+            metrics.inc('dashboard_cache_requests_total', result='stale')
+            return entry[1], entry[2]
+        try:
+            with open(self.lock_path, 'a') as lock_file:
+                if not self.try_flock(lock_file, blocking):
+                    metrics.inc('dashboard_cache_requests_total', result='stale')
+                    return entry[1], entry[2]
+                try:
+                    # Someone else may have rebuilt it while we waited for the lock
+                    latest = self.read()
+                    if self.is_fresh(latest) and (entry is None or latest[0] != entry[0] or not force):
+                        metrics.inc('dashboard_cache_requests_total', result='shared')
+                        return latest[1], latest[2]
+                    body = build()
+                    metrics.inc('dashboard_cache_requests_total', result='rebuild')
+                    metrics.observe('dashboard_cache_payload_bytes', len(body))
+                    latest = self.write(body)
+                    return latest[1], latest[2]
+                finally:
+                    if fcntl: fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self.local_lock.release()
+
+    def get_data(self, build):
+        """The payload as a dict, parsed once per ETag."""
+        etag, body = self.get(build)
+        parsed = self.parsed
+        if parsed is None or parsed[0] != etag:
+            parsed = self.parsed = (etag, json.loads(body))
+        return parsed[1]
+
+def build_dashboard_payload():
+    sales_aggregate.refresh(force=True)
+    return sales_aggregate.dashboard_payload(sales_aggregate.etag())
+
+dashboard_cache = SharedPayloadCache(DASHBOARD_CACHE_DIR, CACHE_REFRESH_SECONDS)
+
+# --- LIVE UPDATES (SSE) ---
+SSE_HEARTBEAT_SECONDS = 15
+# Without a Firebase listener (offline / listen() failed) the cache is polled this often instead
+SSE_FALLBACK_POLL_SECONDS = 1
+SSE_QUEUE_SIZE = 4
+
+class DashboardBroadcaster:
+    """
+    Fans one upstream change feed out to every connected browser. A single
+    Firebase listener on the all-time rollup (which every sale increments)
+    only wakes the publisher; the publisher takes the payload from the
+    shared cache and hands the same serialized body to each subscriber
+    queue, so subscriber count does not multiply upstream reads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.wakeup = threading.Event()
+        self.started = False
+        self.listening = False
+        self.latest = None  # (etag, body) most recently published
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(q)
+            if not self.started:
+                self.started = True
+                self.start_listener()
+                threading.Thread(target=self.publish_loop, daemon=True).start()
+        if self.latest:
+            q.put_nowait(self.latest)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def publish(self, message):
+        self.latest = message
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Slow browser: drop its oldest update, it only needs the newest state
+                try:
+                    q.get_nowait()
+                    q.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def start_listener(self):
+        if not firebase_initialized: return
+        try:
+            db.reference('/rollups/all_time').listen(lambda event: self.wakeup.set())
+            self.listening = True
+            print("✅ Listening for sales changes.")
+        except Exception as e:
+            print(f"❌ Error starting sales listener: {e}")
+
+    def publish_loop(self):
+        timeout = SSE_HEARTBEAT_SECONDS if self.listening else SSE_FALLBACK_POLL_SECONDS
+        published_etag = None
+        while True:
+            try:
+                force = self.wakeup.is_set()
+                self.wakeup.clear()
+                etag, body = dashboard_cache.get(build_dashboard_payload, force=force)
+                if etag != published_etag:
+                    self.publish((etag, body))
+                    published_etag = etag
+            except Exception as e:
+                print(f"❌ Error publishing dashboard update: {e}")
+            self.wakeup.wait(timeout)
+
+broadcaster = DashboardBroadcaster()
 
 # --- ROUTES ---
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get('profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+        response = app.response_class(out.getvalue(), mimetype='text/plain')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('dashboard_http_request_duration_seconds', time.perf_counter() - g.get('request_start', time.perf_counter()), route=route)
+    metrics.inc('dashboard_http_requests_total', route=route, method=request.method, status=response.status_code)
+    size = response.calculate_content_length()
+    if size is not None:
+        metrics.observe('dashboard_http_response_bytes', size, route=route)
+    metrics.flush()
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latency and size, upstream Firebase calls and payload cache results, for Prometheus."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def dashboard():
     return render_template('index.html')
 
+@app.route('/api/dashboard')
+def get_dashboard():
+    """Stats, charts and recent sales in one payload, with ETag revalidation."""
+    try:
+        etag, body = dashboard_cache.get(build_dashboard_payload)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        print(f"Error dashboard: {e}")
+        return jsonify({})
+
+@app.route('/api/stream')
+def stream_dashboard():
+    """Server-Sent Events feed of /api/dashboard payloads, pushed as sales arrive."""
+    def events():
+        q = broadcaster.subscribe()
+        try:
+            while True:
+                try:
+                    etag, body = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {etag}\nevent: dashboard\ndata: {body}\n\n"
+        finally:
+            broadcaster.unsubscribe(q)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/stats')
 def get_stats():
     try:
-        sales_data = get_safe_sales_data()
-        total_sales = 0.0
-        total_transactions = 0
-        today_sales = 0.0
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        for _, sale in sales_data.items():
-            # Get amount
-            try:
-                amt = float(sale.get('total_amount', 0))
-            except:
-                amt = 0.0
-
-            total_sales += amt
-            total_transactions += 1
-            
-            # Get date
-            ts = sale.get('timestamp') or sale.get('sale_date')
-            if ts:
-                dt_obj = parse_date(ts)
-                if dt_obj and dt_obj.strftime('%Y-%m-%d') == today:
-                    today_sales += amt
-
-        return jsonify({
-            'total_sales': round(total_sales, 2),
-            'total_transactions': total_transactions,
-            'today_sales': round(today_sales, 2)
-        })
+        return jsonify(dashboard_cache.get_data(build_dashboard_payload)['stats'])
     except Exception as e:
         print(f"Error stats: {e}")
         return jsonify({'total_sales': 0, 'total_transactions': 0, 'today_sales': 0})
 
 @app.route('/api/sales')
 def get_recent_sales():
-    """Fetches last 20 sales for the table."""
+    """Last RECENT_SALES_LIMIT sales for the table, newest first, from the shared payload."""
     try:
-        if not firebase_initialized: return jsonify([])
-        ref = db.reference('/sales')
-        # Limit to last 20
-        data = ref.order_by_child('timestamp').limit_to_last(20).get()
-        
-        sales = []
-        if data:
-            source = data if isinstance(data, list) else data.values()
-            for item in source:
-                if isinstance(item, dict):
-                    sales.append({
-                        'id': item.get('sale_id', 'N/A'),
-                        'amount': item.get('total_amount', 0),
-                        'method': item.get('payment_method', 'Cash'),
-                        'timestamp': item.get('timestamp', ''),
-                        'items': len(item.get('items', []))
-                    })
-        # Return reversed (newest first)
-        return jsonify(sales[::-1])
+        return jsonify(dashboard_cache.get_data(build_dashboard_payload)['sales'])
     except Exception as e:
+        print(f"Error sales: {e}")
         return jsonify([])
 
 @app.route('/api/charts')
 def get_chart_data():
     """Aggregates data for the Dashboard Charts."""
     try:
-        sales_data = get_safe_sales_data()
-        
-        # 1. Payment Method Stats
-        methods = {}
-        
-        # 2. Weekly Trends (Last 7 days)
-        today = datetime.now().date()
-        last_7_days = [(today - timedelta(days=i)) for i in range(6, -1, -1)] 
-        daily_totals = {d.strftime('%Y-%m-%d'): 0.0 for d in last_7_days}
-        
-        for _, sale in sales_data.items():
-            # Method Count
-            pm = sale.get('payment_method', 'Unknown')
-            methods[pm] = methods.get(pm, 0) + 1
-            
-            # Daily Sum
-            ts = sale.get('timestamp') or sale.get('sale_date')
-            if ts:
-                dt_obj = parse_date(ts)
-                if dt_obj:
-                    d_str = dt_obj.strftime('%Y-%m-%d')
-                    if d_str in daily_totals:
-                        try:
-                            daily_totals[d_str] += float(sale.get('total_amount', 0))
-                        except: pass
-
-        return jsonify({
-            'payment_methods': {
-                'labels': list(methods.keys()),
-                'data': list(methods.values())
-            },
-            'weekly_sales': {
-                'labels': [d.strftime('%a %d') for d in last_7_days], 
-                'data': list(daily_totals.values())
-            }
-        })
+        return jsonify(dashboard_cache.get_data(build_dashboard_payload)['charts'])
     except Exception as e:
         print(e)
         return jsonify({})